@@ -0,0 +1,295 @@
+from __future__ import annotations
+import typing as t
+import ast
+import sys
+import asyncio
+import inspect
+import operator
+from baku.cache import LRUCache
+from baku.closure import ClosureCompiler, Env
+from baku.minieval import compile_expr, Compiled, MAX_RECURSIVE_DEPTH
+from baku import vm
+
+AFn = t.Callable[[Env], t.Awaitable[t.Any]]
+# compiled child, (is_async, fn)
+Child = t.Tuple[bool, t.Callable[[Env], t.Any]]
+
+
+def has_call(node: ast.AST) -> bool:
+    return any(isinstance(x, ast.Call) for x in ast.walk(node))
+
+
+async def _evaluate_all(children: t.Sequence[Child], env: Env) -> t.List[t.Any]:
+    """evaluate the children in order, the async ones concurrently
+
+    the calls are made in the same order as the sync backends: each async child runs
+    until its first suspension, before the next sync child is evaluated. the results
+    are awaited in order, so the first error (in the order of the children) is raised,
+    and the other tasks are cancelled.
+    """
+    if sum(is_async for is_async, _ in children) < 2:
+        return [(await fn(env)) if is_async else fn(env) for is_async, fn in children]
+
+    results: t.List[t.Any] = [None] * len(children)
+    tasks: t.List[t.Tuple[int, asyncio.Future[t.Any]]] = []
+    try:
+        started = True
+        for i, (is_async, fn) in enumerate(children):
+            if is_async:
+                task = asyncio.ensure_future(fn(env))
+                # if failed, the later ones are not needed
+                task.add_done_callback(_cancel_later(tasks, len(tasks)))
+                tasks.append((i, task))
+                started = False
+            else:
+                if not started:
+                    await asyncio.sleep(0)  # the tasks run until their first suspension
+                    started = True
+                results[i] = fn(env)
+        for i, task in tasks:
+            results[i] = await task
+    finally:
+        _cancel(task for _, task in tasks)
+    return results
+
+
+def _cancel_later(
+    tasks: t.List[t.Tuple[int, asyncio.Future[t.Any]]], index: int
+) -> t.Callable[[asyncio.Future[t.Any]], None]:
+    def _callback(task: asyncio.Future[t.Any]) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            _cancel(task for _, task in tasks[index + 1 :])
+
+    return _callback
+
+
+def _cancel(tasks: t.Iterable[asyncio.Future[t.Any]]) -> None:
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # retrieved (not logged), the first one is raised
+
+
+class AsyncCompiler:
+    """compile validated expression to async closures, awaiting the results of calls
+
+    the independent calls (e.g. both sides of BinOp, the elements of Tuple, the arguments)
+    are evaluated concurrently. the sub-expressions without calls are compiled as closures.
+    """
+
+    def __init__(self, sync: t.Optional[ClosureCompiler] = None) -> None:
+        self.sync = sync or ClosureCompiler()
+
+    def compile(self, node: ast.AST) -> AFn:
+        is_async, fn = self.child(node)
+        if is_async:
+            return fn
+
+        async def _sync(env: Env) -> t.Any:
+            return fn(env)
+
+        return _sync
+
+    def child(self, node: ast.AST) -> Child:
+        if not has_call(node):
+            return (False, self.sync.compile(node))
+        method = getattr(self, "compile_" + node.__class__.__name__, None)
+        if method is None:
+            raise NotImplementedError("visit_" + node.__class__.__name__)
+        return (True, method(node))
+
+    def compile_Expression(self, node: ast.Expression) -> AFn:
+        return self.compile(node.body)
+
+    def compile_Expr(self, node: ast.Expr) -> AFn:
+        return self.compile(node.value)
+
+    def compile_BinOp(self, node: ast.BinOp) -> AFn:
+        op = self.sync.bop(node.op)
+        children = [self.child(node.left), self.child(node.right)]
+
+        async def _binop(env: Env) -> t.Any:
+            left, right = await _evaluate_all(children, env)
+            return op(left, right)
+
+        return _binop
+
+    def compile_BoolOp(self, node: ast.BoolOp) -> AFn:
+        # short-circuited, evaluated sequentially
+        self.sync.bop(node.op)  # validation
+        children = [self.child(v) for v in node.values]
+        is_and = isinstance(node.op, ast.And)
+
+        async def _boolop(env: Env) -> t.Any:
+            acc: t.Any = None
+            for i, (is_async, fn) in enumerate(children):
+                if i > 0 and (not acc if is_and else acc):
+                    return acc
+                acc = (await fn(env)) if is_async else fn(env)
+            return acc
+
+        return _boolop
+
+    def compile_Compare(self, node: ast.Compare) -> AFn:
+        assert len(node.ops) == len(node.comparators)
+        ops = [self.sync.bop(op) for op in node.ops]
+        children = [self.child(node.left)]
+        for cmpop, x in zip(node.ops, node.comparators):
+            if has_call(x):
+                children.append(self.child(x))
+            else:
+                children.append((False, self.sync._compile_comparator(cmpop, x)))
+
+        if len(ops) == 1:
+            compare = ops[0]
+
+            async def _compare(env: Env) -> t.Any:
+                left, right = await _evaluate_all(children, env)
+                return compare(left, right)
+
+            return _compare
+
+        # short-circuited, evaluated sequentially
+        async def _chained_compare(env: Env) -> t.Any:
+            is_async, fn = children[0]
+            l_val = (await fn(env)) if is_async else fn(env)
+            acc: t.Any = None
+            for op, (is_async, fn) in zip(ops, children[1:]):
+                r_val = (await fn(env)) if is_async else fn(env)
+                acc = op(l_val, r_val)
+                if not acc:
+                    return acc
+                l_val = r_val
+            return acc
+
+        return _chained_compare
+
+    def compile_Subscript(self, node: ast.Subscript) -> AFn:
+        if sys.version_info < (3, 9):
+            key = node.slice.value  # type: ignore
+        else:
+            key = node.slice
+        children = [self.child(node.value), self.child(key)]
+
+        async def _subscript(env: Env) -> t.Any:
+            value, k = await _evaluate_all(children, env)
+            return value[k]
+
+        return _subscript
+
+    def compile_Attribute(self, node: ast.Attribute) -> AFn:
+        if node.attr.startswith("_"):
+            raise AttributeError(node.attr)
+        value = self.compile(node.value)
+        get = operator.attrgetter(node.attr)
+
+        async def _attribute(env: Env) -> t.Any:
+            return get(await value(env))
+
+        return _attribute
+
+    def compile_Call(self, node: ast.Call) -> AFn:
+        names = []
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise NotImplementedError("visit_keyword")
+            names.append(keyword.arg)
+        children = [
+            self.child(x)
+            for x in [node.func, *node.args, *[k.value for k in node.keywords]]
+        ]
+        n_args = len(node.args)
+
+        async def _call(env: Env) -> t.Any:
+            fn, *values = await _evaluate_all(children, env)
+            r = fn(*values[:n_args], **dict(zip(names, values[n_args:])))
+            if inspect.isawaitable(r):
+                r = await r
+            return r
+
+        return _call
+
+    def _elements(
+        self, elts: t.Sequence[ast.AST], build: t.Callable[[t.List[t.Any]], t.Any]
+    ) -> AFn:
+        children = [self.child(x) for x in elts]
+
+        async def _elements(env: Env) -> t.Any:
+            return build(await _evaluate_all(children, env))
+
+        return _elements
+
+    def compile_Tuple(self, node: ast.Tuple) -> AFn:
+        return self._elements(node.elts, tuple)
+
+    def compile_List(self, node: ast.List) -> AFn:
+        return self._elements(node.elts, list)
+
+    def compile_Set(self, node: ast.Set) -> AFn:
+        return self._elements(node.elts, set)
+
+    def compile_Dict(self, node: ast.Dict) -> AFn:
+        if any(k is None for k in node.keys):
+            raise NotImplementedError("visit_Dict")  # {**d}
+        n = len(node.keys)
+        return self._elements(
+            [*node.keys, *node.values], lambda xs: dict(zip(xs[:n], xs[n:]))  # type: ignore
+        )
+
+
+def compile_async(node: ast.AST) -> AFn:
+    return AsyncCompiler().compile(node)
+
+
+async def _run_program(program: vm.Program, env: Env) -> t.Any:
+    """same as vm.Program.evaluate(), but awaiting the results of calls (sequentially)"""
+    gen = vm.execute(program.code, vm.EVALUATE, env)
+    try:
+        r = gen.send(None)
+        while True:
+            if inspect.isawaitable(r):
+                r = await r
+            r = gen.send(r)
+    except StopIteration as e:
+        return e.value
+    finally:
+        gen.close()
+
+
+def _compile(c: Compiled) -> AFn:
+    if has_call(c.node):
+        if vm.depth(c.node) > MAX_RECURSIVE_DEPTH:
+            # deeply nested, AsyncCompiler uses recursion
+            program = (
+                c.fn if isinstance(c.fn, vm.Program) else vm.compile_program(c.node)
+            )
+
+            async def _deep(env: Env) -> t.Any:
+                return await _run_program(program, env)
+
+            return _deep
+        return compile_async(c.node)
+    fn = c.fn  # e.g. deeply nested expression, compiled with "vm"
+
+    async def _sync(env: Env) -> t.Any:
+        return fn(env)
+
+    return _sync
+
+
+_cache: LRUCache[str, AFn] = LRUCache(maxsize=1024)
+
+
+async def async_evaluate(
+    expr: t.Union[str, Compiled], env: t.Optional[t.Dict[str, object]] = None
+) -> object:
+    """evaluate the expression, awaiting the awaitable results of calls
+
+    e.g. `svc.lookup(x) == 'ok'`, where svc.lookup() returns a coroutine
+    """
+    if isinstance(expr, str):
+        fn = _cache.get_or_create(expr, lambda code: _compile(compile_expr(code)))
+    else:
+        fn = _compile(expr)
+    return await fn(env if env is not None else {})
@@ -0,0 +1,291 @@
+from __future__ import annotations
+import typing as t
+import ast
+from types import ModuleType
+from baku.q import QEvaluator
+from baku.closure import ClosureCompiler, Fn
+from baku.minieval import Compiled, MAX_RECURSIVE_DEPTH, compile_expr
+from baku.vm import depth
+
+np: t.Optional[ModuleType]
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+Columns = t.Mapping[str, t.Sequence[t.Any]]
+
+# numpy dtype kinds vectorized (bool, int, uint, float), the other columns are str ("U")
+# or object ("O") arrays, vectorized only by the operators below
+NUMERIC_KINDS = "biuf"
+# compared by numpy (the order of str is the same as python's)
+STR_OPERATORS = ("==", "!=", "<", "<=", ">", ">=", "in", "not in")
+# evaluated by python for each element
+OBJECT_OPERATORS = ("==", "!=", "in", "not in")
+
+# the integer results (int64) must be less than this, the magnitude is checked by float
+_INT_LIMIT = float(2**62)
+
+# the vectorized evaluation falls back to row by row evaluation, on these errors
+# (FloatingPointError is raised instead of the warnings, e.g. division by zero)
+FALLBACK_ERRORS = (NotImplementedError, TypeError, OverflowError, FloatingPointError)
+
+
+def _kinds(*args: t.Any) -> str:
+    assert np is not None  # used only if numpy is installed
+    return "".join(a.dtype.kind for a in args if isinstance(a, np.ndarray))
+
+
+def _numeric(name: str, *args: t.Any) -> None:
+    if any(k not in NUMERIC_KINDS for k in _kinds(*args)):
+        raise NotImplementedError(f"{name} (vectorized, not numeric)")
+
+
+def _is_bool_array(x: t.Any) -> bool:
+    assert np is not None
+    return isinstance(x, np.ndarray) and x.dtype == np.bool_
+
+
+def _and(x: t.Any, y: t.Any) -> t.Any:
+    assert np is not None
+    if _is_bool_array(x) and _is_bool_array(y):
+        return x & y
+    if not isinstance(x, np.ndarray) and not isinstance(y, np.ndarray):
+        return x and y
+    _numeric("and", x, y)  # the truth value of str and object differ
+    # same as `x and y` for each element
+    return np.where(np.asarray(x).astype(bool), y, x)
+
+
+def _or(x: t.Any, y: t.Any) -> t.Any:
+    assert np is not None
+    if _is_bool_array(x) and _is_bool_array(y):
+        return x | y
+    if not isinstance(x, np.ndarray) and not isinstance(y, np.ndarray):
+        return x or y
+    _numeric("or", x, y)
+    return np.where(np.asarray(x).astype(bool), x, y)
+
+
+def _stripped(v: t.Any) -> bool:
+    # trailing "\0" of str is stripped by numpy
+    return isinstance(v, str) and v.endswith("\0")
+
+
+def _object(v: t.Any) -> t.Any:
+    # not converted by numpy (e.g. str is not stripped)
+    assert np is not None
+    if isinstance(v, np.ndarray):
+        return v
+    a = np.empty((), dtype=object)
+    a[()] = v
+    return a
+
+
+def _isin(x: t.Any, y: t.Any) -> t.Any:
+    assert np is not None
+    if isinstance(y, np.ndarray):
+        raise NotImplementedError("in (with column)")
+    if not isinstance(x, np.ndarray):
+        return x in y
+    if isinstance(y, (str, bytes)):
+        raise NotImplementedError("in (substring)")
+    kind = x.dtype.kind
+    if kind == "O":
+        return np.fromiter((v in y for v in x), dtype=bool, count=len(x))
+    values = list(y)
+    # the values are not coerced (e.g. `1 in ['1']` is False)
+    types = (str,) if kind == "U" else (bool, int, float)
+    if not all(type(v) in types and not _stripped(v) for v in values):
+        raise NotImplementedError("in (vectorized, mixed types)")
+    return np.isin(x, values)
+
+
+def _not_isin(x: t.Any, y: t.Any) -> t.Any:
+    r = _isin(x, y)
+    return ~r if isinstance(r, np.ndarray) else not r  # type: ignore
+
+
+def _not(x: t.Any) -> t.Any:
+    assert np is not None
+    _numeric("not", x)
+    return np.logical_not(x)
+
+
+def _elementwise(
+    name: str, op: t.Callable[[t.Any, t.Any], t.Any]
+) -> t.Callable[[t.Any, t.Any], t.Any]:
+    """op on str and object arrays (evaluated by python for each element, if object)"""
+
+    def _op(x: t.Any, y: t.Any) -> t.Any:
+        assert np is not None
+        kinds = _kinds(x, y)
+        if "O" in kinds:
+            if name not in OBJECT_OPERATORS:
+                raise NotImplementedError(f"{name} (vectorized, object)")
+            r = np.frompyfunc(op, 2, 1)(_object(x), _object(y))
+            if all(type(v) is bool for v in r):
+                r = r.astype(bool)
+            return r
+        if "U" in kinds:
+            if name not in STR_OPERATORS or _stripped(x) or _stripped(y):
+                raise NotImplementedError(f"{name} (vectorized, str)")
+        return op(x, y)
+
+    return _op
+
+
+def _checked(
+    op: t.Callable[[t.Any, t.Any], t.Any],
+) -> t.Callable[[t.Any, t.Any], t.Any]:
+    """raise OverflowError instead of wrapping around, for integer arrays
+
+    and bool arrays are treated as int (in numpy, `True + True` is True)
+    """
+
+    def _op(x: t.Any, y: t.Any) -> t.Any:
+        assert np is not None
+        if _is_bool_array(x) or isinstance(x, bool):
+            x = np.asarray(x, dtype=np.int64)
+        if _is_bool_array(y) or isinstance(y, bool):
+            y = np.asarray(y, dtype=np.int64)
+        r = op(x, y)
+        if isinstance(r, np.ndarray) and r.dtype.kind in "iu":
+            f = op(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+            if np.abs(f).max(initial=0.0) >= _INT_LIMIT:
+                raise OverflowError("integer overflow (vectorized)")
+        return r
+
+    return _op
+
+
+class VectorEvaluator(QEvaluator):
+    uop_mapping = {**QEvaluator.uop_mapping, "not": _not}
+    bop_mapping = {
+        **{name: _elementwise(name, op) for name, op in QEvaluator.bop_mapping.items()},
+        "and": _and,
+        "or": _or,
+        "in": _isin,
+        "not in": _not_isin,
+        "+": _elementwise("+", _checked(QEvaluator.bop_mapping["+"])),
+        "-": _elementwise("-", _checked(QEvaluator.bop_mapping["-"])),
+        "*": _elementwise("*", _checked(QEvaluator.bop_mapping["*"])),
+    }
+
+
+class VectorCompiler(ClosureCompiler):
+    """compile expression to closures that take columns (numpy arrays), instead of env
+
+    only elementwise operations are supported, otherwise NotImplementedError is raised
+    """
+
+    unsupported: t.ClassVar[t.Tuple[str, ...]] = ("Is", "IsNot")
+    short_circuit = False  # the truth value of an array is ambiguous
+
+    def __init__(self) -> None:
+        super().__init__(VectorEvaluator())
+
+    def bop(self, op: ast.AST) -> t.Callable[[t.Any, t.Any], t.Any]:
+        if op.__class__.__name__ in self.unsupported:
+            raise NotImplementedError(op.__class__.__name__)
+        return super().bop(op)
+
+    def compile_Subscript(self, node: ast.Subscript) -> Fn:
+        raise NotImplementedError("visit_Subscript (vectorized)")
+
+    def compile_Attribute(self, node: ast.Attribute) -> Fn:
+        raise NotImplementedError("visit_Attribute (vectorized)")
+
+    def compile_Call(self, node: ast.Call) -> Fn:
+        raise NotImplementedError("visit_Call (vectorized)")
+
+    def compile_Dict(self, node: ast.Dict) -> Fn:
+        raise NotImplementedError("visit_Dict (vectorized)")
+
+
+def _size(columns: Columns) -> int:
+    sizes = {len(col) for col in columns.values()}
+    if len(sizes) > 1:
+        raise ValueError(
+            f"all columns must have same length, {dict((k, len(v)) for k, v in columns.items())}"
+        )
+    return sizes.pop() if sizes else 0
+
+
+def evaluate_rows(c: Compiled, columns: Columns) -> t.List[t.Any]:
+    """pure python version, evaluate the expression for each row"""
+    _size(columns)
+    names = list(columns.keys())
+    fn = c.fn
+    return [fn(dict(zip(names, row))) for row in zip(*[columns[k] for k in names])]
+
+
+def _column(values: t.Sequence[t.Any]) -> t.Any:
+    assert np is not None
+    if isinstance(values, np.ndarray):
+        a = values
+    else:
+        try:
+            a = np.asarray(values)
+        except ValueError as e:  # e.g. the lists of different lengths
+            raise NotImplementedError("column (vectorized)") from e
+        if a.dtype.kind not in NUMERIC_KINDS and a.dtype != object:
+            # not coerced to str (e.g. [1, 'a'])
+            if a.dtype.kind != "U" or not all(
+                type(v) is str and not _stripped(v) for v in values
+            ):
+                a = np.empty(len(values), dtype=object)
+                a[:] = values
+    if a.ndim != 1:  # e.g. the column of lists
+        raise NotImplementedError(f"column (ndim={a.ndim}) (vectorized)")
+    if a.dtype.kind not in NUMERIC_KINDS and a.dtype.kind not in "UO":
+        raise NotImplementedError(f"column (dtype={a.dtype}) (vectorized)")
+    return a
+
+
+def evaluate_vectorized(c: Compiled, columns: Columns) -> t.Any:
+    """numpy version, raises NotImplementedError if the expression is not vectorizable
+
+    numeric and bool columns are vectorized, str and object columns only by comparisons
+    and membership tests (the semantics of numpy differ from python's). the errors that
+    python does not raise (e.g. overflow, division by zero) are raised as one of
+    FALLBACK_ERRORS.
+    """
+    if np is None:
+        raise RuntimeError("numpy is not installed (pip install baku[numpy])")
+    if depth(c.node) > MAX_RECURSIVE_DEPTH:
+        raise NotImplementedError("deeply nested (vectorized)")
+    fn = VectorCompiler().compile(c.node)
+
+    n = _size(columns)
+    arrays = {k: _column(v) for k, v in columns.items()}
+    with np.errstate(all="raise"):
+        r = fn(arrays)
+    if not isinstance(r, np.ndarray) or r.shape != (n,):
+        r = np.array(np.broadcast_to(r, (n,)))
+    return r
+
+
+def evaluate_batch(
+    expr: t.Union[str, Compiled],
+    columns: Columns,
+    *,
+    use_numpy: t.Optional[bool] = None,
+) -> t.Any:
+    """evaluate the expression over columnar data, names are bound to the columns
+
+    if numpy is available (and use_numpy is not False), the expression is vectorized
+    and numpy.ndarray is returned. if not (or the expression includes non-elementwise
+    operations, e.g. subscript, attribute access, call, or arithmetic on str columns,
+    or the vectorized evaluation raises one of FALLBACK_ERRORS), the expression is
+    evaluated row by row and list is returned.
+    """
+    c = compile_expr(expr) if isinstance(expr, str) else expr
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        try:
+            return evaluate_vectorized(c, columns)
+        except FALLBACK_ERRORS:
+            pass
+    return evaluate_rows(c, columns)
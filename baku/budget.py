@@ -0,0 +1,288 @@
+from __future__ import annotations
+import typing as t
+import ast
+import math
+import threading
+from time import perf_counter
+from baku.closure import ClosureCompiler, Env, Fn
+from baku.minieval import Compiled, MAX_RECURSIVE_DEPTH, compile_expr
+from baku.q import QEvaluator
+from baku.vm import CALL, Linearizer, Program
+from baku.vm import depth as _depth
+
+# the results of `+` and `*` are checked, if both operands are one of them
+SIZED = (str, bytes, bytearray, list, tuple)
+
+
+class Budget(t.NamedTuple):
+    """the limits of an evaluation (None is unlimited)"""
+
+    max_visits: t.Optional[int] = None  # the number of evaluated nodes
+    max_calls: t.Optional[int] = None  # the number of function calls
+    max_size: t.Optional[int] = None  # len() of the result of `+` and `*` on sequences
+    timeout: t.Optional[float] = None  # wall-clock deadline (seconds)
+
+
+class BudgetExceeded(RuntimeError):
+    """the evaluation is aborted, kind is one of "visits", "calls", "size" and "timeout" """
+
+    def __init__(self, kind: str, limit: float, code: str = "<expr>") -> None:
+        super().__init__(kind, limit)
+        self.kind = kind
+        self.limit = limit
+        self.code = code  # set by BudgetedExpression
+
+    def __str__(self) -> str:
+        return f"{self.kind} budget exceeded (limit={self.limit}) in {self.code!r}"
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        return (self.__class__, (self.kind, self.limit, self.code))
+
+
+class Cost(t.NamedTuple):
+    """the cost of an evaluation"""
+
+    visits: int
+    calls: int
+    elapsed: float  # seconds
+
+
+class CostStats:
+    """cost metrics of an expression, accumulated (thread-safe)"""
+
+    __slots__ = (
+        "evaluations",
+        "exceeded",
+        "visits",
+        "calls",
+        "elapsed",
+        "max_elapsed",
+        "_lock",
+    )
+
+    def __init__(self) -> None:
+        self.evaluations = 0
+        self.exceeded = 0  # the number of evaluations aborted by the budget
+        self.visits = 0
+        self.calls = 0
+        self.elapsed = 0.0
+        self.max_elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, cost: Cost, *, exceeded: bool = False) -> None:
+        with self._lock:
+            self.evaluations += 1
+            self.exceeded += exceeded
+            self.visits += cost.visits
+            self.calls += cost.calls
+            self.elapsed += cost.elapsed
+            if cost.elapsed > self.max_elapsed:
+                self.max_elapsed = cost.elapsed
+
+    @property
+    def mean_elapsed(self) -> float:
+        return self.elapsed / self.evaluations if self.evaluations else 0.0
+
+    def as_dict(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            return {name: getattr(self, name) for name in self.__slots__[:-1]}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} evaluations={self.evaluations} exceeded={self.exceeded} mean_elapsed={self.mean_elapsed:.6f}>"
+
+
+class Meter(t.Mapping[str, t.Any]):
+    """the state of an evaluation, passed to the closures as env"""
+
+    __slots__ = ("env", "visits", "calls", "deadline")
+
+    def __init__(self, env: Env, deadline: float = math.inf) -> None:
+        self.env = env
+        self.visits = 0
+        self.calls = 0
+        self.deadline = deadline
+
+    def __getitem__(self, name: str) -> t.Any:
+        return self.env[name]
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self.env)
+
+    def __len__(self) -> int:
+        return len(self.env)
+
+
+def _limit(n: t.Optional[int]) -> float:
+    return math.inf if n is None else n
+
+
+def sized_evaluator(max_size: int) -> QEvaluator:
+    """QEvaluator whose `+` and `*` reject too large sequences (before allocation)"""
+
+    def _add(x: t.Any, y: t.Any) -> t.Any:
+        if isinstance(x, SIZED) and isinstance(y, SIZED) and len(x) + len(y) > max_size:
+            raise BudgetExceeded("size", max_size)
+        return x + y
+
+    def _mul(x: t.Any, y: t.Any) -> t.Any:
+        if isinstance(x, int) and isinstance(y, SIZED):
+            if len(y) * x > max_size:
+                raise BudgetExceeded("size", max_size)
+        elif isinstance(y, int) and isinstance(x, SIZED):
+            if len(x) * y > max_size:
+                raise BudgetExceeded("size", max_size)
+        return x * y
+
+    evaluator = QEvaluator()
+    evaluator.bop_mapping = {**QEvaluator.bop_mapping, "+": _add, "*": _mul}
+    return evaluator
+
+
+class BudgetedCompiler(ClosureCompiler):
+    """ClosureCompiler, each closure counts the visit and checks the budget (env is Meter)"""
+
+    def __init__(self, budget: Budget) -> None:
+        super().__init__(
+            sized_evaluator(budget.max_size) if budget.max_size is not None else None
+        )
+        self.budget = budget
+
+    def compile(self, node: ast.AST) -> Fn:
+        fn = super().compile(node)
+        max_visits = _limit(self.budget.max_visits)
+
+        if self.budget.timeout is None:
+
+            def _visit(meter: Meter) -> t.Any:
+                meter.visits += 1
+                if meter.visits > max_visits:
+                    raise BudgetExceeded("visits", max_visits)
+                return fn(meter)
+
+        else:
+            timeout = self.budget.timeout
+
+            def _visit(meter: Meter) -> t.Any:
+                meter.visits += 1
+                if meter.visits > max_visits:
+                    raise BudgetExceeded("visits", max_visits)
+                if perf_counter() > meter.deadline:
+                    raise BudgetExceeded("timeout", timeout)
+                return fn(meter)
+
+        return t.cast(Fn, _visit)
+
+    def compile_Call(self, node: ast.Call) -> Fn:
+        fn = super().compile_Call(node)
+        max_calls = _limit(self.budget.max_calls)
+        timeout = self.budget.timeout
+
+        if timeout is None:
+
+            def _call(meter: Meter) -> t.Any:
+                meter.calls += 1
+                if meter.calls > max_calls:
+                    raise BudgetExceeded("calls", max_calls)
+                return fn(meter)
+
+        else:
+
+            def _call(meter: Meter) -> t.Any:
+                meter.calls += 1
+                if meter.calls > max_calls:
+                    raise BudgetExceeded("calls", max_calls)
+                r = fn(meter)
+                # the call itself cannot be interrupted, checked after it
+                if perf_counter() > meter.deadline:
+                    raise BudgetExceeded("timeout", timeout)
+                return r
+
+        return t.cast(Fn, _call)
+
+
+class BudgetedExpression:
+    """compiled expression evaluated within the budget, with cost metrics
+
+    deeply nested expressions (evaluated by baku.vm, without closures) are bounded
+    statically: the number of instructions and CALLs (the program jumps only forward),
+    and the deadline is checked after the evaluation.
+    """
+
+    __slots__ = ("compiled", "budget", "stats", "fn", "_static")
+
+    def __init__(
+        self, code_or_compiled: t.Union[str, Compiled], budget: Budget
+    ) -> None:
+        c = (
+            compile_expr(code_or_compiled)
+            if isinstance(code_or_compiled, str)
+            else code_or_compiled
+        )
+        self.compiled = c
+        self.budget = budget
+        self.stats = CostStats()
+        self._static: t.Optional[t.Tuple[int, int]] = None
+        if _depth(c.node) > MAX_RECURSIVE_DEPTH:
+            evaluator = (
+                sized_evaluator(budget.max_size)
+                if budget.max_size is not None
+                else None
+            )
+            program = Program(Linearizer(evaluator).linearize(c.node))
+            calls = sum(1 for op, _, _ in program.code if op == CALL)
+            self._static = (len(program.code), calls)
+            self.fn: Fn = program
+        else:
+            self.fn = BudgetedCompiler(budget).compile(c.node)
+
+    def evaluate(self, env: t.Optional[t.Dict[str, object]] = None) -> object:
+        return self.evaluate_with_cost(env)[0]
+
+    def evaluate_with_cost(
+        self, env: t.Optional[t.Dict[str, object]] = None
+    ) -> t.Tuple[object, Cost]:
+        budget = self.budget
+        start = perf_counter()
+        deadline = start + budget.timeout if budget.timeout is not None else math.inf
+        meter = Meter(env if env is not None else {}, deadline)
+        try:
+            if self._static is None:
+                r = self.fn(meter)
+            else:
+                r = self._run_static(meter)
+        except BudgetExceeded as e:
+            e.code = self.compiled.code
+            self.stats.record(
+                Cost(meter.visits, meter.calls, perf_counter() - start), exceeded=True
+            )
+            raise
+        cost = Cost(meter.visits, meter.calls, perf_counter() - start)
+        self.stats.record(cost)
+        return r, cost
+
+    def _run_static(self, meter: Meter) -> object:
+        assert self._static is not None
+        budget = self.budget
+        visits, calls = self._static
+        if budget.max_visits is not None and visits > budget.max_visits:
+            raise BudgetExceeded("visits", budget.max_visits)
+        if budget.max_calls is not None and calls > budget.max_calls:
+            raise BudgetExceeded("calls", budget.max_calls)
+        meter.visits, meter.calls = visits, calls  # upper bounds
+        r = self.fn(meter.env)
+        if perf_counter() > meter.deadline:
+            raise BudgetExceeded("timeout", budget.timeout)  # type: ignore
+        return r
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.compiled.code!r} {self.budget!r}>"
+
+
+def evaluate(
+    code_or_compiled: t.Union[str, Compiled],
+    env: t.Optional[t.Dict[str, object]] = None,
+    *,
+    budget: Budget,
+) -> object:
+    """evaluate once within the budget (for repeated evaluations, use BudgetedExpression)"""
+    return BudgetedExpression(code_or_compiled, budget).evaluate(env)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import typing as t
+import threading
+from collections import OrderedDict
+
+K = t.TypeVar("K")
+V = t.TypeVar("V")
+
+
+class CacheInfo(t.NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class LRUCache(t.Generic[K, V]):
+    """thread-safe LRU cache (the counters are same as functools.lru_cache's one, + evictions)"""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"maxsize must be positive, got {maxsize!r}")
+        self.maxsize = maxsize
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> t.Optional[V]:
+        with self._lock:
+            try:
+                val = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def put(self, key: K, val: V) -> V:
+        with self._lock:
+            # another thread may have created the same value, the first one wins
+            existing = self._data.get(key)
+            if existing is not None:
+                self._data.move_to_end(key)
+                return existing
+
+            self._data[key] = val
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return val
+
+    def get_or_create(self, key: K, create: t.Callable[[K], V]) -> V:
+        val = self.get(key)
+        if val is not None:
+            return val
+        # create outside of the lock, compilation can be slow
+        return self.put(key, create(key))
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                maxsize=self.maxsize,
+                currsize=len(self._data),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
@@ -0,0 +1,303 @@
+from __future__ import annotations
+import typing as t
+import sys
+import ast
+import operator
+from baku.q import QEvaluator, OPERATORS
+from baku.optimize import is_constant, constant_value
+
+Env = t.Mapping[str, t.Any]
+Fn = t.Callable[[Env], t.Any]
+
+
+class ClosureCompiler:
+    """compile validated expression to a tree of closures, each closure takes env
+
+    operators are resolved at compile time, so evaluation does not touch Q objects.
+    `and`, `or` and chained comparison are short-circuited (if short_circuit is True).
+    """
+
+    short_circuit: t.ClassVar[bool] = True
+
+    def __init__(self, evaluator: t.Optional[QEvaluator] = None) -> None:
+        self.evaluator = evaluator or QEvaluator()
+
+    def compile(self, node: ast.AST) -> Fn:
+        method = getattr(self, "compile_" + node.__class__.__name__, None)
+        if method is None:
+            raise NotImplementedError("visit_" + node.__class__.__name__)
+        return method(node)  # type: ignore
+
+    def bop(self, op: ast.AST) -> t.Callable[[t.Any, t.Any], t.Any]:
+        name = OPERATORS.get(op.__class__.__name__)
+        if name is None:
+            raise NotImplementedError(op.__class__.__name__)
+        return self.evaluator.bop_mapping[name]
+
+    def compile_Expression(self, node: ast.Expression) -> Fn:
+        return self.compile(node.body)
+
+    def compile_Expr(self, node: ast.Expr) -> Fn:
+        return self.compile(node.value)
+
+    def compile_Name(self, node: ast.Name) -> Fn:
+        name = node.id
+        if name.startswith("_"):
+
+            def _reject(env: Env) -> t.Any:
+                raise NameError(f"{name!r} is not defined (?)")
+
+            return _reject
+        return operator.itemgetter(name)
+
+    def compile_Constant(self, node: ast.Constant) -> Fn:
+        return self._value(node.value)
+
+    # for python < 3.8
+    def compile_NameConstant(self, node: ast.NameConstant) -> Fn:
+        return self._value(node.value)
+
+    # for python < 3.8
+    def compile_Num(self, node: ast.Num) -> Fn:
+        return self._value(node.n)
+
+    # for python < 3.8
+    def compile_Str(self, node: ast.Str) -> Fn:
+        return self._value(node.s)
+
+    def _value(self, value: object) -> Fn:
+        def _const(env: Env) -> t.Any:
+            return value
+
+        return _const
+
+    def compile_BinOp(self, node: ast.BinOp) -> Fn:
+        op = self.bop(node.op)
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        def _binop(env: Env) -> t.Any:
+            return op(left(env), right(env))
+
+        return _binop
+
+    def compile_BoolOp(self, node: ast.BoolOp) -> Fn:
+        op = self.bop(node.op)
+        first = self.compile(node.values[0])
+        rest = [self.compile(v) for v in node.values[1:]]
+
+        if self.short_circuit:
+            if isinstance(node.op, ast.And):
+                return _and(first, rest)
+            return _or(first, rest)
+
+        def _boolop(env: Env) -> t.Any:
+            acc = first(env)
+            for fn in rest:
+                acc = op(acc, fn(env))
+            return acc
+
+        return _boolop
+
+    def compile_Compare(self, node: ast.Compare) -> Fn:
+        assert len(node.ops) == len(node.comparators)
+        left = self.compile(node.left)
+        if len(node.ops) == 1:
+            op = self.bop(node.ops[0])
+            right = self._compile_comparator(node.ops[0], node.comparators[0])
+
+            def _compare(env: Env) -> t.Any:
+                return op(left(env), right(env))
+
+            return _compare
+
+        and_ = self.evaluator.bop_mapping["and"]
+        pairs = [
+            (self.bop(op), self.compile(x))
+            for op, x in zip(node.ops[:-1], node.comparators[:-1])
+        ]
+        pairs.append(
+            (
+                self.bop(node.ops[-1]),
+                self._compile_comparator(node.ops[-1], node.comparators[-1]),
+            )
+        )
+
+        if self.short_circuit:
+
+            def _chained_compare_short_circuit(env: Env) -> t.Any:
+                l_val = left(env)
+                acc: t.Any = None
+                for op, fn in pairs:
+                    r_val = fn(env)
+                    acc = op(l_val, r_val)
+                    if not acc:
+                        return acc
+                    l_val = r_val
+                return acc
+
+            return _chained_compare_short_circuit
+
+        def _chained_compare(env: Env) -> t.Any:
+            l_val = left(env)
+            acc: t.Any = None
+            for op, fn in pairs:
+                r_val = fn(env)
+                if acc is None:
+                    acc = op(l_val, r_val)
+                else:
+                    acc = and_(acc, op(l_val, r_val))
+                l_val = r_val
+            return acc
+
+        return _chained_compare
+
+    def _compile_comparator(self, op: ast.AST, node: ast.AST) -> Fn:
+        # `x in [1, 2]` -> `x in (1, 2)`, `x in {1, 2}` -> `x in frozenset({1, 2})`
+        if isinstance(op, (ast.In, ast.NotIn)) and isinstance(
+            node, (ast.List, ast.Set)
+        ):
+            values = self._constant_elts(node.elts)
+            if values is not None:
+                if isinstance(node, ast.List):
+                    return self._value(tuple(values))
+                try:
+                    return self._value(frozenset(values))
+                except TypeError:  # unhashable
+                    pass
+        return self.compile(node)
+
+    def _constant_elts(self, elts: t.Sequence[ast.AST]) -> t.Optional[t.List[t.Any]]:
+        if not all(is_constant(x) for x in elts):
+            return None
+        return [constant_value(x) for x in elts]
+
+    def compile_Subscript(self, node: ast.Subscript) -> Fn:
+        value = self.compile(node.value)
+        if sys.version_info < (3, 9):
+            key = self.compile(node.slice.value)  # type: ignore
+        else:
+            key = self.compile(node.slice)
+
+        def _subscript(env: Env) -> t.Any:
+            return value(env)[key(env)]
+
+        return _subscript
+
+    def compile_Attribute(self, node: ast.Attribute) -> Fn:
+        if node.attr.startswith("_"):
+            raise AttributeError(node.attr)
+        value = self.compile(node.value)
+        get = operator.attrgetter(node.attr)
+
+        def _attribute(env: Env) -> t.Any:
+            return get(value(env))
+
+        return _attribute
+
+    def compile_Call(self, node: ast.Call) -> Fn:
+        fn = self.compile(node.func)
+        args = [self.compile(x) for x in node.args]
+        kwargs = []
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise NotImplementedError("visit_keyword")
+            kwargs.append((keyword.arg, self.compile(keyword.value)))
+
+        if not kwargs:
+
+            def _call(env: Env) -> t.Any:
+                return fn(env)(*[x(env) for x in args])
+
+            return _call
+
+        def _call_with_kwargs(env: Env) -> t.Any:
+            return fn(env)(*[x(env) for x in args], **{k: x(env) for k, x in kwargs})
+
+        return _call_with_kwargs
+
+    def compile_Tuple(self, node: ast.Tuple) -> Fn:
+        values = self._constant_elts(node.elts)
+        if values is not None:
+            return self._value(tuple(values))
+
+        elts = [self.compile(x) for x in node.elts]
+
+        def _tuple(env: Env) -> t.Any:
+            return tuple([x(env) for x in elts])
+
+        return _tuple
+
+    def compile_List(self, node: ast.List) -> Fn:
+        values = self._constant_elts(node.elts)
+        if values is not None:
+            frozen = tuple(values)
+
+            def _constant_list(env: Env) -> t.Any:
+                return list(frozen)
+
+            return _constant_list
+
+        elts = [self.compile(x) for x in node.elts]
+
+        def _list(env: Env) -> t.Any:
+            return [x(env) for x in elts]
+
+        return _list
+
+    def compile_Set(self, node: ast.Set) -> Fn:
+        elts = [self.compile(x) for x in node.elts]
+
+        def _set(env: Env) -> t.Any:
+            return {x(env) for x in elts}
+
+        return _set
+
+    def compile_Dict(self, node: ast.Dict) -> Fn:
+        if any(k is None for k in node.keys):
+            raise NotImplementedError("visit_Dict")  # {**d}
+
+        keys = self._constant_elts(node.keys)  # type: ignore
+        values = self._constant_elts(node.values)
+        if keys is not None and values is not None:
+            frozen = tuple(zip(keys, values))
+
+            def _constant_dict(env: Env) -> t.Any:
+                return dict(frozen)
+
+            return _constant_dict
+
+        items = [(self.compile(k), self.compile(v)) for k, v in zip(node.keys, node.values)]  # type: ignore
+
+        def _dict(env: Env) -> t.Any:
+            return {k(env): v(env) for k, v in items}
+
+        return _dict
+
+
+def _and(first: Fn, rest: t.List[Fn]) -> Fn:
+    def _and(env: Env) -> t.Any:
+        acc = first(env)
+        for fn in rest:
+            if not acc:
+                return acc
+            acc = fn(env)
+        return acc
+
+    return _and
+
+
+def _or(first: Fn, rest: t.List[Fn]) -> Fn:
+    def _or(env: Env) -> t.Any:
+        acc = first(env)
+        for fn in rest:
+            if acc:
+                return acc
+            acc = fn(env)
+        return acc
+
+    return _or
+
+
+def compile_closure(node: ast.AST) -> Fn:
+    return ClosureCompiler().compile(node)
@@ -0,0 +1,264 @@
+from __future__ import annotations
+import typing as t
+import ast
+import threading
+from collections import Counter
+from baku.closure import ClosureCompiler, Env, Fn
+from baku.q import QEvaluator
+
+# a policy for whether the call is pure (evaluated once, if repeated)
+CallPolicy = t.Union[bool, t.Callable[[ast.Call], bool]]
+
+# only these nodes are memoized (containers are not, the result may be mutated)
+CANDIDATES = (
+    ast.Subscript,
+    ast.Attribute,
+    ast.Call,
+    ast.BinOp,
+    ast.Compare,
+    ast.BoolOp,
+)
+
+# rough cost of evaluation, per node (the other candidates are 1, and the others are 0)
+COSTS: t.Dict[t.Type[ast.AST], int] = {ast.Call: 8}
+
+# the default of min_saved_cost, e.g. a repeated `d['a']['b']` (2) is memoized
+MIN_SAVED_COST = 2
+
+_MISSING = object()
+
+
+class CSEStats:
+    __slots__ = ("subexpressions", "eliminated", "hits", "_lock")
+
+    def __init__(self, subexpressions: int = 0, eliminated: int = 0) -> None:
+        self.subexpressions = subexpressions  # the number of memoized sub-expressions
+        self.eliminated = eliminated  # the number of occurrences that is not evaluated
+        self.hits = 0  # the number of evaluations skipped at runtime (if count_hits)
+        self._lock = threading.Lock()
+
+    def add_hits(self, n: int) -> None:
+        with self._lock:
+            self.hits += n
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} subexpressions={self.subexpressions} eliminated={self.eliminated} hits={self.hits}>"
+
+
+class _Scope(dict):  # type: ignore
+    """env with memo slots, the names are looked up lazily (and kept)"""
+
+    __slots__ = ("env", "memo", "hits")
+
+    # set by new_scope (without __init__, for speed)
+    env: Env
+    memo: t.List[t.Any]
+    hits: int  # counted per scope (per evaluation), not shared between threads
+
+    def __missing__(self, name: str) -> t.Any:
+        v = self[name] = self.env[name]
+        return v
+
+
+def invalidate(scope: Env) -> None:
+    """forget the memoized values and names (after an impure call, it may mutate them)"""
+    memo = scope.memo  # type: ignore
+    memo[:] = [_MISSING] * len(memo)
+    scope.clear()  # type: ignore
+
+
+def new_scope(env: Env, size: int) -> Env:
+    """env for the memoized closures, with `size` memo slots"""
+    scope = _Scope()
+    scope.env = env
+    scope.memo = [_MISSING] * size
+    scope.hits = 0
+    return scope
+
+
+def _walk(
+    x: ast.AST,
+    pure_calls: CallPolicy,
+    keys: t.Dict[int, str],
+    costs: t.Dict[int, int],
+    counts: t.Counter[str],
+) -> bool:
+    """collect the keys of the pure candidates and the costs, returns whether x is pure"""
+    pure = True
+    cost = COSTS.get(type(x), 1) if isinstance(x, CANDIDATES) else 0
+    for child in ast.iter_child_nodes(x):
+        pure = _walk(child, pure_calls, keys, costs, counts) and pure
+        cost += costs[id(child)]
+    costs[id(x)] = cost
+    if isinstance(x, ast.Call):
+        pure = pure and (pure_calls(x) if callable(pure_calls) else pure_calls)
+    if pure and isinstance(x, CANDIDATES):
+        k = keys[id(x)] = ast.dump(x)
+        counts[k] += 1
+    return pure
+
+
+def _select(
+    nodes: t.Sequence[ast.AST], keys: t.Dict[int, str], counts: t.Counter[str]
+) -> t.Dict[int, str]:
+    """the repeated sub-expressions, not evaluated only through a memoized ancestor"""
+    # preorder, with the number of evaluations of the nearest memoized ancestor
+    selected: t.Dict[int, str] = {}
+    stack: t.List[t.Tuple[ast.AST, int]] = [(node, 0) for node in reversed(nodes)]
+    while stack:
+        x, covered = stack.pop()
+        k = keys.get(id(x))
+        # (if covered, evaluated only through the memoized ancestor)
+        if k is not None and counts[k] >= 2 and (not covered or counts[k] > covered):
+            selected[id(x)] = k
+            covered = counts[k]
+        stack.extend((child, covered) for child in ast.iter_child_nodes(x))
+    return selected
+
+
+def plan(
+    *nodes: ast.AST, pure_calls: CallPolicy = False, min_saved_cost: int = 0
+) -> t.Dict[int, int]:
+    """find repeated pure sub-expressions (across the nodes), returns id(node) -> slot
+
+    if the cost of the evaluations eliminated is less than min_saved_cost (see COSTS),
+    nothing is returned (memoization has its own cost)
+    """
+    keys: t.Dict[int, str] = {}
+    costs: t.Dict[int, int] = {}
+    counts: t.Counter[str] = Counter()
+    for node in nodes:
+        _walk(node, pure_calls, keys, costs, counts)
+    selected = _select(nodes, keys, counts)
+
+    slots: t.Dict[str, int] = {}
+    saved = 0
+    for i, k in selected.items():
+        if k in slots:
+            saved += costs[i]
+        else:
+            slots[k] = len(slots)
+    if saved < min_saved_cost:
+        return {}
+    return {i: slots[k] for i, k in selected.items()}
+
+
+class CSECompiler(ClosureCompiler):
+    """ClosureCompiler, evaluating repeated pure sub-expressions once per evaluation
+
+    e.g. `d['a']['b'] > 1 and d['a']['b'] < 10`, d['a']['b'] is evaluated once.
+    calls are treated as impure, by default (see pure_calls), the memoized values are
+    forgotten after an impure call (it may mutate them, e.g. `d['a'].update(...)`)
+
+    if the cost saved is less than min_saved_cost, compile_toplevel() memoizes nothing.
+    if count_hits is True, the memo hits are counted per evaluation, and added to
+    stats.hits after it (the hits are not counted by default, it is the hot path)
+    """
+
+    def __init__(
+        self,
+        evaluator: t.Optional[QEvaluator] = None,
+        *,
+        pure_calls: CallPolicy = False,
+        min_saved_cost: int = MIN_SAVED_COST,
+        count_hits: bool = False,
+    ) -> None:
+        super().__init__(evaluator)
+        self.pure_calls = pure_calls
+        self.min_saved_cost = min_saved_cost
+        self.count_hits = count_hits
+        self.slots: t.Dict[int, int] = {}
+        self.stats = CSEStats()
+
+    def compile(self, node: ast.AST) -> Fn:
+        fn = super().compile(node)
+        slot = self.slots.get(id(node))
+        if slot is None:
+            return fn
+        if self.count_hits:
+            return _counting_memo(fn, slot)
+
+        def _memo(env: Env) -> t.Any:
+            memo = env.memo  # type: ignore
+            v = memo[slot]
+            if v is _MISSING:
+                v = memo[slot] = fn(env)
+            return v
+
+        return _memo
+
+    def compile_Call(self, node: ast.Call) -> Fn:
+        fn = super().compile_Call(node)
+        pure_calls = self.pure_calls
+        if not self.slots or (pure_calls(node) if callable(pure_calls) else pure_calls):
+            return fn
+
+        def _impure_call(env: Env) -> t.Any:
+            try:
+                return fn(env)
+            finally:
+                invalidate(env)
+
+        return _impure_call
+
+    def compile_toplevel(self, node: ast.AST) -> Fn:
+        (body,) = self.compile_many([node], min_saved_cost=self.min_saved_cost)
+        size = self.stats.subexpressions
+        if not size:
+            return body
+        return CSEFunction(body, size, self.stats, count_hits=self.count_hits)
+
+    def compile_many(
+        self, nodes: t.Sequence[ast.AST], *, min_saved_cost: int = 0
+    ) -> t.List[Fn]:
+        """compile the nodes sharing memo slots, the closures take new_scope(env, size)"""
+        self.slots = plan(
+            *nodes, pure_calls=self.pure_calls, min_saved_cost=min_saved_cost
+        )
+        size = len(set(self.slots.values()))
+        self.stats = CSEStats(subexpressions=size, eliminated=len(self.slots) - size)
+        return [self.compile(node) for node in nodes]
+
+
+def _counting_memo(fn: Fn, slot: int) -> Fn:
+    def _memo(env: Env) -> t.Any:
+        memo = env.memo  # type: ignore
+        v = memo[slot]
+        if v is _MISSING:
+            v = memo[slot] = fn(env)
+        else:
+            env.hits += 1  # type: ignore
+        return v
+
+    return _memo
+
+
+class CSEFunction:
+    __slots__ = ("body", "size", "stats", "count_hits")
+
+    def __init__(
+        self, body: Fn, size: int, stats: CSEStats, *, count_hits: bool = False
+    ) -> None:
+        self.body = body
+        self.size = size
+        self.stats = stats
+        self.count_hits = count_hits
+
+    def __call__(self, env: Env) -> t.Any:
+        scope = new_scope(env, self.size)
+        if not self.count_hits:
+            return self.body(scope)
+        try:
+            return self.body(scope)
+        finally:
+            self.stats.add_hits(scope.hits)  # type: ignore
+
+
+def compile_cse(
+    node: ast.AST,
+    *,
+    pure_calls: CallPolicy = False,
+    min_saved_cost: int = MIN_SAVED_COST,
+) -> Fn:
+    compiler = CSECompiler(pure_calls=pure_calls, min_saved_cost=min_saved_cost)
+    return compiler.compile_toplevel(node)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import typing as t
+import ast
+import sys
+from baku.minieval import compile_expr, Compiled
+from baku.index import is_path
+from baku.optimize import constant_value
+
+Expr = t.Union[str, Compiled, ast.AST]
+
+
+class Access(t.NamedTuple):
+    """the path read by the expression, e.g. d['user'].name -> ("d", (("item", "user"), ("attr", "name")))"""
+
+    name: str
+    steps: t.Tuple[t.Tuple[str, t.Any], ...] = ()  # ("attr", name) or ("item", key)
+
+    def __str__(self) -> str:
+        parts = [self.name]
+        for kind, x in self.steps:
+            parts.append(f".{x}" if kind == "attr" else f"[{x!r}]")
+        return "".join(parts)
+
+
+def _node(expr: Expr) -> ast.AST:
+    if isinstance(expr, str):
+        return compile_expr(expr).node
+    if isinstance(expr, Compiled):
+        return expr.node
+    return expr
+
+
+def _access(node: ast.AST) -> Access:
+    steps: t.List[t.Tuple[str, t.Any]] = []
+    while not isinstance(node, ast.Name):
+        if isinstance(node, ast.Attribute):
+            steps.append(("attr", node.attr))
+            node = node.value
+        else:
+            assert isinstance(node, ast.Subscript)
+            key = node.slice.value if sys.version_info < (3, 9) else node.slice  # type: ignore
+            steps.append(("item", constant_value(key)))
+            node = node.value
+    return Access(node.id, tuple(reversed(steps)))
+
+
+def free_names(expr: Expr) -> t.FrozenSet[str]:
+    """the names read by the expression"""
+    return frozenset(x.id for x in ast.walk(_node(expr)) if isinstance(x, ast.Name))
+
+
+def accesses(expr: Expr) -> t.FrozenSet[Access]:
+    """the (longest) attribute/constant subscript paths read by the expression
+
+    e.g. `d['a']['b'] > 0 and f(d['c'])` -> {d['a']['b'], d['c'], f}
+    """
+    r: t.Set[Access] = set()
+    stack = [_node(expr)]
+    while stack:
+        x = stack.pop()
+        if is_path(x):
+            r.add(_access(x))
+        else:
+            stack.extend(ast.iter_child_nodes(x))
+    return frozenset(r)
+
+
+class LazyEnv(t.Mapping[str, t.Any]):
+    """env fetching the values on demand (and caching them)
+
+    the value is looked up from values (cache), loaders[name]() and loader(name), in order.
+    """
+
+    def __init__(
+        self,
+        loaders: t.Optional[t.Mapping[str, t.Callable[[], t.Any]]] = None,
+        *,
+        values: t.Optional[t.Mapping[str, t.Any]] = None,
+        loader: t.Optional[t.Callable[[str], t.Any]] = None,
+    ) -> None:
+        self.loaders = loaders or {}
+        self.loader = loader
+        self.cache: t.Dict[str, t.Any] = dict(values or {})
+        self.loaded: t.List[str] = []  # the names fetched by loaders (for debugging)
+
+    def __getitem__(self, name: str) -> t.Any:
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+
+        fn = self.loaders.get(name)
+        if fn is not None:
+            v = fn()
+        elif self.loader is not None:
+            v = self.loader(name)
+        else:
+            raise KeyError(name)
+        self.cache[name] = v
+        self.loaded.append(name)
+        return v
+
+    def __iter__(self) -> t.Iterator[str]:
+        # only the known names (the names loader() accepts are unknown)
+        yield from self.cache
+        yield from (k for k in self.loaders if k not in self.cache)
+
+    def __len__(self) -> int:
+        return len(self.cache) + sum(1 for k in self.loaders if k not in self.cache)
+
+    def __contains__(self, name: object) -> bool:
+        if name in self.cache or name in self.loaders:
+            return True
+        if self.loader is None or not isinstance(name, str):
+            return False
+        # same as env[name] (loaded and cached, if found)
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
@@ -0,0 +1,259 @@
+from __future__ import annotations
+import typing as t
+import ast
+import sys
+import math
+from baku.closure import Env, Fn
+from baku.optimize import is_constant, constant_value
+
+# the conditions used for indexing a rule (one of them, per rule)
+# - ("eq", path, values): `path == 'x'`, `path in ['x', 'y']`
+# - ("range", path, (lo, hi)): `0 < path <= 10`, `path > 0` (inclusive, as candidates)
+
+
+class Condition(t.NamedTuple):
+    kind: str  # "eq" or "range"
+    path: ast.AST
+    values: t.Tuple[t.Any, ...]
+
+
+def is_path(node: ast.AST) -> bool:
+    """name, or attribute/constant subscript chain (e.g. `d['kind']`, `ob.x`)"""
+    while True:
+        if isinstance(node, ast.Name):
+            return not node.id.startswith("_")
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith("_"):
+                return False
+            node = node.value
+        elif isinstance(node, ast.Subscript):
+            key = node.slice.value if sys.version_info < (3, 9) else node.slice  # type: ignore
+            if not is_constant(key):
+                return False
+            node = node.value
+        else:
+            return False
+
+
+def _hashable(values: t.Iterable[t.Any]) -> bool:
+    try:
+        for v in values:
+            hash(v)
+    except TypeError:
+        return False
+    return True
+
+
+def _is_number(v: t.Any) -> bool:
+    return isinstance(v, (int, float)) and not (isinstance(v, float) and math.isnan(v))
+
+
+_FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE}
+
+
+def _eq(left: ast.AST, right: ast.AST) -> t.Optional[Condition]:
+    """`path == value` (or `value == path`)"""
+    for path, value in [(left, right), (right, left)]:
+        if is_path(path) and is_constant(value):
+            v = constant_value(value)
+            return Condition("eq", path, (v,)) if _hashable([v]) else None
+    return None
+
+
+def _in(left: ast.AST, right: ast.AST) -> t.Optional[Condition]:
+    """`path in [value, ...]` (or constant tuple/frozenset)"""
+    if not is_path(left):
+        return None
+    if isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+        if not all(is_constant(e) for e in right.elts):
+            return None
+        values = tuple(constant_value(e) for e in right.elts)
+    elif is_constant(right) and isinstance(constant_value(right), (tuple, frozenset)):
+        values = tuple(constant_value(right))
+    else:
+        return None  # e.g. `x in 'abc'`
+    return Condition("eq", left, values) if _hashable(values) else None
+
+
+def _bound(
+    left: ast.AST,
+    op: ast.cmpop,
+    right: ast.AST,
+    bounds: t.Dict[str, t.Tuple[ast.AST, float, float]],
+) -> None:
+    """narrow the bounds of the path by `path < value` (or the others, flipped)"""
+    if is_path(right) and is_constant(left):
+        left, right = right, left
+        op = _FLIPPED[type(op)]()
+    if not (is_path(left) and is_constant(right)):
+        return
+    v = constant_value(right)
+    if not _is_number(v):
+        return
+    key = ast.dump(left)
+    _, lo, hi = bounds.get(key, (left, -math.inf, math.inf))
+    if isinstance(op, (ast.Gt, ast.GtE)):
+        lo = max(lo, v)
+    else:
+        hi = min(hi, v)
+    bounds[key] = (left, lo, hi)
+
+
+def conditions(node: ast.AST) -> t.List[Condition]:
+    """indexable conditions of the top-level conjuncts (and, chained comparison)"""
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        conjuncts: t.Sequence[ast.AST] = node.values
+    else:
+        conjuncts = [node]
+
+    r: t.List[Condition] = []
+    bounds: t.Dict[str, t.Tuple[ast.AST, float, float]] = {}
+    for x in conjuncts:
+        if not isinstance(x, ast.Compare):
+            continue
+        items = [x.left, *x.comparators]
+        for left, op, right in zip(items, x.ops, items[1:]):
+            if type(op) in _FLIPPED:
+                _bound(left, op, right, bounds)
+                continue
+            if isinstance(op, ast.Eq):
+                cond = _eq(left, right)
+            elif isinstance(op, ast.In):
+                cond = _in(left, right)
+            else:
+                continue
+            if cond is not None:
+                r.append(cond)
+
+    r.extend(Condition("range", path, (lo, hi)) for path, lo, hi in bounds.values())
+    return r
+
+
+# the values looked up in HashIndex, hash is consistent with __eq__
+# (the other types, e.g. with custom __eq__, are not looked up, all rules are candidates)
+HASHABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _exact(v: t.Any) -> bool:
+    if type(v) in HASHABLE_TYPES:
+        return True
+    if type(v) in (tuple, frozenset):
+        return all(_exact(x) for x in v)
+    return False
+
+
+class HashIndex:
+    """rules by the value of the path (`path == value` or `path in values`)"""
+
+    def __init__(self, fn: Fn) -> None:
+        self.fn = fn
+        self.table: t.Dict[t.Any, t.List[int]] = {}
+        self.all: t.List[int] = []
+
+    def add(self, i: int, values: t.Iterable[t.Any]) -> None:
+        for v in set(values):
+            self.table.setdefault(v, []).append(i)
+        self.all.append(i)
+
+    def candidates(self, env: Env) -> t.Sequence[int]:
+        try:
+            v = self.fn(env)
+            if not _exact(v):
+                return self.all
+            return self.table.get(v, ())
+        except Exception:
+            # unhashable or evaluation error, the rules are evaluated (and raise)
+            return self.all
+
+
+class IntervalIndex:
+    """rules by the range of the path (inclusive, `lo <= path <= hi`)
+
+    a centered interval tree (built by freeze()), a lookup is O(log n + k)
+    """
+
+    def __init__(self, fn: Fn) -> None:
+        self.fn = fn
+        self.intervals: t.List[t.Tuple[float, float, int]] = []
+        self.all: t.List[int] = []
+        # (center, by lo (ascending), by hi (descending), left, right), -1 is no child
+        self.nodes: t.List[_Node] = []
+
+    def add(self, i: int, lo: float, hi: float) -> None:
+        self.intervals.append((lo, hi, i))
+        self.all.append(i)
+
+    def freeze(self) -> None:
+        self.nodes = []
+        # empty intervals (e.g. `x > 10 and x < 5`) are never candidates
+        intervals = [x for x in self.intervals if x[0] <= x[1]]
+        # (intervals, the index of the parent, is left child), built without recursion
+        work: t.List[t.Tuple[t.List[t.Tuple[float, float, int]], int, bool]] = [
+            (intervals, -1, False)
+        ]
+        while work:
+            intervals, parent, is_left = work.pop()
+            if not intervals:
+                continue
+            center = _median(intervals)
+            here, left, right = [], [], []
+            for x in intervals:
+                if x[1] < center:
+                    left.append(x)
+                elif x[0] > center:
+                    right.append(x)
+                else:
+                    here.append(x)
+            index = len(self.nodes)
+            self.nodes.append(
+                [
+                    center,
+                    sorted(here, key=lambda x: x[0]),
+                    sorted(here, key=lambda x: x[1], reverse=True),
+                    -1,
+                    -1,
+                ]
+            )
+            if parent >= 0:
+                self.nodes[parent][3 if is_left else 4] = index
+            if left:
+                work.append((left, index, True))
+            if right:
+                work.append((right, index, False))
+
+    def candidates(self, env: Env) -> t.Sequence[int]:
+        try:
+            x = self.fn(env)
+            r = []
+            index = 0 if self.nodes else -1
+            while index >= 0:
+                center, by_lo, by_hi, left, right = self.nodes[index]
+                if x < center:
+                    for lo, _, i in by_lo:
+                        if not lo <= x:
+                            break
+                        r.append(i)
+                    index = left
+                elif x > center:
+                    for _, hi, i in by_hi:
+                        if not x <= hi:
+                            break
+                        r.append(i)
+                    index = right
+                else:
+                    # x == center (or nan, not comparable with the bounds)
+                    r.extend(i for lo, hi, i in by_lo if lo <= x <= hi)
+                    break
+            return r
+        except Exception:
+            # not comparable or evaluation error, the rules are evaluated (and raise)
+            return self.all
+
+
+_Node = t.List[t.Any]
+
+
+def _median(intervals: t.Sequence[t.Tuple[float, float, int]]) -> float:
+    """the median of the finite endpoints (the center of the tree node)"""
+    points = sorted(v for lo, hi, _ in intervals for v in (lo, hi) if math.isfinite(v))
+    return points[len(points) // 2] if points else 0.0
@@ -1,18 +1,30 @@
 from __future__ import annotations
 import typing as t
 import typing_extensions as tx
+import sys
 import ast
 from functools import partial
-import logging
 from baku.q import QEvaluator, QBuilder, q, Q, QArgs
+from baku.cache import LRUCache, CacheInfo
+from baku.closure import compile_closure, Fn
+from baku.sealed import compile_sealed
+from baku.cse import compile_cse
+from baku.schema import Schema, compile_typed, infer_types
+from baku.optimize import optimize as _optimize
+from baku.vm import compile_program, depth, Program
 
-logger = logging.getLogger(__name__)
+if t.TYPE_CHECKING:
+    from baku.tracing import Tracer
 
 
 class StrictVisitor(ast.NodeVisitor):
     def __init__(self, ctx: ContextProtocol) -> None:
         self.stack: t.List[t.List[t.Any]] = [[]]
         self.ctx = ctx
+        # optional, for the contexts not subclassing ContextProtocol (no short-circuit)
+        self.short_circuit: t.Optional[t.Callable[[str, Q], bool]] = getattr(
+            ctx, "ShortCircuit", None
+        )
 
     # override
     def generic_visit(self, node: ast.AST) -> None:
@@ -20,45 +32,31 @@ class StrictVisitor(ast.NodeVisitor):
         raise NotImplementedError(method)
 
     def visit_Module(self, node: ast.Module) -> None:
-        logger.debug("trace Module depth=%d %s", len(self.stack), node)
         assert len(node.body) == 1, "must be expr, len(node) == 1"
         self.visit(node.body[0])
 
     def visit_Expr(self, node: ast.Expr) -> None:
-        logger.debug("trace Expr depth=%d %s", len(self.stack), node)
         self.visit(node.value)
 
     def visit_Name(self, node: ast.Name) -> None:
-        logger.debug("trace Name depth=%d %s", len(self.stack), node)
         self.stack[-1].append(self.ctx.Name(node.id))
 
     def visit_Constant(self, node: ast.Constant) -> None:
-        logger.debug("trace Constant depth=%d %s", len(self.stack), node)
         self.stack[-1].append(self.ctx.Value(node.value))
 
     # for python < 3.8
     def visit_NameConstant(self, node: ast.NameConstant) -> None:
-        logger.debug("trace NameConstant depth=%d %s", len(self.stack), node)
         self.stack[-1].append(self.ctx.Value(node.value))
 
     # for python < 3.8
     def visit_Num(self, node: ast.Num) -> None:
-        logger.debug("trace Num depth=%d %s", len(self.stack), node)
         self.stack[-1].append(self.ctx.Value(node.n))
 
     # for python < 3.8
     def visit_Str(self, node: ast.Str) -> None:
-        logger.debug("trace Str depth=%d %s", len(self.stack), node)
         self.stack[-1].append(self.ctx.Value(node.s))
 
     def visit_BinOp(self, node: ast.BinOp) -> None:
-        logger.debug(
-            "trace BinOp depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.left,
-            node.right,
-        )
         self.stack.append([])
         self.visit(node.left)
         self.visit(node.right)
@@ -68,21 +66,16 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(method(right))
 
     def visit_BoolOp(self, node: ast.BoolOp) -> None:
-        # short circuit?
-        logger.debug(
-            "trace BoolOp depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.op,
-            node.values,
-        )
         self.stack.append([])
         self.visit(node.values[0])
         l_value = self.stack[-1].pop()
 
+        op_name = node.op.__class__.__name__
         for v in node.values[1:]:
+            if self.short_circuit is not None and self.short_circuit(op_name, l_value):
+                break
             self.visit(v)
-            method = getattr(l_value, node.op.__class__.__name__)
+            method = getattr(l_value, op_name)
             r_value = self.stack[-1].pop()
             l_value = method(r_value)
 
@@ -90,14 +83,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(l_value)
 
     def visit_Compare(self, node: ast.Compare) -> None:
-        # short circuit?
-        logger.debug(
-            "trace Compare depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.ops,
-            node.comparators,
-        )
         self.stack.append([])
         self.visit(node.left)
         l_val = self.stack[-1].pop()
@@ -105,6 +90,12 @@ class StrictVisitor(ast.NodeVisitor):
         assert len(node.ops) == len(node.comparators)
         acc = None
         for i, (op, right) in enumerate(zip(node.ops, node.comparators)):
+            if (
+                acc is not None
+                and self.short_circuit is not None
+                and self.short_circuit("And", acc)
+            ):
+                break
             self.visit(right)
             r_val = self.stack[-1].pop()
             method = getattr(l_val, op.__class__.__name__)
@@ -118,33 +109,20 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(acc)
 
     def visit_Subscript(self, node: ast.Subscript) -> None:
-        logger.debug(
-            "trace Subscript depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.value,
-            node.slice,
-        )
-
         # e.g. d["x"]
         self.stack.append([])
         self.visit(node.value)
         c = self.stack[-1].pop()
-        self.visit(node.slice.value)  # type: ignore  # ???
+        if sys.version_info < (3, 9):
+            self.visit(node.slice.value)  # type: ignore
+        else:
+            self.visit(node.slice)
         k = self.stack[-1].pop()
 
         assert not self.stack.pop()
         self.stack[-1].append(c[k])
 
     def visit_Attribute(self, node: ast.Attribute) -> None:
-        logger.debug(
-            "trace Attribute depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.value,
-            node.attr,
-        )
-
         # e.g. ob.x
         self.stack.append([])
         self.visit(node.value)
@@ -154,15 +132,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(getattr(ob, node.attr))
 
     def visit_Call(self, node: ast.Call) -> None:
-        logger.debug(
-            "trace Call depth=%d %s, %s, %s, %s",
-            len(self.stack),
-            node,
-            node.func,
-            node.args,
-            node.keywords,
-        )
-
         self.stack.append([])
         self.visit(node.func)
         fn = self.stack[-1].pop()
@@ -182,10 +151,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(fn(*args, **kwargs))
 
     def visit_Tuple(self, node: ast.Tuple) -> None:
-        logger.debug(
-            "trace Tuple depth=%d %s, %s", len(self.stack), node, node.elts,
-        )
-
         self.stack.append([])
 
         for x in node.elts:
@@ -194,10 +159,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(self.ctx.Tuple(xs))
 
     def visit_List(self, node: ast.List) -> None:
-        logger.debug(
-            "trace List depth=%d %s, %s", len(self.stack), node, node.elts,
-        )
-
         self.stack.append([])
 
         for x in node.elts:
@@ -206,10 +167,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(self.ctx.List(xs))
 
     def visit_Set(self, node: ast.Set) -> None:
-        logger.debug(
-            "trace Set depth=%d %s, %s", len(self.stack), node, node.elts,
-        )
-
         self.stack.append([])
 
         for x in node.elts:
@@ -218,14 +175,6 @@ class StrictVisitor(ast.NodeVisitor):
         self.stack[-1].append(self.ctx.Set(xs))
 
     def visit_Dict(self, node: ast.Dict) -> None:
-        logger.debug(
-            "trace Dict depth=%d %s, %s, %s",
-            len(self.stack),
-            node,
-            node.keys,
-            node.values,
-        )
-
         self.stack.append([])
         for k in node.keys:
             if k is None:
@@ -261,6 +210,10 @@ class ContextProtocol(tx.Protocol):
     def Dict(self, ks: t.List[str], vs: t.List[Q]) -> Q:
         ...
 
+    # op is "And" or "Or", if True, the rest operands are not visited
+    def ShortCircuit(self, op: str, value: Q) -> bool:
+        return False
+
 
 class ContextForBuilding(ContextProtocol):
     def __init__(self, env: t.Dict[str, object]) -> None:
@@ -313,17 +266,239 @@ class ContextForEvaluation(ContextProtocol):
     def Dict(self, ks: t.List[str], vs: t.List[Q]) -> Q:
         return q({getattr(k, "val", k): getattr(v, "val", v) for k, v in zip(ks, vs)})
 
+    def ShortCircuit(self, op: str, value: Q) -> bool:
+        if op == "And":
+            return not value.val
+        return bool(value.val)
+
+
+# backend name -> function compiling validated node to Fn
+BACKENDS: t.Dict[str, t.Callable[[ast.AST], Fn]] = {
+    "closure": compile_closure,
+    "sealed": compile_sealed,
+    "vm": compile_program,
+    "cse": compile_cse,
+}
+
+# deeper expressions than this are always compiled with the "vm" backend
+# (the other backends and the optimization pass use recursion)
+MAX_RECURSIVE_DEPTH = 100
+
+
+class Compiled:
+    """parsed and validated expression, reusable with different envs"""
+
+    __slots__ = (
+        "code",
+        "node",
+        "backend",
+        "optimize",
+        "schema",
+        "min_saved_cost",
+        "fn",
+    )
+
+    code: str
+    node: ast.AST
+    backend: str
+    optimize: bool
+    schema: t.Optional[Schema]
+    min_saved_cost: t.Optional[int]
+    fn: Fn
+
+    def __init__(
+        self,
+        code: str,
+        node: ast.AST,
+        *,
+        backend: str = "closure",
+        optimize: bool = False,  # compiled with the optimization (kept for pickling)
+        schema: t.Optional[Schema] = None,
+        min_saved_cost: t.Optional[int] = None,  # of the cse backend (None: default)
+        lazy: bool = False,  # fn is compiled on the first use (e.g. by baku.store)
+    ) -> None:
+        # immutable, safe to share between threads (the state of evaluation is per call)
+        setattr = object.__setattr__
+        setattr(self, "code", code)
+        setattr(self, "node", node)
+        setattr(self, "backend", backend)
+        setattr(self, "optimize", optimize)
+        setattr(self, "schema", schema)
+        setattr(self, "min_saved_cost", min_saved_cost)
+        if not lazy:
+            setattr(self, "fn", self._compile())
+
+    def _compile(self) -> Fn:
+        if self.schema is not None and self.backend == "closure":
+            return compile_typed(self.node, self.schema)
+        if self.min_saved_cost is not None and self.backend == "cse":
+            return compile_cse(self.node, min_saved_cost=self.min_saved_cost)
+        return BACKENDS[self.backend](self.node)
+
+    def __getattr__(self, name: str) -> t.Any:
+        # only for the empty slot of fn (if lazy). if compiled by several threads at
+        # once, one of the equivalent closures is kept
+        if name != "fn":
+            raise AttributeError(
+                f"{self.__class__.__name__!r} object has no attribute {name!r}"
+            )
+        fn = self._compile()
+        object.__setattr__(self, "fn", fn)
+        return fn
+
+    def __setattr__(self, name: str, value: t.Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def run(self, ctx: ContextProtocol) -> Q:
+        if isinstance(self.fn, Program):
+            return self.fn.run(ctx)
+        v = StrictVisitor(ctx)
+        v.visit(self.node)
+        return v.stack[-1][-1]  # type: ignore
+
+    def evaluate(self, env: t.Optional[t.Dict[str, object]] = None) -> object:
+        return self.fn(env if env is not None else {})
+
+    def build(self) -> str:
+        r = self.run(ContextForBuilding({}))
+        return str(r.builder.build(r))
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.code!r} backend={self.backend!r}>"
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        # pickled by source (deeply nested node cannot be pickled), recompiled on load.
+        # if the code is a label (e.g. "<ast>"), pickled by node
+        options: t.Dict[str, t.Any] = {
+            "backend": self.backend,
+            "optimize": self.optimize,
+            "schema": self.schema,
+            "min_saved_cost": self.min_saved_cost,
+        }
+        if self.code.startswith("<"):
+            return (partial(Compiled, **options), (self.code, self.node))
+        return (partial(compile_expr, **options), (self.code,))
+
+
+def compile_node(
+    node: ast.AST,
+    *,
+    code: str = "<ast>",
+    backend: str = "closure",
+    optimize: bool = True,
+    schema: t.Optional[t.Mapping[str, t.Any]] = None,
+    min_saved_cost: t.Optional[int] = None,
+    parsed: bool = False,  # just parsed (not shared), optimized in place
+) -> Compiled:
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, (supported: {list(BACKENDS)})")
+    if min_saved_cost is not None and backend != "cse":
+        raise ValueError(f"min_saved_cost is not an option of backend {backend!r}")
+    if schema is not None and not isinstance(schema, Schema):
+        schema = Schema(schema)
+
+    if depth(node) > MAX_RECURSIVE_DEPTH:
+        # validated by the linearizer
+        if schema is not None:
+            infer_types(node, schema)
+        return Compiled(code, node, backend="vm", optimize=optimize, schema=schema)
+
+    # validation (StrictVisitor rejects unsupported nodes)
+    StrictVisitor(ContextForBuilding({})).visit(node)
+    if schema is not None and backend != "closure":
+        infer_types(node, schema)  # the closure backend is type-checked when compiled
+    if optimize:
+        node = _optimize(node, inplace=parsed)
+    return Compiled(
+        code,
+        node,
+        backend=backend,
+        optimize=optimize,
+        schema=schema,
+        min_saved_cost=min_saved_cost,
+    )
+
+
+# (code, backend, optimize, schema, min_saved_cost)
+_Key = t.Tuple[str, str, bool, t.Optional[Schema], t.Optional[int]]
+
+
+def _compile(key: _Key) -> Compiled:
+    code, backend, optimize, schema, min_saved_cost = key
+    tree = ast.parse(code)
+    assert len(tree.body) == 1, "must be expr, len(node) == 1"
+    node = tree.body[0]
+    if not isinstance(node, ast.Expr):
+        raise NotImplementedError("visit_" + node.__class__.__name__)
+    return compile_node(
+        node.value,
+        code=code,
+        backend=backend,
+        optimize=optimize,
+        schema=schema,
+        min_saved_cost=min_saved_cost,
+        parsed=True,
+    )
+
+
+_cache: LRUCache[_Key, Compiled] = LRUCache(maxsize=1024)
+
+
+def compile_expr(
+    code: str,
+    *,
+    backend: str = "closure",
+    optimize: bool = True,
+    cache: bool = True,
+    schema: t.Optional[t.Mapping[str, t.Any]] = None,
+    min_saved_cost: t.Optional[int] = None,
+) -> Compiled:
+    """compile expression, the backend is one of the followings
+
+    - closure: a tree of closures (default)
+    - sealed: a native code object, evaluated with restricted globals (no builtins)
+    - vm: postfix instructions, evaluated with an explicit stack
+    - cse: closure, but repeated sub-expressions are evaluated once (see baku.cse)
+
+    deeply nested expressions (> MAX_RECURSIVE_DEPTH) are always compiled with "vm".
+    if optimize is True, constant sub-expressions are folded (see baku.optimize)
+    if schema (name -> type, e.g. `{"x": int, "d": t.Dict[str, int]}`) is given,
+    ill-typed expressions are rejected with TypeCheckError, and the closure backend
+    is specialized by the inferred types (see baku.schema)
+    min_saved_cost is the threshold of the cse backend (see baku.cse.MIN_SAVED_COST)
+    """
+    if schema is not None and not isinstance(schema, Schema):
+        schema = Schema(schema)
+    key = (code, backend, optimize, schema, min_saved_cost)
+    if not cache:
+        return _compile(key)
+    return _cache.get_or_create(key, _compile)
+
+
+def cache_info() -> CacheInfo:
+    return _cache.info()
+
+
+def cache_clear() -> None:
+    _cache.clear()
+
 
 def literal_eval_plus(
     code: str,
     *,
     env: t.Optional[t.Dict[str, object]] = None,
     create_ctx: t.Callable[..., ContextProtocol] = ContextForEvaluation,
+    tracer: t.Optional[Tracer] = None,
 ) -> object:
-    t = ast.parse(code)
-    v = StrictVisitor(create_ctx(env))
-    v.visit(t)
-    return v.stack[-1][-1].val
+    c = compile_expr(code)
+    if tracer is not None:
+        return tracer.run(c, create_ctx(env)).val
+    if create_ctx is ContextForEvaluation:
+        return c.evaluate(env)
+    return c.run(create_ctx(env)).val
 
 
 # TODO: remove
@@ -0,0 +1,146 @@
+from __future__ import annotations
+import typing as t
+import sys
+import ast
+import copy
+from baku.q import QEvaluator, OPERATORS
+
+if sys.version_info < (3, 8):
+    CONSTANT_NODES: t.Tuple[t.Type[ast.AST], ...] = (
+        ast.Constant,
+        ast.Num,
+        ast.Str,
+        ast.NameConstant,
+    )
+else:
+    CONSTANT_NODES = (ast.Constant,)
+
+_MISSING = object()
+
+
+def constant_value(node: ast.AST, default: t.Any = _MISSING) -> t.Any:
+    if not isinstance(node, CONSTANT_NODES):
+        if default is _MISSING:
+            raise ValueError(f"{node!r} is not constant")
+        return default
+    # for python < 3.8
+    if isinstance(node, ast.Num):
+        return node.n
+    if isinstance(node, ast.Str):
+        return node.s
+    return node.value
+
+
+def is_constant(node: ast.AST) -> bool:
+    return isinstance(node, CONSTANT_NODES)
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """fold constant sub-expressions (BinOp, Compare, BoolOp)
+
+    e.g.
+    - 2 * (3 + 1) -> 8
+    - True and x -> x
+    - x and True and y -> x and y
+    - False and x -> False
+    """
+
+    # not folded, if the result is too large (e.g. 'x' * 10000)
+    max_size: t.ClassVar[int] = 256
+
+    def __init__(self, evaluator: t.Optional[QEvaluator] = None) -> None:
+        self.evaluator = evaluator or QEvaluator()
+
+    def _too_large(self, name: str, left: t.Any, right: t.Any) -> bool:
+        """the result of `+` or `*` would be larger than max_size (checked before computing)"""
+        sized = (str, bytes, tuple, list)
+        if name == "+":
+            return (
+                isinstance(left, sized)
+                and isinstance(right, sized)
+                and len(left) + len(right) > self.max_size
+            )
+        if name == "*":
+            if isinstance(left, int) and isinstance(right, sized):
+                left, right = right, left
+            return (
+                isinstance(left, sized)
+                and isinstance(right, int)
+                and len(left) * right > self.max_size
+            )
+        return False
+
+    def _constant(self, value: t.Any, node: ast.AST) -> ast.AST:
+        if isinstance(value, (str, bytes, tuple)) and len(value) > self.max_size:
+            return node
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        name = OPERATORS.get(node.op.__class__.__name__)
+        if name is None or not (is_constant(node.left) and is_constant(node.right)):
+            return node
+        op = self.evaluator.bop_mapping[name]
+        left, right = constant_value(node.left), constant_value(node.right)
+        if self._too_large(name, left, right):
+            return node
+        try:
+            value = op(left, right)
+        except Exception:
+            return node  # e.g. 1 / 0, raised at evaluation time
+        return self._constant(value, node)
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        self.generic_visit(node)
+        if not is_constant(node.left) or not all(
+            is_constant(x) for x in node.comparators
+        ):
+            return node
+
+        l_val = constant_value(node.left)
+        value: t.Any = None
+        for op_node, right in zip(node.ops, node.comparators):
+            name = OPERATORS.get(op_node.__class__.__name__)
+            if name is None:
+                return node
+            r_val = constant_value(right)
+            try:
+                value = self.evaluator.bop_mapping[name](l_val, r_val)
+            except Exception:
+                return node
+            if not value:
+                break
+            l_val = r_val
+        return self._constant(value, node)
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        self.generic_visit(node)
+        is_and = isinstance(node.op, ast.And)
+
+        values: t.List[ast.AST] = []
+        last = len(node.values) - 1
+        for i, x in enumerate(node.values):
+            v = constant_value(x, None)
+            if not is_constant(x) or i == last:
+                values.append(x)
+            elif bool(v) is not is_and:
+                # decided, e.g. `False and ...`, `True or ...`
+                values.append(x)
+                break
+            # else: skip, e.g. `True and x` -> `x`
+
+        if len(values) == 1:
+            return values[0]
+        node.values = values  # type: ignore
+        return node
+
+
+def optimize(node: ast.AST, *, inplace: bool = False) -> ast.AST:
+    """constant folding (the node passed is not modified, unless inplace)
+
+    inplace is for the node not shared with others (e.g. just parsed by compile_expr),
+    copying is the most of the cost of the optimization
+    """
+    if not inplace:
+        node = copy.deepcopy(node)
+    return ConstantFolder().visit(node)  # type: ignore
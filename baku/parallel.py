@@ -0,0 +1,89 @@
+from __future__ import annotations
+import typing as t
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from baku.minieval import compile_expr, Compiled
+
+if t.TYPE_CHECKING:
+    from multiprocessing.context import BaseContext
+
+Env = t.Mapping[str, t.Any]
+
+# the expression, shipped to each worker process once (by the initializer)
+_compiled: t.Optional[Compiled] = None
+
+
+def _init_worker(c: Compiled) -> None:
+    global _compiled
+    _compiled = c
+
+
+def _evaluate_chunk(chunk: t.List[Env]) -> t.List[object]:
+    assert _compiled is not None, "not initialized"
+    fn = _compiled.fn
+    return [fn(env) for env in chunk]
+
+
+def chunked(records: t.Iterable[Env], size: int) -> t.Iterator[t.List[Env]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _next_results(
+    pending: t.Deque[Future[t.List[object]]], *, ordered: bool
+) -> t.List[object]:
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    r: t.List[object] = []
+    for fut in done:
+        pending.remove(fut)
+        r.extend(fut.result())
+    return r
+
+
+def evaluate_parallel(
+    expr: t.Union[str, Compiled],
+    records: t.Iterable[Env],
+    *,
+    workers: t.Optional[int] = None,
+    chunksize: int = 1000,
+    ordered: bool = True,
+    backend: str = "closure",
+    mp_context: t.Optional[BaseContext] = None,
+) -> t.Iterator[object]:
+    """evaluate the expression with each record as env, in worker processes
+
+    the records are consumed lazily, sent to the workers in chunks (at most 2 chunks
+    per worker are in flight). if ordered is False, the results are yielded in the
+    order of completion (chunk by chunk, e.g. for aggregation).
+    the records and the results must be picklable.
+    """
+    c = compile_expr(expr, backend=backend) if isinstance(expr, str) else expr
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(c,),
+    ) as executor:
+        pending: t.Deque[Future[t.List[object]]] = deque()
+        try:
+            for chunk in chunked(records, chunksize):
+                pending.append(executor.submit(_evaluate_chunk, chunk))
+                if len(pending) >= max_pending:
+                    yield from _next_results(pending, ordered=ordered)
+            while pending:
+                yield from _next_results(pending, ordered=ordered)
+        finally:
+            # e.g. the generator is closed before the end
+            for fut in pending:
+                fut.cancel()
@@ -0,0 +1,305 @@
+from __future__ import annotations
+import typing as t
+import sys
+import ast
+from time import perf_counter_ns
+from baku.closure import ClosureCompiler, Env, Fn
+from baku.minieval import Compiled, MAX_RECURSIVE_DEPTH, compile_expr
+from baku.q import QEvaluator
+from baku.vm import depth as _depth
+
+SORT_KEYS = ("cumulative", "self", "count")
+
+Span = t.Tuple[int, int, t.Optional[int], t.Optional[int]]
+
+
+class NodeStats:
+    """call count and cumulative time of a node (keyed by its source span)"""
+
+    __slots__ = ("kind", "span", "text", "parent", "count", "elapsed_ns", "self_ns")
+
+    def __init__(self, kind: str, span: Span, text: str, parent: int) -> None:
+        self.kind = kind
+        self.span = span  # (lineno, col_offset, end_lineno, end_col_offset)
+        self.text = text  # the source segment
+        self.parent = parent  # the index of the parent node (-1 is root)
+        self.count = 0
+        self.elapsed_ns = 0  # including children
+        self.self_ns = 0  # excluding children, computed by ExpressionProfile.update()
+
+    @property
+    def location(self) -> str:
+        lineno, col, end_lineno, end_col = self.span
+        if end_lineno is None:
+            return f"{lineno}:{col}"
+        return f"{lineno}:{col}-{end_lineno}:{end_col}"
+
+    @property
+    def label(self) -> str:
+        return f"{self.kind}@{self.location} {self.text}"
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.label!r} count={self.count} elapsed_ns={self.elapsed_ns}>"
+
+
+class ExpressionProfile:
+    """the profile of a compiled expression, nodes[0] is the root"""
+
+    __slots__ = ("name", "code", "nodes")
+
+    def __init__(self, name: str, code: str) -> None:
+        self.name = name
+        self.code = code
+        self.nodes: t.List[NodeStats] = []
+
+    @property
+    def count(self) -> int:
+        return self.nodes[0].count if self.nodes else 0
+
+    @property
+    def elapsed_ns(self) -> int:
+        return self.nodes[0].elapsed_ns if self.nodes else 0
+
+    def update(self) -> None:
+        """compute self time of the nodes"""
+        children = [0] * len(self.nodes)
+        for s in self.nodes:
+            if s.parent >= 0:
+                children[s.parent] += s.elapsed_ns
+        for s, elapsed in zip(self.nodes, children):
+            s.self_ns = max(s.elapsed_ns - elapsed, 0)
+
+    def stacks(self) -> t.Iterator[t.Tuple[t.List[NodeStats], NodeStats]]:
+        """(ancestors, node) for each node"""
+        paths: t.List[t.List[NodeStats]] = []
+        for s in self.nodes:
+            path = paths[s.parent] + [s] if s.parent >= 0 else [s]
+            paths.append(path)
+            yield path[:-1], s
+
+    def clear(self) -> None:
+        for s in self.nodes:
+            s.count = s.elapsed_ns = s.self_ns = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.name!r} count={self.count} elapsed_ns={self.elapsed_ns}>"
+
+
+def _segment(code: str, node: ast.AST, *, width: int = 40) -> str:
+    if sys.version_info < (3, 8):  # no end positions
+        return ""
+    text = ast.get_source_segment(code, node) or ""
+    text = " ".join(text.split())
+    if len(text) > width:
+        text = text[: width - 3] + "..."
+    return text
+
+
+def _span(node: ast.AST) -> Span:
+    return (
+        getattr(node, "lineno", 0),
+        getattr(node, "col_offset", 0),
+        getattr(node, "end_lineno", None),
+        getattr(node, "end_col_offset", None),
+    )
+
+
+class ProfilingCompiler(ClosureCompiler):
+    """ClosureCompiler, each closure accumulates its call count and elapsed time"""
+
+    def __init__(
+        self, profile: ExpressionProfile, evaluator: t.Optional[QEvaluator] = None
+    ) -> None:
+        super().__init__(evaluator)
+        self.profile = profile
+        self._parent = -1
+
+    def compile(self, node: ast.AST) -> Fn:
+        nodes = self.profile.nodes
+        index = len(nodes)
+        stats = NodeStats(
+            node.__class__.__name__,
+            _span(node),
+            _segment(self.profile.code, node),
+            self._parent,
+        )
+        nodes.append(stats)
+
+        parent, self._parent = self._parent, index
+        try:
+            fn = super().compile(node)
+        finally:
+            self._parent = parent
+
+        def _profiled(env: Env) -> t.Any:
+            start = perf_counter_ns()
+            try:
+                return fn(env)
+            finally:
+                stats.count += 1
+                stats.elapsed_ns += perf_counter_ns() - start
+
+        return _profiled
+
+
+def _program(profile: ExpressionProfile, c: Compiled) -> Fn:
+    # deeply nested (baku.vm), profiled as a whole
+    stats = NodeStats("Program", _span(c.node), _segment(c.code, c.node), -1)
+    profile.nodes.append(stats)
+    fn = c.fn
+
+    def _profiled(env: Env) -> t.Any:
+        start = perf_counter_ns()
+        try:
+            return fn(env)
+        finally:
+            stats.count += 1
+            stats.elapsed_ns += perf_counter_ns() - start
+
+    return _profiled
+
+
+class ProfiledExpression:
+    """compiled expression, profiled while the profiler is enabled"""
+
+    __slots__ = ("compiled", "profile", "profiler", "fn")
+
+    def __init__(
+        self, compiled: Compiled, profile: ExpressionProfile, profiler: Profiler
+    ) -> None:
+        self.compiled = compiled
+        self.profile = profile
+        self.profiler = profiler
+        if _depth(compiled.node) > MAX_RECURSIVE_DEPTH:
+            self.fn = _program(profile, compiled)
+        else:
+            self.fn = ProfilingCompiler(profile).compile(compiled.node)
+
+    def __call__(self, env: Env) -> t.Any:
+        if self.profiler.enabled:
+            return self.fn(env)
+        return self.compiled.fn(env)
+
+    def evaluate(self, env: t.Optional[t.Dict[str, object]] = None) -> object:
+        return self(env if env is not None else {})
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.profile.name!r}>"
+
+
+class Profiler:
+    """opt-in profiler, accumulates call counts and elapsed time per expression and per node
+
+    the expressions compiled by the profiler are evaluated without the bookkeeping,
+    while it is disabled (the other expressions are not affected at all).
+    the counts are approximate, if evaluated by multiple threads concurrently.
+    """
+
+    def __init__(self, *, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.profiles: t.List[ExpressionProfile] = []
+        self._expressions: t.Dict[str, ProfiledExpression] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def compile(
+        self,
+        code_or_compiled: t.Union[str, Compiled],
+        *,
+        name: t.Optional[str] = None,
+    ) -> ProfiledExpression:
+        c = (
+            compile_expr(code_or_compiled)
+            if isinstance(code_or_compiled, str)
+            else code_or_compiled
+        )
+        profile = ExpressionProfile(name if name is not None else c.code, c.code)
+        self.profiles.append(profile)
+        return ProfiledExpression(c, profile, self)
+
+    def evaluate(
+        self,
+        code_or_compiled: t.Union[str, Compiled],
+        env: t.Optional[t.Dict[str, object]] = None,
+    ) -> object:
+        """evaluate the expression (compiled once per source code)"""
+        code = (
+            code_or_compiled
+            if isinstance(code_or_compiled, str)
+            else code_or_compiled.code
+        )
+        expr = self._expressions.get(code)
+        if expr is None:
+            expr = self._expressions[code] = self.compile(code_or_compiled)
+        return expr.evaluate(env)
+
+    def clear(self) -> None:
+        """reset the counts (the compiled expressions are kept)"""
+        for profile in self.profiles:
+            profile.clear()
+
+    def report(self, *, sort: str = "cumulative", limit: t.Optional[int] = 20) -> str:
+        """the expressions and the nodes, sorted by sort ("cumulative", "self" or "count")"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"unknown sort key {sort!r}, (supported: {SORT_KEYS})")
+        rows: t.List[t.Tuple[ExpressionProfile, NodeStats]] = []
+        for profile in self.profiles:
+            profile.update()
+            rows.extend((profile, s) for s in profile.nodes if s.count)
+
+        def _key(row: t.Tuple[ExpressionProfile, NodeStats]) -> int:
+            s = row[1]
+            if sort == "count":
+                return s.count
+            return s.self_ns if sort == "self" else s.elapsed_ns
+
+        profiles = sorted(
+            (p for p in self.profiles if p.count),
+            key=lambda p: p.count if sort == "count" else p.elapsed_ns,
+            reverse=True,
+        )
+        rows.sort(key=_key, reverse=True)
+
+        lines = [
+            f"{'count':>10} {'cumtime(ms)':>12} {'percall(us)':>12}  expression",
+        ]
+        for p in profiles[:limit]:
+            lines.append(
+                f"{p.count:>10} {p.elapsed_ns / 1e6:>12.3f} {p.elapsed_ns / p.count / 1e3:>12.3f}  {p.name}"
+            )
+        lines.append("")
+        lines.append(
+            f"{'count':>10} {'cumtime(ms)':>12} {'selftime(ms)':>12}  expression:node"
+        )
+        for p, s in rows[:limit]:
+            lines.append(
+                f"{s.count:>10} {s.elapsed_ns / 1e6:>12.3f} {s.self_ns / 1e6:>12.3f}  {p.name}:{s.label}"
+            )
+        return "\n".join(lines)
+
+    def collapsed(self) -> t.List[str]:
+        """flamegraph-compatible collapsed stacks (the values are self time in ns)"""
+        lines = []
+        for profile in self.profiles:
+            profile.update()
+            root = _frame(profile.name)
+            for ancestors, s in profile.stacks():
+                if not s.self_ns:
+                    continue
+                frames = [root, *(_frame(x.label) for x in ancestors), _frame(s.label)]
+                lines.append(f"{';'.join(frames)} {s.self_ns}")
+        return lines
+
+    def dump_collapsed(self, wf: t.IO[str]) -> None:
+        for line in self.collapsed():
+            wf.write(line)
+            wf.write("\n")
+
+
+def _frame(label: str) -> str:
+    # ";" separates the frames, and the last space separates the value
+    return " ".join(label.replace(";", ",").split())
@@ -2,18 +2,27 @@ from __future__ import annotations
 import typing as t
 import typing_extensions as tx
 import operator
+import string
+import weakref
+import threading
+from functools import lru_cache, partial
+from types import MappingProxyType
 
 # FIXME: val attribute is reserved in internal code
 
 
 class Q:
-    __slots__ = ("builder", "val", "kwargs")
+    __slots__ = ("builder", "val", "kwargs", "__weakref__")
 
+    # val and kwargs are one of the followings
+    # - leaf: any value, None (or empty dict)
+    # - template: format string, dict (e.g. q("({args})", args=...))
+    # - compact node (built by QBuilder): Op, tuple of operands
     def __init__(
         self,
         builder: BuilderProtocol,
         val: object,
-        kwargs: t.Optional[t.Dict[str, object]],
+        kwargs: t.Union[None, t.Dict[str, object], t.Tuple[object, ...]],
     ) -> None:
         self.builder = builder
         self.val = val
@@ -84,13 +93,7 @@ class Q:
         return str(self.builder.build(self))
 
     def __to_string__(self, builder: BuilderProtocol) -> str:
-        if not self.kwargs:
-            return str(self.val)
-        kwargs = {
-            k: (v.__to_string__(builder) if hasattr(v, "__to_string__") else v)  # type: ignore
-            for k, v in self.kwargs.items()
-        }
-        return self.val.format(**kwargs)  # type: ignore
+        return render(self, builder)
 
     def __getattr__(self, name: str) -> Q:
         if name.startswith("_"):
@@ -100,6 +103,12 @@ class Q:
     def __getitem__(self, name: str) -> Q:
         return self.builder.getindex(self, name)
 
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        kwargs = self.kwargs
+        if isinstance(kwargs, tuple) and kwargs[-1] is _NO_KWARGS:
+            kwargs = (kwargs[0], kwargs[1], {})  # mappingproxy is not picklable
+        return (self.__class__, (self.builder, self.val, kwargs))
+
 
 class QArgs:
     __slots__ = ("builder", "args", "kwargs", "sep")
@@ -118,32 +127,221 @@ class QArgs:
         self.sep = sep
 
     def __to_string__(self, builder: BuilderProtocol) -> str:
-        new_args = [
-            (
-                x.__to_string__(builder)  # type:ignore
-                if hasattr(x, "__to_string__")
-                else repr(x)
-            )
-            for x in self.args
-        ]
-        new_kwargs = [
-            "{}{}{}".format(
-                k,
-                self.sep,
-                (
-                    x.__to_string__(builder)  # type:ignore
-                    if hasattr(x, "__to_string__")
-                    else repr(x)
-                ),
+        return render(self, builder)
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        return (partial(QArgs, sep=self.sep), (self.builder, self.args, self.kwargs))
+
+
+# Op.kind
+UOP = 0  # operands: (value,)
+BOP = 1  # operands: (left, right)
+GETATTR = 2  # operands: (inner, name)
+GETINDEX = 3  # operands: (inner, key)
+CALL = 4  # operands: (inner, args, kwargs)
+
+
+class Op:
+    """operator of compact node, interned (shared by all nodes with the same operator)"""
+
+    __slots__ = ("kind", "name", "text")
+
+    _interned: t.ClassVar[t.Dict[t.Tuple[int, str], Op]] = {}
+
+    def __init__(self, kind: int, name: str) -> None:
+        self.kind = kind
+        self.name = name
+        if kind == BOP:
+            self.text = f" {name} "
+        elif kind == UOP:
+            self.text = f"({name} "
+        else:
+            self.text = name
+
+    @classmethod
+    def intern(cls, kind: int, name: str) -> Op:
+        k = (kind, name)
+        op = cls._interned.get(k)
+        if op is None:
+            op = cls._interned.setdefault(k, cls(kind, name))  # atomic
+        return op
+
+    def __repr__(self) -> str:
+        return f"Op({self.kind}, {self.name!r})"
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        return (Op.intern, (self.kind, self.name))
+
+
+_GETATTR = Op.intern(GETATTR, ".")
+_GETINDEX = Op.intern(GETINDEX, "[]")
+_CALL = Op.intern(CALL, "()")
+_NO_KWARGS: t.Mapping[str, object] = MappingProxyType({})
+_MISSING = object()
+
+
+@lru_cache(maxsize=256)
+def _parse_format(fmt: str) -> t.Optional[t.Tuple[t.Tuple[str, t.Optional[str]], ...]]:
+    r = []
+    for literal, field, spec, conversion in string.Formatter().parse(fmt):
+        if spec or conversion:
+            return None  # not supported, fallback to str.format
+        r.append((literal, field))
+    return tuple(r)
+
+
+def _item(x: object) -> object:
+    # operand of bop/uop, and the value of the template (used by str.format)
+    return x if hasattr(x, "__to_string__") else str(x)
+
+
+def _arg(x: object) -> object:
+    # argument of call, and getindex's key
+    return x if hasattr(x, "__to_string__") else repr(x)
+
+
+def _expand_args(
+    items: t.List[object],
+    args: t.Sequence[object],
+    kwargs: t.Mapping[t.Any, object],
+    sep: str,
+) -> None:
+    first = True
+    for x in args:
+        if not first:
+            items.append(", ")
+        first = False
+        items.append(_arg(x))
+    for k, x in kwargs.items():
+        if not first:
+            items.append(", ")
+        first = False
+        items.append(_item(k))
+        items.append(sep)
+        items.append(_arg(x))
+
+
+def _expand(ob: t.Union[Q, QArgs], builder: BuilderProtocol) -> t.List[object]:
+    """expand node to a list of strings and child nodes"""
+    items: t.List[object] = []
+    if isinstance(ob, QArgs):
+        _expand_args(items, ob.args, ob.kwargs, ob.sep)
+    elif not ob.kwargs:
+        items.append(str(ob.val))
+    elif isinstance(ob.kwargs, tuple):
+        _expand_op(items, ob.val, ob.kwargs)  # type: ignore
+    else:
+        _expand_template(items, ob, builder)
+    return items
+
+
+def _expand_op(items: t.List[object], op: Op, operands: t.Tuple[t.Any, ...]) -> None:
+    kind = op.kind
+    if kind == BOP:
+        items.extend(("(", _item(operands[0]), op.text, _item(operands[1]), ")"))
+    elif kind == GETATTR:
+        items.extend((operands[0], "." + str(operands[1])))
+    elif kind == GETINDEX:
+        items.extend((operands[0], "[", _arg(operands[1]), "]"))
+    elif kind == CALL:
+        items.append(operands[0])
+        items.append("(")
+        _expand_args(items, operands[1], operands[2], "=")
+        items.append(")")
+    elif kind == UOP:
+        items.extend((op.text, _item(operands[0]), ")"))
+    else:
+        raise ValueError(f"unknown op {op!r}")
+
+
+def _expand_template(items: t.List[object], ob: Q, builder: BuilderProtocol) -> None:
+    kwargs: t.Mapping[str, t.Any] = ob.kwargs  # type: ignore
+    parsed = _parse_format(ob.val)
+    if parsed is None or not all(f is None or f in kwargs for _, f in parsed):
+        # fallback
+        items.append(
+            ob.val.format(  # type: ignore
+                **{
+                    k: (render(v, builder) if hasattr(v, "__to_string__") else v)
+                    for k, v in kwargs.items()
+                }
             )
-            for k, x in self.kwargs.items()
-        ]
-        r = []
-        if new_args:
-            r.extend(new_args)
-        if new_kwargs:
-            r.extend(new_kwargs)
-        return ", ".join(r)
+        )
+        return
+    for literal, field in parsed:
+        if literal:
+            items.append(literal)
+        if field is not None:
+            items.append(_item(kwargs[field]))
+
+
+class _Memo:
+    # marker, pushed before and after the node. the rendered fragments are out[start:]
+    __slots__ = ("node", "start")
+
+    def __init__(self, node: Q) -> None:
+        self.node = node
+        self.start = -1
+
+
+def _with_cache(
+    items: t.List[object],
+    parent: object,
+    cache: t.MutableMapping[Q, t.Union[str, int]],
+) -> t.List[object]:
+    r: t.List[object] = []
+    parent_id = id(parent)
+    for x in items:
+        if x.__class__ is str or not isinstance(x, Q) or not x.kwargs:
+            r.append(x)
+            continue
+        s = cache.get(x, _MISSING)
+        if s.__class__ is str:
+            r.append(s)  # memoized
+        elif s is _MISSING:
+            cache[x] = parent_id  # seen
+            r.append(x)
+        elif s != parent_id:
+            # shared by several parents
+            memo = _Memo(x)
+            r.extend((memo, x, memo))
+        else:
+            r.append(x)
+    return r
+
+
+def render(root: t.Union[Q, QArgs], builder: BuilderProtocol) -> str:
+    """render Q (and QArgs) to string in a single pass, without recursion
+
+    if the builder has render_cache, the rendered string of the node shared by
+    several parents is memoized (a node seen again with another parent).
+    """
+    cache: t.Optional[t.MutableMapping[Q, t.Union[str, int]]] = getattr(
+        builder, "render_cache", None
+    )
+    out: t.List[str] = []
+    work: t.List[object] = [root]
+    push = out.append
+    while work:
+        ob = work.pop()
+        if ob.__class__ is str:
+            push(ob)
+        elif isinstance(ob, (Q, QArgs)):
+            items = _expand(ob, builder)
+            if cache is not None:
+                items = _with_cache(items, ob, cache)
+            work.extend(reversed(items))
+        elif isinstance(ob, _Memo):
+            if ob.start < 0:
+                ob.start = len(out)
+            else:
+                s = "".join(out[ob.start :])
+                del out[ob.start :]
+                push(s)
+                cache[ob.node] = s  # type: ignore
+        else:
+            push(ob.__to_string__(builder))  # type: ignore
+    return "".join(out)
 
 
 class BuilderProtocol(tx.Protocol):
@@ -170,34 +368,184 @@ class QBuilder(BuilderProtocol):
     uop_mapping: t.ClassVar[t.Dict[str, str]] = {}
     bop_mapping: t.ClassVar[t.Dict[str, str]] = {}
 
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    @property
+    def render_cache(self) -> weakref.WeakKeyDictionary[Q, t.Union[str, int]]:
+        # Q is immutable, the rendered string can be shared (see render()).
+        # per thread, the builder is shared (e.g. the default builder of q())
+        try:
+            return self._local.render_cache  # type: ignore
+        except AttributeError:
+            cache: weakref.WeakKeyDictionary[Q, t.Union[str, int]]
+            cache = self._local.render_cache = weakref.WeakKeyDictionary()
+            return cache
+
     def uop(self, q: Q, name: str) -> Q:
-        fmt = "({op} {value})"
-        name = self.uop_mapping.get(name, name)
-        return q.__class__(self, fmt, kwargs=dict(op=name, value=q))
+        op = Op.intern(UOP, self.uop_mapping.get(name, name))
+        return q.__class__(self, op, (q,))
 
     def bop(self, q: Q, name: str, right: Q) -> Q:
-        fmt = "({left} {op} {right})"
-        name = self.bop_mapping.get(name, name)
-        return q.__class__(self, fmt, kwargs=dict(op=name, left=q, right=right))
+        op = Op.intern(BOP, self.bop_mapping.get(name, name))
+        return q.__class__(self, op, (q, right))
 
     def getattr(self, q: Q, name: str) -> Q:
-        fmt = "{inner}.{name}"
-        return q.__class__(self, fmt, kwargs=dict(inner=q, name=name))
+        return q.__class__(self, _GETATTR, (q, name))
 
     def getindex(self, q: Q, name: str) -> Q:
-        name = name if hasattr(name, "builder") else repr(name)
-        return q.__class__(self, "{inner}[{name}]", kwargs=dict(inner=q, name=name))
+        return q.__class__(self, _GETINDEX, (q, name))
 
     def call(self, q: Q, args: t.Sequence[object], kwargs: t.Dict[str, object]) -> Q:
-        return q.__class__(
-            self,
-            "{inner}({args})",
-            kwargs=dict(inner=q, args=QArgs(self, args, kwargs)),
-        )
+        return q.__class__(self, _CALL, (q, tuple(args), kwargs or _NO_KWARGS))
 
     def build(self, q: Q) -> t.Any:
         return q.__to_string__(self)
 
+    # the caches are not pickled
+
+    def __getstate__(self) -> t.Dict[str, t.Any]:
+        state = self.__dict__.copy()
+        state.pop("_local", None)
+        return state
+
+    def __setstate__(self, state: t.Dict[str, t.Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+
+def _value_key(x: object) -> object:
+    # 0.0 == -0.0 (with the same hash), but they are rendered differently
+    if isinstance(x, (float, complex)):
+        return repr(x)
+    return x
+
+
+def _frozen_key(x: object) -> t.Hashable:
+    """structural key of the literal (TypeError, if it cannot be)"""
+    if isinstance(x, (list, tuple)):
+        return (type(x), tuple(_frozen_key(e) for e in x))
+    if isinstance(x, (set, frozenset)):
+        return (type(x), frozenset(_frozen_key(e) for e in x))
+    if isinstance(x, dict):
+        return (type(x), tuple((_frozen_key(k), _frozen_key(v)) for k, v in x.items()))
+    hash(x)
+    return (type(x), _value_key(x))
+
+
+class InterningQBuilder(QBuilder):
+    """QBuilder returning the same node for structurally equal expressions (hash-consing)
+
+    the nodes built by this builder can be compared by identity, and used as dict keys
+    (leaves are interned when used as operands, or by leaf())
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # structural key -> node, the key of an operand is id() of the interned node
+        # (it is alive while the parent is alive) or the (type, value) pair
+        self.table: weakref.WeakValueDictionary[t.Hashable, Q] = (
+            weakref.WeakValueDictionary()
+        )
+        self.lock = threading.Lock()  # WeakValueDictionary.setdefault is not atomic
+
+    def __getstate__(self) -> t.Dict[str, t.Any]:
+        state = super().__getstate__()
+        state.pop("table", None)
+        state.pop("lock", None)
+        return state
+
+    def __setstate__(self, state: t.Dict[str, t.Any]) -> None:
+        super().__setstate__(state)
+        self.table = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def _setdefault(self, key: t.Hashable, create: t.Callable[[], Q]) -> Q:
+        node = self.table.get(key)
+        if node is None:
+            with self.lock:
+                node = self.table.get(key)
+                if node is None:
+                    node = self.table[key] = create()
+        return node
+
+    def leaf(self, val: object) -> Q:
+        return self._canonical(Q(self, val, None))[1]  # type: ignore
+
+    def _canonical(self, x: object) -> t.Tuple[t.Hashable, object]:
+        if isinstance(x, Q):
+            if x.builder is self and isinstance(x.kwargs, tuple):
+                return id(x), x  # already interned
+            if x.kwargs:
+                return id(x), x  # template, or the node built by the other builder
+            val = x.val
+            try:
+                key = ("leaf", type(val), _value_key(val))
+                hash(key)
+            except TypeError:
+                return id(x), x  # unhashable
+            leaf = self._setdefault(key, lambda: Q(self, val, None))
+            return id(leaf), leaf
+
+        try:
+            return _frozen_key(x), x
+        except TypeError:
+            return id(x), x
+
+    def _intern(
+        self, q: Q, op: Op, keys: t.Hashable, operands: t.Tuple[object, ...]
+    ) -> Q:
+        return self._setdefault((op, keys), lambda: q.__class__(self, op, operands))
+
+    def _canonical_all(
+        self, xs: t.Iterable[object]
+    ) -> t.Tuple[t.Tuple[t.Hashable, ...], t.Tuple[object, ...]]:
+        pairs = [self._canonical(x) for x in xs]
+        return tuple(k for k, _ in pairs), tuple(x for _, x in pairs)
+
+    def uop(self, q: Q, name: str) -> Q:
+        op = Op.intern(UOP, self.uop_mapping.get(name, name))
+        return self._intern(q, op, *self._canonical_all((q,)))
+
+    def bop(self, q: Q, name: str, right: Q) -> Q:
+        op = Op.intern(BOP, self.bop_mapping.get(name, name))
+        return self._intern(q, op, *self._canonical_all((q, right)))
+
+    def getattr(self, q: Q, name: str) -> Q:
+        return self._intern(q, _GETATTR, *self._canonical_all((q, name)))
+
+    def getindex(self, q: Q, name: str) -> Q:
+        return self._intern(q, _GETINDEX, *self._canonical_all((q, name)))
+
+    def call(self, q: Q, args: t.Sequence[object], kwargs: t.Dict[str, object]) -> Q:
+        fkey, f = self._canonical(q)
+        akeys, cargs = self._canonical_all(args)
+        vkeys, vals = self._canonical_all(kwargs.values())
+        names = tuple(kwargs)
+        operands = (f, cargs, dict(zip(names, vals)) if names else _NO_KWARGS)
+        return self._intern(q, _CALL, (fkey, akeys, names, vkeys), operands)
+
+
+# ast's node class name (Q's method name) -> operator name (uop_mapping/bop_mapping's key)
+OPERATORS: t.Dict[str, str] = {
+    "And": "and",
+    "Or": "or",
+    "Gt": ">",
+    "GtE": ">=",
+    "Lt": "<",
+    "LtE": "<=",
+    "Eq": "==",
+    "NotEq": "!=",
+    "Is": "is",
+    "IsNot": "is not",
+    "In": "in",
+    "NotIn": "not in",
+    "Add": "+",
+    "Sub": "-",
+    "Mult": "*",
+    "Div": "/",
+}
+
 
 class QEvaluator(BuilderProtocol):
     uop_mapping = {
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import typing as t
+import ast
+from baku.minieval import compile_expr, Compiled
+from baku.closure import Env, Fn
+from baku.cse import MIN_SAVED_COST, CSECompiler, CSEStats, CallPolicy, new_scope
+from baku.index import conditions, HashIndex, IntervalIndex
+
+if t.TYPE_CHECKING:
+    from baku.store import Store
+    from baku.profiling import Profiler, ProfiledExpression
+
+K = t.TypeVar("K", bound=t.Hashable)
+
+
+def _switch(expr: ProfiledExpression, fn: Fn) -> Fn:
+    profiler = expr.profiler
+    profiled = expr.fn
+
+    def _rule(scope: Env) -> t.Any:
+        return profiled(scope) if profiler.enabled else fn(scope)
+
+    return _rule
+
+
+class RuleSet(t.Generic[K]):
+    """many expressions, evaluated together against the same env
+
+    the rules are compiled into one shared DAG, names and the repeated sub-expressions
+    (across rules) are evaluated once per env.
+
+    if index is True, match() evaluates only the candidate rules, selected by a top-level
+    conjunct (`d['kind'] == 'x'`, `d['status'] in [...]` or `0 < x <= 10`).
+    (so, the rules that would raise an exception may be skipped)
+    the index is looked up only for the values of builtin types (str, bytes, numbers,
+    None, and tuples of them), the other values (e.g. with custom __eq__) select all rules
+    of the index. the candidates are selected before evaluation, so a mutation of the
+    indexed path by a call in a rule is not seen by the index (use index=False)
+
+    if store is given, the rules are compiled through it (see baku.store)
+
+    if profiler is given, the rules are profiled while it is enabled (see baku.profiling).
+    the profiled rules do not share sub-expressions (each rule is charged its own cost)
+    """
+
+    def __init__(
+        self,
+        rules: t.Union[t.Mapping[K, str], t.Iterable[str]],
+        *,
+        pure_calls: CallPolicy = False,
+        index: bool = True,
+        store: t.Optional[Store] = None,
+        profiler: t.Optional[Profiler] = None,
+    ) -> None:
+        if isinstance(rules, t.Mapping):
+            items = list(rules.items())
+        else:
+            items = list(enumerate(rules))
+        self.ids: t.List[K] = [k for k, _ in items]
+        if store is not None:
+            # loaded from the store, without parsing and validation (if stored)
+            self.compiled: t.List[Compiled] = store.compile_many(
+                code for _, code in items
+            )
+        else:
+            self.compiled = [compile_expr(code, cache=False) for _, code in items]
+
+        # deeply nested rules are compiled with "vm" (they take the scope, too)
+        shared = [c.node for c in self.compiled if c.backend != "vm"]
+        compiler = CSECompiler(pure_calls=pure_calls)
+        fns = iter(compiler.compile_many(shared, min_saved_cost=MIN_SAVED_COST))
+        self.fns: t.List[Fn] = [
+            c.fn if c.backend == "vm" else next(fns) for c in self.compiled
+        ]
+        if profiler is not None:
+            self.fns = [
+                _switch(profiler.compile(c, name=str(k)), fn)
+                for k, c, fn in zip(self.ids, self.compiled, self.fns)
+            ]
+        self.size = compiler.stats.subexpressions
+        self.stats: CSEStats = compiler.stats
+
+        self.indexes: t.List[t.Union[HashIndex, IntervalIndex]] = []
+        self.unindexed: t.List[int] = list(range(len(self.ids)))
+        if index:
+            self._build_indexes(compiler)
+
+    def _build_indexes(self, compiler: CSECompiler) -> None:
+        hash_indexes: t.Dict[str, HashIndex] = {}
+        interval_indexes: t.Dict[str, IntervalIndex] = {}
+        unindexed = []
+        for i, c in enumerate(self.compiled):
+            found = [] if c.backend == "vm" else conditions(c.node)
+            if not found:
+                unindexed.append(i)
+                continue
+
+            # equality is more selective than range, usually
+            cond = min(found, key=lambda x: x.kind != "eq")
+            key = ast.dump(cond.path)
+            if cond.kind == "eq":
+                if key not in hash_indexes:
+                    hash_indexes[key] = HashIndex(compiler.compile(cond.path))
+                hash_indexes[key].add(i, cond.values)
+            else:
+                if key not in interval_indexes:
+                    interval_indexes[key] = IntervalIndex(compiler.compile(cond.path))
+                interval_indexes[key].add(i, *cond.values)
+
+        for ix in interval_indexes.values():
+            ix.freeze()
+        self.indexes = [*hash_indexes.values(), *interval_indexes.values()]
+        self.unindexed = unindexed
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def evaluate(self, env: t.Mapping[str, t.Any]) -> t.List[t.Any]:
+        """the results of all rules (in order)"""
+        scope = new_scope(env, self.size)
+        return [fn(scope) for fn in self.fns]
+
+    def match(self, env: t.Mapping[str, t.Any]) -> t.List[K]:
+        """the ids of the rules whose result is truthy"""
+        scope = new_scope(env, self.size)
+        if not self.indexes:
+            return [k for k, fn in zip(self.ids, self.fns) if fn(scope)]
+
+        candidates = list(self.unindexed)
+        for ix in self.indexes:
+            candidates.extend(ix.candidates(scope))
+        candidates.sort()
+        ids, fns = self.ids, self.fns
+        return [ids[i] for i in candidates if fns[i](scope)]
@@ -0,0 +1,388 @@
+from __future__ import annotations
+import typing as t
+import typing_extensions as tx
+import sys
+import ast
+from functools import lru_cache
+from baku.q import QEvaluator, OPERATORS
+from baku.closure import ClosureCompiler, Fn
+from baku.optimize import is_constant, constant_value
+
+# the type of the value (e.g. int, t.Dict[str, int], dict[str, int]), t.Any if unknown
+Type = t.Any
+ANY: Type = t.Any
+
+NoneType = type(None)
+_NUMBERS = {bool: 0, int: 1, float: 2}
+_SCALARS = frozenset([bool, int, float, str, bytes, NoneType])
+_SEQUENCES = frozenset([str, bytes, list, tuple])
+_CONTAINERS = frozenset([str, bytes, list, tuple, dict, set, frozenset])
+_BUILTINS = _SCALARS | _CONTAINERS
+_ORDERING = (ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+class TypeCheckError(TypeError):
+    """the expression is ill-typed (detected at compile time)"""
+
+
+class Schema(t.Mapping[str, Type]):
+    """the types of the names in env, e.g. `Schema({"x": int, "d": t.Dict[str, int]})`
+
+    the names not in the schema are unknown (any value is accepted).
+    """
+
+    __slots__ = ("_types", "_hash")
+
+    def __init__(self, types: t.Mapping[str, Type]) -> None:
+        self._types = dict(types)
+        self._hash = hash(tuple(sorted(self._types.items(), key=lambda x: x[0])))
+
+    def __getitem__(self, name: str) -> Type:
+        return self._types[name]
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self._types)
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._types!r})"
+
+    def __reduce__(self) -> t.Tuple[t.Any, ...]:
+        return (self.__class__, (self._types,))
+
+
+def origin(tp: Type) -> Type:
+    """e.g. t.Dict[str, int] -> dict"""
+    return tx.get_origin(tp) or tp
+
+
+def is_known(tp: Type) -> bool:
+    """the builtin types, whose operators are not overridden"""
+    return origin(tp) in _BUILTINS
+
+
+def _compatible(x: Type, y: Type) -> bool:
+    xo, yo = origin(x), origin(y)
+    if xo in _NUMBERS and yo in _NUMBERS:
+        return True
+    return bool(xo is yo)
+
+
+def _typename(tp: Type) -> str:
+    tp = origin(tp)
+    return getattr(tp, "__name__", None) or repr(tp).replace("typing.", "")
+
+
+def _slice(node: ast.Subscript) -> ast.AST:
+    if sys.version_info < (3, 9):
+        return node.slice.value  # type: ignore
+    return node.slice
+
+
+class TypeInference:
+    """infer the types of the sub-expressions from the schema, bottom-up
+
+    ill-typed operations on the builtin types (e.g. `x + 'a'` where x is int) are
+    rejected with TypeCheckError, the others are unknown (t.Any) if not inferred.
+    """
+
+    def __init__(self, schema: t.Mapping[str, Type]) -> None:
+        self.schema = schema
+        self.types: t.Dict[int, Type] = {}  # id(node) -> type
+
+    def infer(self, node: ast.AST) -> Type:
+        # not recursive (for deeply nested expressions), the children are inferred first
+        order = [node]
+        i = 0
+        while i < len(order):
+            order.extend(ast.iter_child_nodes(order[i]))
+            i += 1
+        for x in reversed(order):
+            method = getattr(self, "infer_" + x.__class__.__name__, None)
+            self.types[id(x)] = ANY if method is None else method(x)
+        return self.types[id(node)]
+
+    def type_of(self, node: ast.AST) -> Type:
+        return self.types.get(id(node), ANY)
+
+    def error(self, node: ast.AST, msg: str) -> TypeCheckError:
+        lineno = getattr(node, "lineno", None)
+        if lineno is None:
+            return TypeCheckError(msg)
+        return TypeCheckError(f"{lineno}:{getattr(node, 'col_offset', 0)}: {msg}")
+
+    def infer_Expression(self, node: ast.Expression) -> Type:
+        return self.type_of(node.body)
+
+    def infer_Expr(self, node: ast.Expr) -> Type:
+        return self.type_of(node.value)
+
+    def infer_Name(self, node: ast.Name) -> Type:
+        return self.schema.get(node.id, ANY)
+
+    def infer_Constant(self, node: ast.AST) -> Type:
+        return type(constant_value(node))
+
+    # for python < 3.8
+    infer_NameConstant = infer_Num = infer_Str = infer_Constant
+
+    def infer_Tuple(self, node: ast.Tuple) -> Type:
+        return tuple
+
+    def infer_List(self, node: ast.List) -> Type:
+        return list
+
+    def infer_Set(self, node: ast.Set) -> Type:
+        return set
+
+    def infer_Dict(self, node: ast.Dict) -> Type:
+        return dict
+
+    def infer_BoolOp(self, node: ast.BoolOp) -> Type:
+        # the result is one of the operands
+        types = [self.type_of(x) for x in node.values]
+        if all(x == types[0] for x in types[1:]):
+            return types[0]
+        return ANY
+
+    def infer_BinOp(self, node: ast.BinOp) -> Type:
+        left, right = self.type_of(node.left), self.type_of(node.right)
+        if not (is_known(left) and is_known(right)):
+            return ANY
+
+        lo, ro = origin(left), origin(right)
+        if lo in _NUMBERS and ro in _NUMBERS:
+            if isinstance(node.op, ast.Div):
+                return float
+            return max(lo, ro, int, key=_NUMBERS.__getitem__)
+        if isinstance(node.op, ast.Add) and lo in _SEQUENCES and lo is ro:
+            return left if left == right else lo
+        if isinstance(node.op, ast.Mult):
+            if lo in _SEQUENCES and ro in (int, bool):
+                return left
+            if ro in _SEQUENCES and lo in (int, bool):
+                return right
+        if isinstance(node.op, ast.Sub) and {lo, ro} <= {set, frozenset}:
+            return lo
+
+        symbol = OPERATORS.get(node.op.__class__.__name__, node.op.__class__.__name__)
+        raise self.error(
+            node,
+            f"unsupported operand type(s) for {symbol}: {_typename(left)!r} and {_typename(right)!r}",
+        )
+
+    def infer_Compare(self, node: ast.Compare) -> Type:
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            self._check_compare(node, op, self.type_of(left), self.type_of(right))
+            left = right
+        return bool
+
+    def _check_compare(
+        self, node: ast.AST, op: ast.AST, left: Type, right: Type
+    ) -> None:
+        if isinstance(op, _ORDERING):
+            self._check_ordering(node, op, left, right)
+        elif isinstance(op, (ast.In, ast.NotIn)):
+            self._check_membership(node, left, right)
+
+    def _check_ordering(
+        self, node: ast.AST, op: ast.AST, left: Type, right: Type
+    ) -> None:
+        if not (is_known(left) and is_known(right)):
+            return
+        lo, ro = origin(left), origin(right)
+        if lo in _NUMBERS and ro in _NUMBERS:
+            return
+        if lo is ro and lo not in (dict, NoneType):
+            return
+        if {lo, ro} <= {set, frozenset}:
+            return
+        symbol = OPERATORS[op.__class__.__name__]
+        raise self.error(
+            node,
+            f"{symbol!r} not supported between instances of {_typename(left)!r} and {_typename(right)!r}",
+        )
+
+    def _check_membership(self, node: ast.AST, left: Type, right: Type) -> None:
+        if not is_known(right):
+            return
+        lo, ro = origin(left), origin(right)
+        if ro not in _CONTAINERS:
+            raise self.error(
+                node, f"argument of type {_typename(right)!r} is not iterable"
+            )
+        if ro is bytes and lo in (int, bool):
+            return  # e.g. `65 in b"A"`
+        if ro in (str, bytes) and is_known(left) and lo is not ro:
+            raise self.error(
+                node,
+                f"'in <{_typename(right)}>' requires {_typename(right)} as left operand, not {_typename(left)}",
+            )
+
+    def infer_Subscript(self, node: ast.Subscript) -> Type:
+        value, key = self.type_of(node.value), self.type_of(_slice(node))
+        if not is_known(value):
+            return ANY
+        vo = origin(value)
+        if vo is dict:
+            return self._lookup(node, value, key)
+        if vo in _SEQUENCES:
+            return self._index(node, value, key)
+        raise self.error(node, f"{_typename(value)!r} object is not subscriptable")
+
+    def _lookup(self, node: ast.Subscript, value: Type, key: Type) -> Type:
+        """`d[key]`, the type of the values of the dict"""
+        args = tx.get_args(value)
+        if len(args) != 2:
+            return ANY
+        if is_known(args[0]) and is_known(key) and not _compatible(args[0], key):
+            raise self.error(
+                node,
+                f"the key of {_typename(value)!r} must be {_typename(args[0])!r}, not {_typename(key)!r}",
+            )
+        return args[1]
+
+    def _index(self, node: ast.Subscript, value: Type, key: Type) -> Type:
+        """`xs[i]`, the type of the item of the sequence (of i, if tuple)"""
+        if is_known(key) and origin(key) not in (int, bool):
+            raise self.error(
+                node,
+                f"{_typename(value)!r} indices must be integers, not {_typename(key)!r}",
+            )
+        vo, args = origin(value), tx.get_args(value)
+        if vo is str:
+            return str
+        if vo is bytes:
+            return int
+        if vo is list and len(args) == 1:
+            return args[0]
+        if vo is tuple and len(args) == 2 and args[1] is Ellipsis:
+            return args[0]
+        if vo is tuple and args and is_constant(_slice(node)):
+            i = constant_value(_slice(node))
+            if isinstance(i, int) and -len(args) <= i < len(args):
+                return args[i]
+        return ANY
+
+
+def infer_types(node: ast.AST, schema: t.Mapping[str, Type]) -> t.Dict[int, Type]:
+    """the types of the sub-expressions (id(node) -> type), raises TypeCheckError"""
+    inference = TypeInference(schema)
+    inference.infer(node)
+    return inference.types
+
+
+# specialized closures, the operands are inlined (e.g. `lambda env: env['x'] > 10`)
+_OPERANDS = {"fn": "{}(env)", "const": "{}", "name": "env[{}]"}
+
+
+@lru_cache(maxsize=None)
+def _template(fmt: str, left: str, right: str) -> t.Callable[[t.Any, t.Any], Fn]:
+    body = fmt.format(_OPERANDS[left].format("left"), _OPERANDS[right].format("right"))
+    return eval(f"lambda left, right: lambda env: {body}", {"__builtins__": {}})  # type: ignore
+
+
+class TypedCompiler(ClosureCompiler):
+    """compile validated expression to closures, specialized by the inferred types
+
+    if the types of the operands are builtin types, the operator is inlined into the
+    closure (instead of calling the operator function), names and constants are, too.
+    the others are compiled as ClosureCompiler does (generic dispatch).
+    """
+
+    def __init__(
+        self, types: t.Dict[int, Type], evaluator: t.Optional[QEvaluator] = None
+    ) -> None:
+        super().__init__(evaluator)
+        self.types = types
+        self.specialized = 0  # the number of specialized nodes
+
+    def type_of(self, node: ast.AST) -> Type:
+        return self.types.get(id(node), ANY)
+
+    def _symbol(self, op: ast.AST) -> t.Optional[str]:
+        # if the operator is overridden by the evaluator, not inlined
+        name = OPERATORS.get(op.__class__.__name__)
+        if name is None or self.bop(op) is not QEvaluator.bop_mapping.get(name):
+            return None
+        return name
+
+    def _operand(
+        self, node: ast.AST, op: t.Optional[ast.AST] = None
+    ) -> t.Tuple[str, t.Any]:
+        if isinstance(node, ast.Name) and not node.id.startswith("_"):
+            return ("name", node.id)
+        if is_constant(node):
+            return ("const", constant_value(node))
+        if isinstance(op, (ast.In, ast.NotIn)) and isinstance(
+            node, (ast.List, ast.Set)
+        ):
+            # frozen, as _compile_comparator() does, e.g. `x in [1, 2]` -> `x in (1, 2)`
+            values = self._constant_elts(node.elts)
+            if values is not None:
+                if isinstance(node, ast.List):
+                    return ("const", tuple(values))
+                try:
+                    return ("const", frozenset(values))
+                except TypeError:  # unhashable
+                    pass
+        return ("fn", self.compile(node))
+
+    def _specialize(
+        self, fmt: str, left: t.Tuple[str, t.Any], right: t.Tuple[str, t.Any]
+    ) -> Fn:
+        self.specialized += 1
+        return _template(fmt, left[0], right[0])(left[1], right[1])
+
+    def compile_BinOp(self, node: ast.BinOp) -> Fn:
+        symbol = self._symbol(node.op)
+        left, right = self.type_of(node.left), self.type_of(node.right)
+        if symbol is None or not (
+            origin(left) in _SCALARS and origin(right) in _SCALARS
+        ):
+            return super().compile_BinOp(node)
+        return self._specialize(
+            "{} %s {}" % symbol, self._operand(node.left), self._operand(node.right)
+        )
+
+    def compile_Compare(self, node: ast.Compare) -> Fn:
+        if len(node.ops) != 1:
+            return super().compile_Compare(node)
+
+        op, comparator = node.ops[0], node.comparators[0]
+        symbol = self._symbol(op)
+        left, right = self.type_of(node.left), self.type_of(comparator)
+        if isinstance(op, (ast.In, ast.NotIn)):
+            ok = origin(right) in _CONTAINERS
+        else:
+            ok = origin(left) in _SCALARS and origin(right) in _SCALARS
+        if symbol is None or not ok:
+            return super().compile_Compare(node)
+        return self._specialize(
+            "{} %s {}" % symbol,
+            self._operand(node.left),
+            self._operand(comparator, op),
+        )
+
+    def compile_Subscript(self, node: ast.Subscript) -> Fn:
+        if origin(self.type_of(node.value)) not in _CONTAINERS:
+            return super().compile_Subscript(node)
+        return self._specialize(
+            "{}[{}]", self._operand(node.value), self._operand(_slice(node))
+        )
+
+
+def compile_typed(
+    node: ast.AST,
+    schema: t.Mapping[str, Type],
+    *,
+    evaluator: t.Optional[QEvaluator] = None,
+) -> Fn:
+    """type-check the expression by the schema, and compile it with TypedCompiler"""
+    return TypedCompiler(infer_types(node, schema), evaluator=evaluator).compile(node)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import typing as t
+import sys
+import ast
+import copy
+from baku.closure import ClosureCompiler, Env, Fn
+from baku.q import OPERATORS
+
+
+def _reject_name(name: str) -> t.Any:
+    raise NameError(f"{name!r} is not defined (?)")
+
+
+def _getattr(ob: object, name: str) -> t.Any:
+    if name.startswith("_"):
+        raise AttributeError(name)
+    return getattr(ob, name)
+
+
+def _load(name: str, ctx: ast.expr_context) -> ast.Name:
+    return ast.Name(id=name, ctx=ctx)
+
+
+class Sealer(ast.NodeTransformer):
+    """rewrite names and attribute access of the (validated) expression
+
+    - x -> _env['x']
+    - _x -> _reject_name('_x')
+    - ob.x -> _getattr(ob, 'x')
+    """
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id.startswith("_"):
+            return ast.Call(
+                func=_load("_reject_name", ast.Load()),
+                args=[ast.Constant(value=node.id)],
+                keywords=[],
+            )
+        key: ast.expr = ast.Constant(value=node.id)
+        if sys.version_info < (3, 9):
+            key = ast.Index(value=key)  # type: ignore
+        return ast.Subscript(value=_load("_env", ast.Load()), slice=key, ctx=node.ctx)
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.AST:
+        return ast.Call(
+            func=_load("_getattr", ast.Load()),
+            args=[self.visit(node.value), ast.Constant(value=node.attr)],
+            keywords=[],
+        )
+
+
+# the nodes that are not compiled by themselves
+_PARTS = (ast.operator, ast.boolop, ast.cmpop, ast.expr_context, ast.keyword)
+if sys.version_info < (3, 9):
+    _PARTS = (*_PARTS, ast.Index)
+
+
+class Validator(ast.NodeVisitor):
+    """reject the nodes that ClosureCompiler rejects, without compiling them"""
+
+    def generic_visit(self, node: ast.AST) -> None:
+        name = node.__class__.__name__
+        if not isinstance(node, _PARTS) and not hasattr(
+            ClosureCompiler, "compile_" + name
+        ):
+            raise NotImplementedError("visit_" + name)
+        if isinstance(node, (ast.operator, ast.boolop, ast.cmpop)):
+            if name not in OPERATORS:
+                raise NotImplementedError(name)
+        super().generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr.startswith("_"):
+            raise AttributeError(node.attr)
+        self.generic_visit(node)
+
+    def visit_keyword(self, node: ast.keyword) -> None:
+        if node.arg is None:
+            raise NotImplementedError("visit_keyword")
+        self.generic_visit(node)
+
+    def visit_Dict(self, node: ast.Dict) -> None:
+        if any(k is None for k in node.keys):
+            raise NotImplementedError("visit_Dict")  # {**d}
+        self.generic_visit(node)
+
+
+def sealed_globals() -> t.Dict[str, t.Any]:
+    return {"__builtins__": {}, "_getattr": _getattr, "_reject_name": _reject_name}
+
+
+def compile_sealed(node: ast.AST, *, filename: str = "<baku>") -> Fn:
+    """compile the expression to a native code object (a lambda that takes env)
+
+    the whitelist validation is done by Validator, so only the nodes
+    allowed in literal_eval_plus can be here.
+    """
+    Validator().visit(node)
+
+    if isinstance(node, ast.Expression):
+        node = node.body
+    body = Sealer().visit(copy.deepcopy(node))
+
+    tree = ast.parse("lambda _env: None", mode="eval")
+    tree.body.body = body  # type: ignore
+    ast.fix_missing_locations(tree)
+
+    code = compile(tree, filename, "eval")
+    fn: t.Callable[[Env], t.Any] = eval(code, sealed_globals())
+    return fn
@@ -0,0 +1,585 @@
+from __future__ import annotations
+import typing as t
+import os
+import sys
+import ast
+import json
+import keyword
+import mmap
+import struct
+import hashlib
+import tempfile
+import functools
+from baku.minieval import compile_expr, Compiled, MAX_RECURSIVE_DEPTH, BACKENDS
+from baku.vm import depth
+
+# the serialized compiled expressions (validated and optimized nodes)
+#
+# MAGIC, len(header) (4 bytes, big endian), header (JSON), payload (JSON)
+# the payload is {key: [code, backend, optimize, node or null]}, the node is encoded
+# as a flat list of plain JSON values (see encode()), not pickled: loading the file
+# never executes code, and the decoded node is validated again. the node is a JSON
+# string, decoded on the first compile() (load() reads only the entries). the node is
+# null for the deeply nested expressions (recompiled from the source on load)
+
+MAGIC = b"BAKU"
+FORMAT_VERSION = 3
+
+# the modules deciding the compiled nodes (parsing, validation, optimization, encoding)
+_MODULES = ("optimize", "minieval", "store")
+
+Entry = t.Tuple[str, str, bool, t.Any]
+N = t.TypeVar("N", bound=ast.AST)
+
+
+class FormatError(ValueError):
+    """the data is broken, or written by other versions"""
+
+
+def _baku_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("baku")
+    except Exception:  # not installed (e.g. running in the repository), python < 3.8
+        path = os.path.join(os.path.dirname(__file__), "..", "VERSION")
+        try:
+            with open(path) as rf:
+                return rf.read().strip()
+        except OSError:
+            return "unknown"
+
+
+@functools.lru_cache(maxsize=None)
+def _digest() -> str:
+    # VERSION is not changed during development, the sources are hashed too
+    h = hashlib.sha256()
+    for name in _MODULES:
+        with open(os.path.join(os.path.dirname(__file__), f"{name}.py"), "rb") as rf:
+            h.update(rf.read())
+    return h.hexdigest()[:16]
+
+
+def header() -> t.Dict[str, t.Any]:
+    # the nodes depend on the python version (and the optimization on baku's)
+    return {
+        "format": FORMAT_VERSION,
+        "baku": _baku_version(),
+        "digest": _digest(),
+        "python": "{}.{}".format(*sys.version_info[:2]),
+    }
+
+
+def source_key(code: str, *, backend: str = "closure", optimize: bool = True) -> str:
+    data = f"{backend}\0{int(optimize)}\0{code}".encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+# the stored node is a flat list, in postorder (the children are before the parent)
+#
+#   Name       id, *positions
+#   Constant   value, kind, *positions
+#   BinOp      operator, *positions                          (left, right)
+#   BoolOp     operator, n, *positions                       (n values)
+#   Compare    [operator, ...], *positions                   (left, comparators)
+#   Subscript  *positions                                    (value, slice)
+#   Attribute  attr, *positions                              (value)
+#   Call       n, [[arg, *positions], ...], *positions       (func, n args, keywords)
+#   Tuple, List, Set  n, *positions                          (n elts)
+#   Dict       n, *positions                                 (n keys, n values)
+#
+# each node starts with its opcode (index of OPCODES), operators are the indices of
+# the tables below. positions are lineno, col_offset, end_lineno, end_col_offset.
+# it is decoded in one pass with a stack (see decode()), without recursion
+
+OPCODES = (
+    "Name",
+    "Constant",
+    "BinOp",
+    "BoolOp",
+    "Compare",
+    "Subscript",
+    "Attribute",
+    "Call",
+    "Tuple",
+    "List",
+    "Set",
+    "Dict",
+)
+_OPCODE = {name: i for i, name in enumerate(OPCODES)}
+
+# the operators that can be stored (the supported syntax), shared as ast.parse() does
+_BINOPS = (ast.Add(), ast.Sub(), ast.Mult(), ast.Div())
+_BOOLOPS = (ast.And(), ast.Or())
+_CMPOPS: t.Tuple[ast.cmpop, ...] = (
+    ast.Eq(),
+    ast.NotEq(),
+    ast.Lt(),
+    ast.LtE(),
+    ast.Gt(),
+    ast.GtE(),
+    ast.Is(),
+    ast.IsNot(),
+    ast.In(),
+    ast.NotIn(),
+)
+_LOAD = ast.Load()
+_OPERATOR: t.Dict[t.Type[ast.AST], int] = {
+    op.__class__: i for ops in [_BINOPS, _BOOLOPS, _CMPOPS] for i, op in enumerate(ops)
+}
+
+_POSITIONS = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+
+# the constants that are not JSON values, [tag, ...]
+_TAGS = {bytes: "B", complex: "c", tuple: "t", frozenset: "F"}
+
+
+def encode(node: ast.AST) -> t.List[t.Any]:
+    """node -> flat list of plain JSON values, raises ValueError if not supported"""
+    out: t.List[t.Any] = []
+    _encode(node, out)
+    return out
+
+
+def _encode(node: ast.AST, out: t.List[t.Any]) -> None:
+    name = node.__class__.__name__
+    if name not in _OPCODE or getattr(ast, name) is not node.__class__:
+        raise ValueError(f"{name} cannot be encoded")
+    for child in _children(node):
+        _encode(child, out)
+    out.append(_OPCODE[name])
+    out.extend(_fields(node))
+    out.extend(_positions(node))
+
+
+def _children(node: ast.AST) -> t.Sequence[ast.AST]:
+    if isinstance(node, (ast.Name, ast.Constant)):
+        return []
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return node.elts
+    if isinstance(node, ast.BinOp):
+        return [node.left, node.right]
+    if isinstance(node, ast.BoolOp):
+        return node.values
+    if isinstance(node, ast.Compare):
+        return [node.left, *node.comparators]
+    if isinstance(node, ast.Subscript):
+        key = node.slice.value if sys.version_info < (3, 9) else node.slice  # type: ignore
+        return [node.value, key]
+    if isinstance(node, ast.Call):
+        return [node.func, *node.args, *(kw.value for kw in node.keywords)]
+    if isinstance(node, ast.Dict) and all(k is not None for k in node.keys):
+        return [*node.keys, *node.values]  # type: ignore
+    if isinstance(node, ast.Attribute):
+        return [node.value]
+    raise ValueError(f"{node!r} cannot be encoded")  # e.g. {**d}
+
+
+def _fields(node: ast.AST) -> t.List[t.Any]:
+    if isinstance(node, ast.Name):
+        return [node.id]
+    if isinstance(node, ast.Constant):
+        return [_encode_constant(node.value), node.kind]
+    if isinstance(node, ast.Attribute):
+        return [node.attr]
+    if isinstance(node, (ast.BinOp, ast.BoolOp)):
+        n = [len(node.values)] if isinstance(node, ast.BoolOp) else []
+        return [_operator(node.op), *n]
+    if isinstance(node, ast.Compare):
+        return [[_operator(op) for op in node.ops]]
+    if isinstance(node, ast.Call):
+        keywords = [[kw.arg, *_positions(kw)] for kw in node.keywords]
+        return [len(node.args), keywords]
+    if isinstance(node, ast.Dict):
+        return [len(node.keys)]
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        return [len(node.elts)]
+    return []  # Subscript
+
+
+def _operator(op: ast.AST) -> int:
+    try:
+        return _OPERATOR[op.__class__]
+    except KeyError:
+        raise ValueError(f"{op!r} cannot be encoded") from None
+
+
+def _positions(node: ast.AST) -> t.List[int]:
+    if not hasattr(node, "lineno"):  # e.g. keyword of python < 3.9
+        return []
+    r = [getattr(node, a, None) for a in _POSITIONS]
+    if not all(type(v) is int for v in r):  # e.g. python < 3.8
+        raise ValueError(f"the positions of {node!r} cannot be encoded")
+    return r  # type: ignore
+
+
+def _encode_constant(v: t.Any) -> t.Any:
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if v is ...:
+        return ["E"]
+    tag = _TAGS.get(type(v))
+    if tag == "B":
+        return [tag, v.hex()]
+    if tag == "c":
+        return [tag, v.real, v.imag]
+    if tag is not None:
+        return [tag, *(_encode_constant(x) for x in v)]
+    raise ValueError(f"{v!r} cannot be encoded")
+
+
+def decode(x: t.Any) -> ast.AST:
+    """flat list of plain JSON values -> node, raises FormatError if broken or invalid
+
+    only the stored node classes are built, the fields are checked while decoding
+    (identifiers, positions, the number of children) with the rules of
+    baku.sealed.Validator (private attributes, `**` keywords and `{**d}` are rejected)
+    """
+    if type(x) is not list:
+        raise FormatError(f"broken node, {x!r}")
+    stack: t.List[ast.expr] = []
+    i, size = 0, len(x)
+    try:
+        while i < size:
+            i = _DECODERS[x[i]](x, i + 1, stack)
+    except FormatError:
+        raise
+    except (TypeError, ValueError, KeyError, IndexError, RecursionError) as e:
+        raise FormatError(f"broken node, {e!r}") from e
+    if len(stack) != 1:
+        raise FormatError(f"broken node, {len(stack)} nodes")
+    # (the depth is at most the number of the items)
+    if size > MAX_RECURSIVE_DEPTH and depth(stack[0]) > MAX_RECURSIVE_DEPTH:
+        raise FormatError("invalid node, too deep")
+    return stack[0]
+
+
+# opcode -> function(flat list, index of the fields, stack) -> index of the next node
+_Decoder = t.Callable[[t.List[t.Any], int, t.List[ast.expr]], int]
+
+
+def _locate(node: N, x: t.List[t.Any], i: int) -> N:
+    lineno, col_offset, end_lineno, end_col_offset = x[i : i + 4]
+    # (the ranges are checked by compile(), e.g. of the sealed backend)
+    if not (
+        type(lineno) is type(col_offset) is type(end_lineno) is type(end_col_offset)
+        and type(lineno) is int
+        and 0 <= lineno <= end_lineno
+        and col_offset >= 0
+        and end_col_offset >= 0
+        and (lineno < end_lineno or col_offset <= end_col_offset)
+    ):
+        raise FormatError(f"broken position, {x[i : i + 4]!r}")
+    node.lineno = lineno  # type: ignore
+    node.col_offset = col_offset  # type: ignore
+    node.end_lineno = end_lineno  # type: ignore
+    node.end_col_offset = end_col_offset  # type: ignore
+    return node
+
+
+def _identifier(v: t.Any) -> str:
+    if type(v) is not str or not v.isidentifier() or keyword.iskeyword(v):
+        raise FormatError(f"invalid node, identifier {v!r}")
+    return v
+
+
+def _pop(stack: t.List[ast.expr], n: t.Any) -> t.List[ast.expr]:
+    if type(n) is not int or not 0 <= n <= len(stack):
+        raise FormatError(f"broken node, {n!r} children")
+    if not n:
+        return []
+    r = stack[-n:]
+    del stack[-n:]
+    return r
+
+
+def _name(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    stack.append(_locate(ast.Name(_identifier(x[i]), _LOAD), x, i + 1))
+    return i + 5
+
+
+def _constant(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    kind = x[i + 1]
+    if not (kind is None or kind == "u"):
+        raise FormatError(f"broken constant, kind {kind!r}")
+    node = ast.Constant(_decode_constant(x[i]), kind)
+    stack.append(_locate(node, x, i + 2))
+    return i + 6
+
+
+def _binop(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    left, right = _pop(stack, 2)
+    node = ast.BinOp(left, _BINOPS[_index(x[i])], right)
+    stack.append(_locate(node, x, i + 1))
+    return i + 5
+
+
+def _boolop(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    op, n = _BOOLOPS[_index(x[i])], x[i + 1]
+    if type(n) is not int or n < 2:
+        raise FormatError(f"broken node, BoolOp of {n!r} values")
+    stack.append(_locate(ast.BoolOp(op, _pop(stack, n)), x, i + 2))
+    return i + 6
+
+
+def _compare(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    ops = [_CMPOPS[_index(v)] for v in x[i]]
+    if not ops:
+        raise FormatError("broken node, Compare without operators")
+    left, *comparators = _pop(stack, len(ops) + 1)
+    stack.append(_locate(ast.Compare(left, ops, comparators), x, i + 1))
+    return i + 5
+
+
+def _subscript(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    value, key = _pop(stack, 2)
+    if sys.version_info < (3, 9):
+        key = ast.Index(value=key)  # type: ignore
+    stack.append(_locate(ast.Subscript(value, key, _LOAD), x, i))
+    return i + 4
+
+
+def _attribute(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    attr = _identifier(x[i])
+    if attr.startswith("_"):
+        raise FormatError(f"invalid node, private attribute {attr!r}")
+    (value,) = _pop(stack, 1)
+    stack.append(_locate(ast.Attribute(value, attr, _LOAD), x, i + 1))
+    return i + 5
+
+
+def _call(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    n, keywords = x[i], x[i + 1]
+    if type(n) is not int or type(keywords) is not list:
+        raise FormatError(f"broken node, Call of {n!r} args, keywords {keywords!r}")
+    values = _pop(stack, len(keywords))
+    func, *args = _pop(stack, n + 1)
+    kws = [_keyword(kw, v) for kw, v in zip(keywords, values)]
+    stack.append(_locate(ast.Call(func, args, kws), x, i + 2))
+    return i + 6
+
+
+def _keyword(kw: t.Any, value: ast.expr) -> ast.keyword:
+    # (`**` keyword, None, is rejected)
+    node = ast.keyword(_identifier(kw[0]), value)
+    if len(kw) == 1 and sys.version_info < (3, 9):
+        return node
+    return _locate(node, kw, 1)
+
+
+def _sequence(cls: t.Callable[..., ast.expr]) -> _Decoder:
+    def _decode(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+        elts = _pop(stack, x[i])
+        node = cls(elts) if cls is ast.Set else cls(elts, _LOAD)
+        stack.append(_locate(node, x, i + 1))
+        return i + 5
+
+    return _decode
+
+
+def _dict(x: t.List[t.Any], i: int, stack: t.List[ast.expr]) -> int:
+    n = x[i]
+    if type(n) is not int:
+        raise FormatError(f"broken node, Dict of {n!r} items")
+    values = _pop(stack, n)
+    keys: t.List[t.Optional[ast.expr]] = [*_pop(stack, n)]
+    stack.append(_locate(ast.Dict(keys, values), x, i + 1))
+    return i + 5
+
+
+def _index(v: t.Any) -> int:
+    # (negative indices are not operators)
+    if type(v) is not int or v < 0:
+        raise FormatError(f"broken operator, {v!r}")
+    return v
+
+
+_DECODERS: t.Dict[int, _Decoder] = {
+    _OPCODE["Name"]: _name,
+    _OPCODE["Constant"]: _constant,
+    _OPCODE["BinOp"]: _binop,
+    _OPCODE["BoolOp"]: _boolop,
+    _OPCODE["Compare"]: _compare,
+    _OPCODE["Subscript"]: _subscript,
+    _OPCODE["Attribute"]: _attribute,
+    _OPCODE["Call"]: _call,
+    _OPCODE["Tuple"]: _sequence(ast.Tuple),
+    _OPCODE["List"]: _sequence(ast.List),
+    _OPCODE["Set"]: _sequence(ast.Set),
+    _OPCODE["Dict"]: _dict,
+}
+
+
+def _decode_constant(x: t.Any) -> t.Any:
+    if type(x) is not list:
+        if not (x is None or type(x) in (bool, int, float, str)):
+            raise FormatError(f"broken constant, {x!r}")
+        return x
+    tag = x[0]
+    if tag == "E":
+        return ...
+    if tag == "B":
+        return bytes.fromhex(x[1])
+    if tag == "c":
+        return complex(float(x[1]), float(x[2]))
+    if tag == "t":
+        return tuple(_decode_constant(v) for v in x[1:])
+    if tag == "F":
+        return frozenset(_decode_constant(v) for v in x[1:])
+    raise FormatError(f"broken constant, {x!r}")
+
+
+def to_entry(c: Compiled) -> Entry:
+    node = None
+    if depth(c.node) <= MAX_RECURSIVE_DEPTH:
+        try:
+            node = json.dumps(encode(c.node), separators=(",", ":"))
+        except ValueError:  # e.g. the nodes of python < 3.8, recompiled on load
+            pass
+    return (c.code, c.backend, c.optimize, node)
+
+
+def from_entry(entry: Entry) -> Compiled:
+    """the compiled expression, raises FormatError if the entry is broken or invalid"""
+    try:
+        code, backend, optimize, data = entry
+    except (TypeError, ValueError) as e:
+        raise FormatError(f"broken entry, {entry!r}") from e
+    if (
+        not isinstance(code, str)
+        or backend not in BACKENDS
+        or not isinstance(optimize, bool)
+        or not (data is None or isinstance(data, str))
+    ):
+        raise FormatError(f"broken entry, {entry!r}")
+    if data is None:
+        return compile_expr(code, backend=backend, optimize=optimize, cache=False)
+    # not trusted, validated again while decoding (the optimization is not needed)
+    try:
+        x = json.loads(data)
+    except (ValueError, RecursionError) as e:
+        raise FormatError(f"broken node, {e!r}") from e
+    # the closures are compiled on the first use (e.g. RuleSet uses only the nodes)
+    return Compiled(code, decode(x), backend=backend, optimize=optimize, lazy=True)
+
+
+def dumps(entries: t.Mapping[str, Entry]) -> bytes:
+    h = json.dumps(header()).encode("utf-8")
+    payload = json.dumps(dict(entries), separators=(",", ":")).encode("utf-8")
+    return b"".join([MAGIC, struct.pack(">I", len(h)), h, payload])
+
+
+def loads(data: t.Union[bytes, memoryview, mmap.mmap]) -> t.Dict[str, Entry]:
+    # not copied (e.g. mmap), the views are released before returning
+    with memoryview(data) as view:
+        if bytes(view[:4]) != MAGIC:
+            raise FormatError("not a baku file")
+        (size,) = struct.unpack(">I", view[4:8])
+        h = json.loads(bytes(view[8 : 8 + size]).decode("utf-8"))
+        if h != header():
+            raise FormatError(f"version mismatch, {h!r} != {header()!r}")
+        with view[8 + size :] as payload:
+            try:
+                entries = json.loads(bytes(payload).decode("utf-8"))
+            except RecursionError as e:
+                raise FormatError("broken payload (too deep)") from e
+        if not isinstance(entries, dict):
+            raise FormatError("broken payload")
+        return {k: tuple(v) for k, v in entries.items()}
+
+
+class Store:
+    """directory-backed cache of compiled expressions (one file per name)
+
+    e.g. at the startup of workers, the rules are loaded (by a bulk read) instead of
+    parsing and validating each of them.
+
+        store = Store("/var/cache/rules")
+        store.load()
+        rs = RuleSet(rules, store=store)
+        store.save()  # if new expressions are compiled
+
+    the file written by other versions (of the format, baku or python) is ignored.
+    the file is not trusted: the stored nodes are validated again, and the broken or
+    invalid entries are compiled from the source.
+    """
+
+    def __init__(
+        self, directory: t.Union[str, os.PathLike[str]], *, name: str = "default"
+    ) -> None:
+        self.directory = os.fspath(directory)
+        self.name = name
+        self.entries: t.Dict[str, Entry] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.baku")
+
+    def load(self) -> int:
+        """load the entries (memory-mapped), returns the number of them"""
+        try:
+            with open(self.path, "rb") as rf:
+                size = os.fstat(rf.fileno()).st_size
+                if size == 0:
+                    return 0
+                with mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    entries = loads(mm)
+        except FileNotFoundError:
+            return 0
+        except (ValueError, TypeError, struct.error):
+            # FormatError, or broken (e.g. JSONDecodeError)
+            self.dirty = True  # overwritten, by save()
+            return 0
+        self.entries.update(entries)
+        return len(entries)
+
+    def save(self) -> bool:
+        """write the entries (atomically), if modified"""
+        if not self.dirty:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=self.directory, prefix=f".{self.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as wf:
+                wf.write(dumps(self.entries))
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+        return True
+
+    def compile(
+        self, code: str, *, backend: str = "closure", optimize: bool = True
+    ) -> Compiled:
+        key = source_key(code, backend=backend, optimize=optimize)
+        entry = self.entries.get(key)
+        if entry is not None and entry[:3] == (code, backend, optimize):
+            try:
+                c = from_entry(entry)
+            except FormatError:
+                pass  # broken or invalid, compiled again (and overwritten)
+            else:
+                self.hits += 1
+                return c
+
+        self.misses += 1
+        c = compile_expr(code, backend=backend, optimize=optimize, cache=False)
+        self.entries[key] = to_entry(c)
+        self.dirty = True
+        return c
+
+    def compile_many(
+        self, codes: t.Iterable[str], *, backend: str = "closure", optimize: bool = True
+    ) -> t.List[Compiled]:
+        return [
+            self.compile(code, backend=backend, optimize=optimize) for code in codes
+        ]
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import typing as t
+import os
+import json
+from baku.minieval import compile_expr, Compiled
+from baku.rules import RuleSet
+
+# compile once, evaluate lazily over envs
+# e.g. `baku.stream.filter("x > 0", read_jsonl("data.jsonl"))`
+
+Env = t.Mapping[str, t.Any]
+E = t.TypeVar("E", bound=Env)
+Expr = t.Union[str, Compiled]
+
+
+def _fn(expr: Expr) -> t.Callable[[Env], t.Any]:
+    c = compile_expr(expr) if isinstance(expr, str) else expr
+    return c.fn
+
+
+def filter(expr: Expr, iterable: t.Iterable[E]) -> t.Iterator[E]:
+    """yield the envs whose result is truthy"""
+    fn = _fn(expr)
+    for env in iterable:
+        if fn(env):
+            yield env
+
+
+def map(expr: Expr, iterable: t.Iterable[Env]) -> t.Iterator[t.Any]:
+    """yield the result per env"""
+    fn = _fn(expr)
+    for env in iterable:
+        yield fn(env)
+
+
+def project(
+    fields: t.Mapping[str, str], iterable: t.Iterable[Env]
+) -> t.Iterator[t.Dict[str, t.Any]]:
+    """yield a dict (field -> result) per env, the fields share the sub-expressions"""
+    rs: RuleSet[str] = RuleSet(fields, index=False)
+    keys = rs.ids
+    for env in iterable:
+        yield dict(zip(keys, rs.evaluate(env)))
+
+
+def read_jsonl(
+    src: t.Union[str, os.PathLike[str], t.IO[str]], *, name: t.Optional[str] = None
+) -> t.Iterator[Env]:
+    """read JSON lines incrementally (blank lines are skipped)
+
+    if name is given, each line is wrapped as an env, `{name: <line>}`
+    """
+    if isinstance(src, (str, os.PathLike)):
+        with open(src) as rf:
+            yield from read_jsonl(rf, name=name)
+        return
+    for line in src:
+        if not line.strip():
+            continue
+        ob = json.loads(line)
+        yield ob if name is None else {name: ob}
+
+
+# async variants, accepting async iterables (and iterables)
+
+AnyIterable = t.Union[t.AsyncIterable[E], t.Iterable[E]]
+
+
+async def _aiter(iterable: AnyIterable[E]) -> t.AsyncIterator[E]:
+    if isinstance(iterable, t.AsyncIterable):
+        async for x in iterable:
+            yield x
+    else:
+        for x in iterable:
+            yield x
+
+
+async def afilter(expr: Expr, iterable: AnyIterable[E]) -> t.AsyncIterator[E]:
+    fn = _fn(expr)
+    async for env in _aiter(iterable):
+        if fn(env):
+            yield env
+
+
+async def amap(expr: Expr, iterable: AnyIterable[Env]) -> t.AsyncIterator[t.Any]:
+    fn = _fn(expr)
+    async for env in _aiter(iterable):
+        yield fn(env)
+
+
+async def aproject(
+    fields: t.Mapping[str, str], iterable: AnyIterable[Env]
+) -> t.AsyncIterator[t.Dict[str, t.Any]]:
+    rs: RuleSet[str] = RuleSet(fields, index=False)
+    keys = rs.ids
+    async for env in _aiter(iterable):
+        yield dict(zip(keys, rs.evaluate(env)))
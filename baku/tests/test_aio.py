@@ -0,0 +1,126 @@
+# type: ignore
+import asyncio
+import pytest
+
+
+class Service:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+
+    async def lookup(self, x):
+        self.calls.append(x)
+        await asyncio.sleep(self.delay)
+        return {"a": "ok", "b": "ng"}.get(x, x)
+
+    def sync_lookup(self, x):
+        return x * 2
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("svc.lookup(x) == 'ok'", True),
+        ("svc.lookup('b') == 'ok'", False),
+        ("svc.lookup(x) + svc.lookup('b')", "okng"),
+        ("(svc.lookup(x), svc.lookup(1), 2)", ("ok", 1, 2)),
+        ("{svc.lookup(x): [svc.lookup(1)]}", {"ok": [1]}),
+        ("svc.sync_lookup(2) + 1", 5),
+        ("d[svc.lookup(x)]", 10),
+        ("svc.lookup(svc.lookup(x)) == 'ok'", True),
+        ("x + '!'", "a!"),
+        ("0 < svc.lookup(1) < svc.lookup(2) <= 2", True),
+        ("svc.lookup(x) in ['ok', 'ng']", True),
+    ],
+)
+def test_async_evaluate(code, expected):
+    from baku.aio import async_evaluate
+
+    env = {"svc": Service(delay=0), "x": "a", "d": {"ok": 10}}
+    assert asyncio.run(async_evaluate(code, env)) == expected
+
+
+def test_concurrent():
+    import time
+    from baku.aio import async_evaluate
+
+    svc = Service(delay=0.1)
+    code = "[svc.lookup(1), svc.lookup(2), svc.lookup(3)] == [1, 2, 3]"
+    start = time.perf_counter()
+    assert asyncio.run(async_evaluate(code, {"svc": svc})) is True
+    assert time.perf_counter() - start < 0.25  # not 0.3
+    assert sorted(svc.calls) == [1, 2, 3]
+
+
+def test_short_circuit():
+    from baku.aio import async_evaluate
+
+    svc = Service(delay=0)
+    code = "x and svc.lookup(1) or svc.lookup(2)"
+    assert asyncio.run(async_evaluate(code, {"svc": svc, "x": 0})) == 2
+    assert svc.calls == [2]
+
+
+def test_invalid():
+    from baku.aio import async_evaluate
+
+    with pytest.raises(AttributeError):
+        asyncio.run(async_evaluate("svc._private()", {"svc": Service()}))
+
+
+def test_deep():
+    from baku.aio import async_evaluate
+    from baku.minieval import compile_expr
+
+    async def f(x):
+        return x
+
+    code = "f(x)" + " + f(x)" * 2000
+    assert compile_expr(code).evaluate({"f": lambda x: x, "x": 1}) == 2001
+    assert asyncio.run(async_evaluate(code, {"f": f, "x": 1})) == 2001
+    code = "g(x) and (x" + " + f(x)" * 200 + ")"
+    assert asyncio.run(async_evaluate(code, {"f": f, "g": f, "x": 1})) == 201
+    assert asyncio.run(async_evaluate(code, {"f": f, "g": f, "x": 0})) == 0
+
+
+def test_order():
+    from baku.aio import async_evaluate
+
+    svc = Service(delay=0)
+    env = {"svc": svc, "d": {}}
+    # the call is made before the error of the sync sibling (as the sync backends)
+    with pytest.raises(KeyError):
+        asyncio.run(async_evaluate("[svc.lookup(1), svc.lookup(2), d['k']]", env))
+    assert svc.calls == [1, 2]
+
+
+def test_cancel():
+    from baku.aio import async_evaluate
+
+    cancelled = []
+
+    async def slow(x):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(x)
+            raise
+        return x
+
+    async def fail(x):
+        await asyncio.sleep(0)
+        raise ValueError(x)
+
+    env = {"slow": slow, "fail": fail}
+    with pytest.raises(ValueError):
+        asyncio.run(async_evaluate("[fail(1), slow(2), slow(3)]", env))
+    assert cancelled == [2, 3]
+
+    # the first error in order is raised
+    cancelled.clear()
+    code = "[slow(1), fail(2), slow(3)]"
+    env = {"slow": lambda x: fail(x) if x == 1 else slow(x), "fail": fail}
+    with pytest.raises(ValueError) as excinfo:
+        asyncio.run(async_evaluate(code, env))
+    assert excinfo.value.args == (1,)
+    assert cancelled == [3]
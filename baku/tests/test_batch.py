@@ -0,0 +1,108 @@
+# type: ignore
+import pytest
+
+columns = {"x": [0, 5, 10, 11], "y": ["a", "b", "c", "a"]}
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("0 < x <= 10 and y in {'a', 'c'}", [False, False, True, False]),
+        ("x * 2 + 1", [1, 11, 21, 23]),
+        ("x > 5 or y == 'b'", [False, True, True, True]),
+        ("y not in ['a']", [False, True, True, False]),
+        ("1 + 1", [2, 2, 2, 2]),
+    ],
+)
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_evaluate_batch(code, expected, use_numpy):
+    from baku.batch import evaluate_batch
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    actual = evaluate_batch(code, columns, use_numpy=use_numpy)
+    assert list(actual) == expected
+
+
+def test_vectorized():
+    np = pytest.importorskip("numpy")
+    from baku.batch import evaluate_batch
+
+    actual = evaluate_batch("0 < x <= 10", {"x": np.arange(20)})
+    assert isinstance(actual, np.ndarray)
+    assert actual.sum() == 10
+
+
+def test_fallback_to_rows():
+    from baku.batch import evaluate_batch
+
+    actual = evaluate_batch("d['k'] + 1", {"d": [{"k": 1}, {"k": 2}]})
+    assert actual == [2, 3]
+
+
+def test_length_mismatch():
+    from baku.batch import evaluate_batch
+
+    with pytest.raises(ValueError):
+        evaluate_batch("x + y", {"x": [1, 2], "y": [1]}, use_numpy=False)
+
+
+@pytest.mark.parametrize(
+    "code, columns",
+    [
+        ("x == 1", {"x": [1, "a"]}),  # not coerced to str
+        ("x * 2", {"x": [2**62, 1]}),  # not wrapped around (int64)
+        ("x * x * x > 0", {"x": [2**30, 1]}),
+        ("x and y", {"x": [0, 1], "y": ["a", "b"]}),
+        ("y * 2", {"y": ["a", "b"]}),
+        ("x + y", {"x": [True, False], "y": [True, True]}),
+        ("x * 2.5 + y", {"x": [1, 2], "y": [0.5, 1.5]}),
+        ("x in ['1', 2]", {"x": [1, 2]}),
+        ("x in 'abc'", {"x": ["a", "bc", "ac"]}),
+        ("x in {1: 'a'}", {"x": [1, "1"]}),
+        ("x == 'a' or x", {"x": ["a", ""]}),
+        ("x == 'a\\0'", {"x": ["a\0", "a"]}),
+        ("x != None", {"x": [None, 1, "a"]}),
+        ("x < 'b'", {"x": ["a", "c"]}),
+        ("x == 'a\\0' or x in ['b\\0']", {"x": ["a", "b", "c"]}),
+        ("x == [1]", {"x": [[1], [1, 2]]}),
+    ],
+)
+def test_evaluate_batch__same_as_rows(code, columns):
+    pytest.importorskip("numpy")
+    from baku.batch import evaluate_batch
+
+    expected = evaluate_batch(code, columns, use_numpy=False)
+    actual = evaluate_batch(code, columns, use_numpy=True)
+    assert list(actual) == expected
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_evaluate_batch__zero_division(use_numpy):
+    from baku.batch import evaluate_batch
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    with pytest.raises(ZeroDivisionError):
+        evaluate_batch("x / 0", {"x": [1, 2]}, use_numpy=use_numpy)
+
+
+def test_vectorized__str():
+    np = pytest.importorskip("numpy")
+    from baku.batch import evaluate_vectorized
+    from baku.minieval import compile_expr
+
+    c = compile_expr("0 < x <= 10 and y in {'a', 'c'} and z != None")
+    actual = evaluate_vectorized(c, {**columns, "z": [None, 1, "a", 2]})
+    assert isinstance(actual, np.ndarray)
+    assert list(actual) == [False, False, True, False]
+
+    with pytest.raises(NotImplementedError):
+        evaluate_vectorized(compile_expr("y + 'x'"), columns)
+
+
+def test_deep():
+    from baku.batch import evaluate_batch
+
+    actual = evaluate_batch("x" + " + x" * 2000, {"x": [1, 2]})
+    assert list(actual) == [2001, 4002]
@@ -0,0 +1,99 @@
+# type: ignore
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code, env, expected",
+    [
+        ("x + 1", {"x": 1}, 2),
+        ("x * n", {"x": "ab", "n": 3}, "ababab"),
+        ("n * x", {"x": [1], "n": 2}, [1, 1]),
+        ("x + y", {"x": "a", "y": "b"}, "ab"),
+        ("f(x) > 0 and d['k'] in [1, 2]", {"x": 1, "f": abs, "d": {"k": 2}}, True),
+        ("0 < x < 10", {"x": 1}, True),
+    ],
+)
+def test_evaluate(code, env, expected):
+    from baku.budget import Budget, BudgetedExpression
+    from baku.minieval import compile_expr
+
+    budget = Budget(max_visits=100, max_calls=10, max_size=100, timeout=1.0)
+    expr = BudgetedExpression(code, budget)
+    assert expr.evaluate(env) == expected == compile_expr(code).evaluate(env)
+
+
+@pytest.mark.parametrize(
+    "code, env, budget, kind",
+    [
+        ("x * n", {"x": "ab", "n": 10**8}, {"max_size": 100}, "size"),
+        ("n * x", {"x": [1], "n": 10**8}, {"max_size": 100}, "size"),
+        ("x + x", {"x": "a" * 60}, {"max_size": 100}, "size"),
+        ("x + 1 + 1 + 1", {"x": 1}, {"max_visits": 5}, "visits"),
+        ("f(f(f(x)))", {"x": 1, "f": abs}, {"max_calls": 2}, "calls"),
+        (
+            "f(x) + 1",
+            {"x": 0.01, "f": __import__("time").sleep},
+            {"timeout": 0.0},
+            "timeout",
+        ),
+    ],
+)
+def test_evaluate__exceeded(code, env, budget, kind):
+    from baku.budget import Budget, BudgetedExpression, BudgetExceeded
+
+    expr = BudgetedExpression(code, Budget(**budget))
+    with pytest.raises(BudgetExceeded) as excinfo:
+        expr.evaluate(env)
+    assert excinfo.value.kind == kind
+    assert excinfo.value.code == code
+    assert str(excinfo.value).startswith(f"{kind} budget exceeded")
+    assert (expr.stats.evaluations, expr.stats.exceeded) == (1, 1)
+
+
+def test_evaluate__numbers():
+    from baku.budget import Budget, BudgetedExpression
+
+    # arithmetic on numbers is not limited by max_size
+    expr = BudgetedExpression("x * 1000 + 1", Budget(max_size=10))
+    assert expr.evaluate({"x": 1}) == 1001
+
+
+def test_cost():
+    from baku.budget import Budget, BudgetedExpression
+
+    expr = BudgetedExpression("x > 0 and f(x) > 0", Budget())
+    _, cost = expr.evaluate_with_cost({"x": 1, "f": abs})
+    assert (cost.visits, cost.calls) == (9, 1)
+    _, cost = expr.evaluate_with_cost({"x": 0, "f": abs})
+    assert (cost.visits, cost.calls) == (4, 0)  # short-circuited
+
+    stats = expr.stats
+    assert (stats.evaluations, stats.exceeded) == (2, 0)
+    assert (stats.visits, stats.calls) == (13, 1)
+    assert stats.as_dict()["max_elapsed"] >= stats.mean_elapsed > 0
+
+
+def test_deep():
+    from baku.budget import Budget, BudgetedExpression, BudgetExceeded
+
+    code = "x" + " + x" * 300
+    expr = BudgetedExpression(code, Budget(max_size=1000))
+    assert expr.evaluate({"x": 1}) == 301
+    with pytest.raises(BudgetExceeded) as excinfo:
+        expr.evaluate({"x": "abcd"})
+    assert excinfo.value.kind == "size"
+
+    # bounded statically
+    with pytest.raises(BudgetExceeded) as excinfo:
+        BudgetedExpression(code, Budget(max_visits=10)).evaluate({"x": 1})
+    assert excinfo.value.kind == "visits"
+    _, cost = BudgetedExpression(code, Budget()).evaluate_with_cost({"x": 1})
+    assert cost.visits == 601
+
+
+def test_pickle():
+    import pickle
+    from baku.budget import BudgetExceeded
+
+    e = pickle.loads(pickle.dumps(BudgetExceeded("size", 10, "x * n")))
+    assert (e.kind, e.limit, e.code) == ("size", 10, "x * n")
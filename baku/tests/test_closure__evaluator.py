@@ -0,0 +1,76 @@
+# type: ignore
+import pytest
+from baku.tests.test_minieval__evaluator import ob
+
+
+@pytest.mark.parametrize(
+    "code, env",
+    [
+        ("1", None),
+        ("2 * (3 + 1)", None),
+        ("(x + 1) * x", {"x": 10}),
+        ("x * 3", {"x": "foo"}),
+        ("0 < x <= 10 < y < 20", {"x": 10, "y": 20}),
+        ("0 < x <= 10 < y <= 20", {"x": 10, "y": 20}),
+        ("False or 0", None),
+        ("0 < x and x <= 10", {"x": 10}),
+        ("d['x'] + d['y']", {"d": {"x": 10, "y": 20}}),
+        ("ob.x * ob.y", {"ob": ob}),
+        ("x.split(sep='/')", {"x": "foo/bar/boo"}),
+        ("""{"x": d["x"], "y": d.get("y")}""", {"d": {"x": 10}}),
+        ("""{1, x, 3}""", {"x": 10}),
+    ],
+)
+def test_same_as_visitor(code, env):
+    from baku.minieval import compile_expr, ContextForEvaluation
+
+    c = compile_expr(code, cache=False)
+    expected = c.run(ContextForEvaluation(env)).val
+    assert c.fn(env or {}) == expected
+
+
+def test_ng():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("x + _y", cache=False)
+    with pytest.raises(NameError):
+        c.evaluate({"x": 1, "_y": 2})
+
+
+def test_unsupported_operator():
+    import ast
+    from baku.closure import compile_closure
+
+    with pytest.raises(NotImplementedError):
+        compile_closure(ast.parse("x ** 2", mode="eval"))
+
+
+@pytest.mark.parametrize(
+    "code, env",
+    [
+        ("x and f()", {"x": 0}),
+        ("x or f()", {"x": 1}),
+        ("x and y or f()", {"x": 1, "y": 2}),
+        ("x > 1 < f()", {"x": 0}),
+        ("0 < x < 2 < f()", {"x": 3}),
+    ],
+)
+@pytest.mark.parametrize("backend", ["closure", "sealed"])
+def test_short_circuit(code, env, backend):
+    from baku.minieval import compile_expr, ContextForEvaluation
+
+    def f():
+        raise AssertionError("must not be called")
+
+    env = {**env, "f": f}
+    c = compile_expr(code, backend=backend, cache=False)
+    assert c.evaluate(env) == eval(code, {"__builtins__": None}, env)
+    # StrictVisitor is also short-circuited, with ContextForEvaluation
+    assert c.run(ContextForEvaluation(env)).val == c.evaluate(env)
+
+
+def test_short_circuit__building():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("0 < x < 2 < f() and y or g()", cache=False)
+    assert c.build() == "(((((0 < x) and (x < 2)) and (2 < f())) and y) or g())"
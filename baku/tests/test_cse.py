@@ -0,0 +1,131 @@
+# type: ignore
+import pytest
+
+
+def _compile(code, **kwargs):
+    import ast
+    from baku.cse import CSECompiler
+
+    compiler = CSECompiler(min_saved_cost=0, **kwargs)
+    return compiler.compile_toplevel(ast.parse(code).body[0].value)
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("d['a']['b'] > 1 and d['a']['b'] < 10", ["d['a']['b']"]),
+        ("ob.x.y + 1 > 2 and ob.x.y < 100", ["ob.x.y"]),
+        # d['a'] is evaluated only through d['a']['b']
+        ("d['a']['b'] + d['a']['b']", ["d['a']['b']"]),
+        ("d['a']['b'] + d['a']['b'] + d['a']['c']", ["d['a']", "d['a']['b']"]),
+        # calls are impure, by default
+        ("f(x) + f(x)", []),
+        ("d[f(x)] + d[f(x)]", []),
+        ("x + x", []),
+    ],
+)
+def test_plan(code, expected):
+    import ast
+    from baku.cse import plan
+
+    node = ast.parse(code).body[0].value
+    nodes = {id(x): x for x in ast.walk(node)}
+    got = {ast.dump(nodes[i]) for i in plan(node)}
+    assert sorted(got) == sorted(ast.dump(ast.parse(x).body[0].value) for x in expected)
+
+
+def test_evaluate():
+    fn = _compile("d['a']['b'] > 1 and d['a']['b'] < 10")
+    assert fn({"d": {"a": {"b": 5}}}) is True
+    assert fn({"d": {"a": {"b": 10}}}) is False
+    assert fn.stats.subexpressions == 1
+    assert fn.stats.eliminated == 1
+
+
+def test_pure_calls():
+    calls = []
+
+    def f(x):
+        calls.append(x)
+        return x * 2
+
+    env = {"f": f, "x": 3}
+    code = "f(x) != f(x) + 1"
+
+    assert _compile(code)(env) is True
+    assert calls == [3, 3]
+
+    calls.clear()
+    fn = _compile(code, pure_calls=True)
+    assert fn(env) is True
+    assert calls == [3]
+    assert fn.stats.hits == 0  # not counted, by default
+
+    calls.clear()
+    fn = _compile(code, pure_calls=True, count_hits=True)
+    assert fn(env) is True
+    assert fn(env) is True
+    assert calls == [3, 3]
+    assert fn.stats.hits == 2
+
+    calls.clear()
+    fn = _compile(code, pure_calls=lambda node: node.func.id == "g")
+    assert fn(env) is True
+    assert calls == [3, 3]
+
+
+def test_short_circuit():
+    # memoized values are evaluated lazily
+    fn = _compile("'a' in d and d['a']['b'] > 1 and d['a']['b'] < 5")
+    assert fn.stats.subexpressions == 1
+    assert fn({"d": {}}) is False
+    assert fn({"d": {"a": {"b": 3}}}) is True
+    with pytest.raises(KeyError):
+        fn({})
+
+
+def test_backend():
+    import pickle
+    from baku.minieval import compile_expr
+    from baku.cse import CSEFunction
+
+    code = "d['user']['profile']['age'] >= 18 and d['user']['profile']['age'] < 65 and d['user']['profile']['country'] in ['jp', 'us']"
+    c = compile_expr(code, backend="cse", cache=False)
+    assert isinstance(c.fn, CSEFunction)
+    assert c.evaluate({"d": {"user": {"profile": {"age": 20, "country": "jp"}}}})
+    assert c.build() == compile_expr(code, cache=False).build()
+
+    # too cheap to memoize
+    c = compile_expr("x + 1 > x + 1", backend="cse", cache=False)
+    assert not isinstance(c.fn, CSEFunction)
+
+    # repeated subscript chains are memoized, by default
+    c = compile_expr("d['a']['b'] > 1 and d['a']['b'] < 10", backend="cse")
+    assert isinstance(c.fn, CSEFunction)
+    assert c.fn.stats.subexpressions == 1
+    assert c.evaluate({"d": {"a": {"b": 5}}}) is True
+
+    # the threshold is an option of the backend
+    c = compile_expr("x + 1 > x + 1", backend="cse", min_saved_cost=0)
+    assert isinstance(c.fn, CSEFunction)
+    assert compile_expr("x + 1 > x + 1", backend="cse") is not c
+    assert pickle.loads(pickle.dumps(c)).min_saved_cost == 0
+    with pytest.raises(ValueError):
+        compile_expr("x + 1", min_saved_cost=0)
+
+
+def test_impure_call():
+    # the memoized values are forgotten after the impure call
+    code = "d['a']['f'] == 1 and d['a'].update(f=2) is None and d['a']['f'] == 2"
+    fn = _compile(code)
+    assert fn.stats.subexpressions > 0
+    assert fn({"d": {"a": {"f": 1}}}) is True
+
+    # the memoized (mutable) result is not shared across the call
+    code = "f(xs + ys) is None and xs + ys == [1, 2]"
+    fn = _compile(code)
+    assert fn({"f": lambda x: x.append(3), "xs": [1], "ys": [2]}) is True
+
+    # unless the call is pure
+    fn = _compile(code, pure_calls=True)
+    assert fn({"f": lambda x: x.append(3), "xs": [1], "ys": [2]}) is False
@@ -0,0 +1,65 @@
+# type: ignore
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code, names, paths",
+    [
+        ("x + 1", {"x"}, {"x"}),
+        ("d['a']['b'] > 0 and f(d['c'])", {"d", "f"}, {"d['a']['b']", "d['c']", "f"}),
+        (
+            "ob.user.name.startswith(prefix)",
+            {"ob", "prefix"},
+            {"ob.user.name.startswith", "prefix"},
+        ),
+        ("d[k].x", {"d", "k"}, {"d", "k"}),
+        ("d[0] + d['0']", {"d"}, {"d[0]", "d['0']"}),
+        ("1 + 2", set(), set()),
+    ],
+)
+def test_names(code, names, paths):
+    from baku.env import free_names, accesses
+
+    assert free_names(code) == names
+    assert {str(a) for a in accesses(code)} == paths
+
+
+def test_access():
+    from baku.env import accesses, Access
+
+    assert accesses("d['user'].name") == {
+        Access("d", (("item", "user"), ("attr", "name")))
+    }
+
+
+def test_lazy_env():
+    from baku.env import LazyEnv
+    from baku.minieval import literal_eval_plus, ContextForEvaluation
+
+    calls = []
+
+    def load(name):
+        calls.append(name)
+        return {"user": {"age": 20}, "items": [1, 2]}[name]
+
+    env = LazyEnv({"x": lambda: 10}, values={"y": 1}, loader=load)
+    assert literal_eval_plus("user['age'] >= 20 or items[0]", env=env) is True
+    assert literal_eval_plus("user['age'] + x + y", env=env) == 31
+    assert calls == ["user"]  # cached, and items is not loaded
+    assert env.loaded == ["user", "x"]
+
+    # the visitor based evaluation (ContextForEvaluation itself is compiled to closures)
+    class Ctx(ContextForEvaluation):
+        pass
+
+    assert literal_eval_plus("items[1]", env=env, create_ctx=Ctx) == 2
+
+    with pytest.raises(KeyError):
+        literal_eval_plus("z", env=LazyEnv({"x": lambda: 1}))
+    assert "x" in env and "user" in env and "z" not in env
+    assert sorted(env) == ["items", "user", "x", "y"]
+
+    # `in` tries loader(), too (the same as env[name])
+    env = LazyEnv({}, loader=load)
+    assert "items" in env and env.loaded == ["items"]
+    assert "z" not in env
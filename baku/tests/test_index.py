@@ -0,0 +1,108 @@
+# type: ignore
+import math
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("d['kind'] == 'x'", [("eq", "d['kind']", ("x",))]),
+        ("'x' == ob.kind", [("eq", "ob.kind", ("x",))]),
+        ("d['kind'] in ['x', 'y'] and z", [("eq", "d['kind']", ("x", "y"))]),
+        ("0 < x <= 10", [("range", "x", (0, 10))]),
+        ("x > 0 and y and x < 5", [("range", "x", (0, 5))]),
+        ("10 >= x", [("range", "x", (-math.inf, 10))]),
+        ("x == 1 and 0 < y", [("eq", "x", (1,)), ("range", "y", (0, math.inf))]),
+        # not indexable
+        ("x == 1 or y == 2", []),
+        ("f(x) == 1", []),
+        ("d[k] == 1", []),
+        ("x == y", []),
+        ("x in 'abc'", []),
+        ("x < 'z'", []),
+        ("x == [1]", []),
+    ],
+)
+def test_conditions(code, expected):
+    import ast
+    from baku.index import conditions
+
+    def _dump(code):
+        return ast.dump(ast.parse(code).body[0].value)
+
+    got = conditions(ast.parse(code).body[0].value)
+    assert [(c.kind, ast.dump(c.path), c.values) for c in got] == [
+        (kind, _dump(path), values) for kind, path, values in expected
+    ]
+
+
+RULES = {
+    "a": "d['kind'] == 'x' and d['n'] > 1",
+    "b": "d['kind'] in ['x', 'y']",
+    "c": "0 < d['n'] <= 10",
+    "d": "d['n'] > 5 and d['kind'] != 'z'",
+    "e": "d['kind'] == 'z' or d['n'] == 0",  # not indexed
+    "f": "d['n'] == 2.0",
+}
+
+
+@pytest.mark.parametrize("kind", ["x", "y", "z", 1, None])
+@pytest.mark.parametrize("n", [0, 1, 2, 5, 6, 10, 11, -1, 2.5, float("nan")])
+def test_match(kind, n):
+    from baku.rules import RuleSet
+
+    env = {"d": {"kind": kind, "n": n}}
+    assert RuleSet(RULES).match(env) == RuleSet(RULES, index=False).match(env)
+
+
+def test_match__not_comparable():
+    from baku.rules import RuleSet
+
+    rs = RuleSet(RULES)
+    assert len(rs.indexes) == 3
+    assert rs.unindexed == [4]
+
+    # index lookup fails, the rules are evaluated
+    with pytest.raises(TypeError):
+        rs.match({"d": {"kind": ["x"], "n": "x"}})
+    assert rs.match({"d": {"kind": [], "n": 0}}) == ["e"]
+
+
+def test_match__custom_eq():
+    from baku.rules import RuleSet
+
+    class Kind:
+        def __init__(self, name):
+            self.name = name
+
+        def __eq__(self, other):
+            return self.name == other
+
+        def __hash__(self):
+            return id(self)
+
+    # not looked up by the hash (not dropped)
+    env = {"d": {"kind": Kind("x"), "n": 2}}
+    assert RuleSet(RULES).match(env) == RuleSet(RULES, index=False).match(env)
+    assert RuleSet(RULES).match(env) == ["a", "b", "c", "f"]
+
+
+def test_interval_index():
+    import math
+    import random
+    from baku.index import IntervalIndex
+
+    rnd = random.Random(0)
+    ix = IntervalIndex(lambda env: env["x"])
+    intervals = []
+    for i in range(500):
+        lo = rnd.choice([-math.inf, rnd.randint(-50, 50)])
+        hi = rnd.choice([math.inf, rnd.randint(-50, 50)])
+        intervals.append((lo, hi))
+        ix.add(i, lo, hi)
+    ix.freeze()
+
+    for x in [-100, -50, -1, 0, 0.5, 10, 50, 100, math.inf, float("nan")]:
+        expected = [i for i, (lo, hi) in enumerate(intervals) if lo <= x <= hi]
+        assert sorted(ix.candidates({"x": x})) == expected
+    assert ix.candidates({"x": "a"}) == ix.all  # not comparable
@@ -0,0 +1,78 @@
+# type: ignore
+import pytest
+
+
+def test_evaluate():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("0 < x <= 10", cache=False)
+    assert c.evaluate({"x": 10}) is True
+    assert c.evaluate({"x": 11}) is False
+
+
+def test_build():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("d['x'] + 1", cache=False)
+    assert c.build() == "(d['x'] + 1)"
+
+
+def test_invalid():
+    from baku.minieval import compile_expr
+
+    with pytest.raises(NotImplementedError):
+        compile_expr("x = 1", cache=False)
+    with pytest.raises(NotImplementedError):
+        compile_expr("[x for x in xs]", cache=False)
+
+
+def test_cache():
+    from baku.minieval import literal_eval_plus, cache_info, cache_clear
+
+    cache_clear()
+    assert literal_eval_plus("x + 1", env={"x": 1}) == 2
+    assert literal_eval_plus("x + 1", env={"x": 2}) == 3
+    info = cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+
+def test_lru_eviction():
+    from baku.cache import LRUCache
+
+    c = LRUCache(maxsize=2)
+    c.get_or_create("a", str.upper)
+    c.get_or_create("b", str.upper)
+    c.get_or_create("a", str.upper)  # a is recently used
+    c.get_or_create("c", str.upper)  # b is evicted
+
+    assert "a" in c
+    assert "b" not in c
+    info = c.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (1, 3, 1, 2)
+
+
+@pytest.mark.parametrize("backend", ["closure", "sealed", "vm", "cse"])
+def test_pickle(backend):
+    import pickle
+    from baku.minieval import compile_expr
+
+    c = pickle.loads(pickle.dumps(compile_expr("0 < x + 1 <= 10", backend=backend)))
+    assert c.backend == backend
+    assert c.evaluate({"x": 9}) is True
+    assert c.evaluate({"x": 10}) is False
+
+
+def test_pickle__deep_and_node():
+    import ast
+    import pickle
+    from baku.minieval import compile_expr, compile_node
+
+    # pickled by source
+    c = pickle.loads(pickle.dumps(compile_expr("x" + " + 1" * 900, cache=False)))
+    assert c.backend == "vm"
+    assert c.evaluate({"x": 0}) == 900
+
+    # pickled by node
+    c = pickle.loads(pickle.dumps(compile_node(ast.parse("x * 2").body[0].value)))
+    assert c.code == "<ast>"
+    assert c.evaluate({"x": 2}) == 4
@@ -62,3 +62,45 @@ def test_ng():
 
     with pytest.raises(NameError):
         _run("__import__", env={"__import__": None})
+
+
+class _PlainContext:
+    """a context not subclassing ContextProtocol (without ShortCircuit)"""
+
+    def __init__(self, env):
+        from baku.minieval import ContextForEvaluation
+
+        self.ctx = ContextForEvaluation(env)
+
+    def Name(self, name):
+        return self.ctx.Name(name)
+
+    def Value(self, value):
+        return self.ctx.Value(value)
+
+    def Tuple(self, xs):
+        return self.ctx.Tuple(xs)
+
+    def List(self, xs):
+        return self.ctx.List(xs)
+
+    def Set(self, xs):
+        return self.ctx.Set(xs)
+
+    def Dict(self, ks, vs):
+        return self.ctx.Dict(ks, vs)
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("x and y", 2),
+        ("x or y", 1),
+        ("0 < x < y", True),
+        ("y and (x" + " + x" * 200 + ")", 201),  # deeply nested (vm)
+    ],
+)
+def test_context_without_short_circuit(code, expected):
+    from baku.minieval import literal_eval_plus as _run
+
+    assert _run(code, env={"x": 1, "y": 2}, create_ctx=_PlainContext) == expected
@@ -0,0 +1,94 @@
+# type: ignore
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("2 * (3 + 1)", "8"),
+        ("x * (3 + 1)", "(x * 4)"),
+        ("True and x", "x"),
+        ("x and True and y", "(x and y)"),
+        ("x and True", "(x and True)"),
+        ("False and x", "False"),
+        ("x or True or y", "(x or True)"),
+        ("False or x", "x"),
+        ("x or False", "(x or False)"),
+        ("0 < 1 <= 2", "True"),
+        ("0 < x <= 2 * 5", "((0 < x) and (x <= 10))"),
+        ("1 / 0 + x", "((1 / 0) + x)"),
+        ("'x' * 1000", "('x' * 1000)"),
+    ],
+)
+def test_build(code, expected):
+    from baku.minieval import compile_expr
+
+    assert compile_expr(code, cache=False).build() == expected
+
+
+@pytest.mark.parametrize(
+    "code, env",
+    [
+        ("2 * (3 + 1)", {}),
+        ("True and x", {"x": 0}),
+        ("x and True and y", {"x": 1, "y": 2}),
+        ("x or False", {"x": 0}),
+        ("x or 0 or y", {"x": 0, "y": []}),
+        ("x in [1, 2, 3]", {"x": 2}),
+        ("x not in {1, 2, 3}", {"x": 2}),
+        ("x in [[1], 2]", {"x": [1]}),
+        ("[1, 2, 3] + x", {"x": [4]}),
+        ("{'a': 1, 'b': (1, 2)}", {}),
+    ],
+)
+def test_evaluate(code, env):
+    from baku.minieval import compile_expr
+
+    expected = eval(code, {"__builtins__": None}, env)
+    assert compile_expr(code, cache=False).evaluate(env) == expected
+    c = compile_expr(code, optimize=False, cache=False)
+    assert c.evaluate(env) == expected
+
+
+def test_constant_list_is_not_shared():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("[1, 2]", cache=False)
+    x = c.evaluate()
+    x.append(3)
+    assert c.evaluate() == [1, 2]
+
+
+def test_not_modified():
+    import ast
+    from baku.optimize import optimize
+
+    node = ast.parse("1 + 1", mode="eval").body
+    optimize(node)
+    assert isinstance(node, ast.BinOp)
+
+    # unless inplace (e.g. just parsed)
+    node = ast.parse("x + (1 + 1)", mode="eval").body
+    assert optimize(node, inplace=True) is node
+    assert isinstance(node.right, ast.Constant)
+
+
+@pytest.mark.parametrize(
+    "code", ["'ab' * 100000000", "100000000 * b'ab'", "('x',) * 100000000"]
+)
+def test_not_folded__large(code):
+    import ast
+    import tracemalloc
+    from baku.minieval import compile_expr
+    from baku.optimize import optimize
+
+    tracemalloc.start()
+    try:
+        c = compile_expr(code, cache=False)
+        node = optimize(ast.parse(code, mode="eval").body)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1_000_000  # the result is not computed at compile time
+    assert isinstance(c.node, ast.BinOp)
+    assert isinstance(node, ast.BinOp)
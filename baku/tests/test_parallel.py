@@ -0,0 +1,38 @@
+# type: ignore
+import pytest
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_evaluate_parallel(ordered):
+    from baku.parallel import evaluate_parallel
+
+    records = [{"d": {"x": i}} for i in range(100)]
+    got = list(
+        evaluate_parallel(
+            "d['x'] * 2 + 1", records, workers=2, chunksize=7, ordered=ordered
+        )
+    )
+    expected = [i * 2 + 1 for i in range(100)]
+    if ordered:
+        assert got == expected
+    else:
+        assert sorted(got) == expected
+
+
+def test_evaluate_parallel__lazy():
+    from itertools import count, islice
+    from baku.minieval import compile_expr
+    from baku.parallel import evaluate_parallel
+
+    # infinite records, consumed partially
+    c = compile_expr("x > 2")
+    records = ({"x": i} for i in count())
+    got = list(islice(evaluate_parallel(c, records, workers=1, chunksize=3), 5))
+    assert got == [False, False, False, True, True]
+
+
+def test_evaluate_parallel__error():
+    from baku.parallel import evaluate_parallel
+
+    with pytest.raises(KeyError):
+        list(evaluate_parallel("x + 1", [{"x": 1}, {}], workers=1))
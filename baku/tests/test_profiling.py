@@ -0,0 +1,121 @@
+# type: ignore
+import io
+import pytest
+
+
+def test_evaluate():
+    from baku.profiling import Profiler
+
+    profiler = Profiler()
+    for x in range(3):
+        assert profiler.evaluate("x + 1 > 1", {"x": x}) == (x > 0)
+    assert len(profiler.profiles) == 1  # compiled once
+
+    profile = profiler.profiles[0]
+    assert (profile.name, profile.count) == ("x + 1 > 1", 3)
+    assert [(s.kind, s.location, s.text, s.count) for s in profile.nodes] == [
+        ("Compare", "1:0-1:9", "x + 1 > 1", 3),
+        ("BinOp", "1:0-1:5", "x + 1", 3),
+        ("Name", "1:0-1:1", "x", 3),
+        ("Constant", "1:4-1:5", "1", 3),
+        ("Constant", "1:8-1:9", "1", 3),
+    ]
+    root = profile.nodes[0]
+    assert root.elapsed_ns >= profile.nodes[1].elapsed_ns > 0
+
+
+def test_short_circuit():
+    from baku.profiling import Profiler
+
+    profiler = Profiler()
+    expr = profiler.compile("x > 0 and f(x)", name="rule")
+    assert expr.evaluate({"x": 0, "f": abs}) is False
+    assert expr.evaluate({"x": 2, "f": abs}) == 2
+    counts = {s.text: s.count for s in expr.profile.nodes}
+    assert counts["x > 0 and f(x)"] == 2
+    assert counts["f(x)"] == 1
+
+
+def test_disabled():
+    from baku.profiling import Profiler
+
+    profiler = Profiler(enabled=False)
+    expr = profiler.compile("x + 1")
+    assert expr.evaluate({"x": 1}) == 2
+    assert expr.profile.count == 0
+
+    profiler.enable()
+    assert expr.evaluate({"x": 1}) == 2
+    assert expr.profile.count == 1
+    profiler.clear()
+    assert expr.profile.count == 0
+
+
+def test_deep():
+    from baku.profiling import Profiler
+
+    profiler = Profiler()
+    code = "x" + " + x" * 300
+    assert profiler.evaluate(code, {"x": 1}) == 301
+    [node] = profiler.profiles[0].nodes
+    assert (node.kind, node.count) == ("Program", 1)
+
+
+@pytest.mark.parametrize("sort", ["cumulative", "self", "count"])
+def test_report(sort):
+    from baku.profiling import Profiler
+
+    profiler = Profiler()
+    profiler.evaluate("x + 1", {"x": 1})
+    profiler.evaluate("d['k'] in [1, 2]", {"d": {"k": 1}})
+
+    lines = profiler.report(sort=sort, limit=3).splitlines()
+    assert "expression" in lines[0]
+    assert len(lines) == 1 + 2 + 1 + 1 + 3
+    assert "x + 1" in "\n".join(lines[1:3]) and "d['k'] in [1, 2]" in "\n".join(
+        lines[1:3]
+    )
+
+    with pytest.raises(ValueError):
+        profiler.report(sort="xxx")
+
+
+def test_collapsed():
+    from baku.profiling import Profiler
+
+    profiler = Profiler()
+    profiler.evaluate("f(x) + 1", {"x": 1, "f": abs})
+
+    wf = io.StringIO()
+    profiler.dump_collapsed(wf)
+    lines = wf.getvalue().splitlines()
+    assert lines
+    for line in lines:
+        stack, value = line.rsplit(" ", 1)
+        assert int(value) > 0
+        frames = stack.split(";")
+        assert frames[0] == "f(x) + 1"
+        assert frames[1] == "BinOp@1:0-1:8 f(x) + 1"
+
+
+def test_ruleset():
+    from baku.profiling import Profiler
+    from baku.rules import RuleSet
+
+    rules = {"a": "x > 0", "b": "x > 0 and d['k'] == 'v'", "c": "x < 0"}
+    env = {"x": 1, "d": {"k": "v"}}
+    expected = RuleSet(rules).match(env)
+
+    profiler = Profiler()
+    ruleset = RuleSet(rules, profiler=profiler)
+    assert ruleset.match(env) == expected
+    assert ruleset.evaluate(env) == [True, True, False]
+    assert [(p.name, p.count) for p in profiler.profiles] == [
+        ("a", 2),
+        ("b", 2),
+        ("c", 1),  # skipped by the index
+    ]
+
+    profiler.disable()
+    assert ruleset.match(env) == expected
+    assert profiler.profiles[0].count == 2
@@ -46,3 +46,100 @@ def test_complex(q):
     assert (
         str(q("x").Add("y").neg().add(q("int")(True))) == "(- (x + y)).add(int(True))"
     )
+
+
+def test_template(q):
+    from baku.q import QArgs, QBuilder
+
+    args = QArgs(QBuilder(), [q("x"), 1], {"k": q("y")})
+    assert str(q("{{{args}}}", args=args)) == "{x, 1, k=y}"
+    assert str(q("{x!r}", x="y")) == "'y'"
+
+
+def test_compact_node(q):
+    from baku.q import Op, BOP
+
+    x = q("x").Add(q("y"))
+    assert x.val is Op.intern(BOP, "+")
+    assert isinstance(x.kwargs, tuple)
+    assert str(x.Mult(q("z")).neg()) == "(- ((x + y) * z))"
+
+
+def test_custom_mapping():
+    from baku.q import q, QBuilder
+
+    class SQLBuilder(QBuilder):
+        bop_mapping = {"==": "=", "!=": "<>"}
+
+    b = SQLBuilder()
+    assert str(q("x", builder=b).Eq(1).And(q("y", builder=b).NotEq(2))) == (
+        "((x = 1) and (y <> 2))"
+    )
+
+
+def test_render_cache(monkeypatch):
+    import gc
+    import baku.q
+    from baku.q import q, QBuilder
+
+    b = QBuilder()
+    guard = q("d", builder=b)["tenant"].Eq(q("t"))
+    queries = [guard.And(q("x", builder=b).Gt(i)) for i in range(3)]
+
+    assert str(queries[0]) == "((d['tenant'] == t) and (x > 0))"
+    assert str(queries[1]) == "((d['tenant'] == t) and (x > 1))"  # guard is memoized
+
+    calls = []
+    original = baku.q._expand
+    monkeypatch.setattr(
+        baku.q, "_expand", lambda ob, b: calls.append(ob) or original(ob, b)
+    )
+    assert str(queries[2]) == "((d['tenant'] == t) and (x > 2))"
+    assert guard not in calls
+
+    calls.clear()
+    del guard, queries
+    gc.collect()
+    assert len(b.render_cache) == 0  # weak references
+
+
+def test_interning():
+    import gc
+    from baku.q import q, InterningQBuilder
+
+    b = InterningQBuilder()
+
+    def build(n):
+        x = q("x", builder=b)
+        return x["kind"].In(["a", "b"]).And(x.f(n, k=b.leaf("y"))).Or(q("z", builder=b).Not())
+
+    x = build(1)
+    assert build(1) is x
+    assert build(2) is not x
+    assert b.leaf("x") is b.leaf("x")
+    assert b.leaf(1) is not b.leaf(True)
+    assert q("x", builder=b).Eq(1) is not q("x", builder=b).Eq(True)
+    assert str(b.leaf(0.0)) == "0.0" and str(b.leaf(-0.0)) == "-0.0"
+    assert str(q("x", builder=b).Add(0.0)) == "(x + 0.0)"
+    assert str(q("x", builder=b).Add(-0.0)) == "(x + -0.0)"
+    assert str(q("x", builder=b).Add([-0.0])) == "(x + [-0.0])"
+    assert str(x) == "(((x['kind'] in ['a', 'b']) and x.f(1, k=y)) or (not z))"
+
+    plans = {x: "plan"}
+    assert plans[build(1)] == "plan"
+
+    del x, plans
+    gc.collect()
+    assert len(b.table) == 0  # weak references
+
+
+def test_pickle():
+    import pickle
+    from baku.q import q, QBuilder, InterningQBuilder
+
+    for b in [QBuilder(), InterningQBuilder()]:
+        x = q("x", builder=b)
+        expr = x.f(1).And(x["k"].g(a=q("y"))).Or(q("{a} - {b}", a=1, b=x.Not()))
+        expected = "((x.f(1) and x['k'].g(a=y)) or 1 - (not x))"
+        assert str(expr) == expected
+        assert str(pickle.loads(pickle.dumps(expr))) == expected
@@ -0,0 +1,76 @@
+# type: ignore
+import pytest
+
+RULES = {
+    "jp-adult": "d['country'] == 'jp' and d['age'] >= 20",
+    "us-adult": "d['country'] == 'us' and d['age'] >= 21",
+    "adult": "d['age'] >= 20",
+    "teen": "13 <= d['age'] < 20",
+}
+
+
+@pytest.mark.parametrize(
+    "env, expected",
+    [
+        ({"d": {"country": "jp", "age": 20}}, ["jp-adult", "adult"]),
+        ({"d": {"country": "us", "age": 20}}, ["adult"]),
+        ({"d": {"country": "us", "age": 15}}, ["teen"]),
+    ],
+)
+def test_match(env, expected):
+    from baku.rules import RuleSet
+
+    rs = RuleSet(RULES)
+    assert rs.match(env) == expected
+
+
+def test_evaluate():
+    from baku.rules import RuleSet
+    from baku.minieval import literal_eval_plus
+
+    rs = RuleSet(list(RULES.values()))
+    assert len(rs) == 4
+    assert rs.ids == [0, 1, 2, 3]
+
+    env = {"d": {"country": "jp", "age": 30}}
+    assert rs.evaluate(env) == [
+        literal_eval_plus(code, env=env) for code in RULES.values()
+    ]
+
+
+def test_shared():
+    from baku.rules import RuleSet
+
+    loaded = []
+
+    class Env(dict):
+        def __missing__(self, name):
+            loaded.append(name)
+            return {"country": "jp", "age": 30}
+
+    rs = RuleSet(RULES)
+    assert rs.stats.subexpressions == 3  # d['country'], d['age'], d['age'] >= 20
+    assert rs.match(Env()) == ["jp-adult", "adult"]
+    assert loaded == ["d"]  # names are looked up once per env
+
+
+def test_deep():
+    from baku.rules import RuleSet
+
+    rs = RuleSet(["x" + " + 1" * 200, "x > 0"])
+    assert rs.evaluate({"x": 1}) == [201, True]
+
+
+def test_impure_call():
+    from baku.rules import RuleSet
+
+    # a rule mutating the env by a call, the later rules see the new value
+    rules = [
+        "d['a']['f'] == 1 and d['a']['g'] > 0",
+        "d['a'].update(f=2) is None",
+        "d['a']['f'] == 2 and d['a']['g'] > 0",
+    ]
+    rs = RuleSet(rules, index=False)
+    assert rs.stats.subexpressions > 0
+    assert rs.evaluate({"d": {"a": {"f": 1, "g": 1}}}) == [True, True, True]
+    assert rs.match({"d": {"a": {"f": 1, "g": 1}}}) == [0, 1, 2]
@@ -0,0 +1,175 @@
+# type: ignore
+import typing as t
+import pytest
+
+SCHEMA = {
+    "x": int,
+    "y": float,
+    "name": str,
+    "d": t.Dict[str, int],
+    "xs": t.List[int],
+    "pair": t.Tuple[str, float],
+    "b": bytes,
+}
+ENV = {
+    "x": 3,
+    "y": 0.5,
+    "name": "foo",
+    "d": {"a": 1},
+    "xs": [4, 5],
+    "pair": ("p", 1.5),
+    "b": b"AB\x03",
+}
+
+
+@pytest.mark.parametrize(
+    "code, typ",
+    [
+        ("x", int),
+        ("x + 1", int),
+        ("x + y", float),
+        ("x / 2", float),
+        ("True + True", int),
+        ("name * x", str),
+        ("d['a']", int),
+        ("d['a'] + 1 > x", bool),
+        ("xs[0]", int),
+        ("pair[1]", float),
+        ("name[0]", str),
+        ("x > 1 and y > 1", bool),
+        ("x or name", t.Any),
+        ("f(x) + 1", t.Any),
+        ("ob.x + 1", t.Any),
+        ("unknown + 1", t.Any),
+    ],
+)
+def test_infer(code, typ):
+    from baku.minieval import compile_expr
+    from baku.schema import TypeInference
+
+    c = compile_expr(code, optimize=False, cache=False)
+    assert TypeInference(SCHEMA).infer(c.node) == typ
+
+
+@pytest.mark.parametrize(
+    "code, msg",
+    [
+        ("x + 'a'", "unsupported operand type(s) for +: 'int' and 'str'"),
+        ("d['a'] - name", "unsupported operand type(s) for -: 'int' and 'str'"),
+        ("x > name", "'>' not supported between instances of 'int' and 'str'"),
+        ("0 < x < name", "'<' not supported between instances of 'int' and 'str'"),
+        ("d[1]", "the key of 'dict' must be 'str', not 'int'"),
+        ("xs['a']", "'list' indices must be integers, not 'str'"),
+        ("x[0]", "'int' object is not subscriptable"),
+        ("1 in x", "argument of type 'int' is not iterable"),
+        ("x in name", "'in <str>' requires str as left operand, not int"),
+        ("y in b", "'in <bytes>' requires bytes as left operand, not float"),
+    ],
+)
+def test_reject(code, msg):
+    from baku.minieval import compile_expr
+    from baku.schema import TypeCheckError
+
+    with pytest.raises(TypeCheckError) as excinfo:
+        compile_expr(code, schema=SCHEMA, cache=False)
+    assert str(excinfo.value) == f"1:0: {msg}"
+
+
+@pytest.mark.parametrize("backend", ["closure", "sealed", "vm", "cse"])
+def test_reject__backend(backend):
+    from baku.minieval import compile_expr
+    from baku.schema import TypeCheckError
+
+    with pytest.raises(TypeCheckError):
+        compile_expr("x + 'a'", schema=SCHEMA, backend=backend, cache=False)
+
+    # deeply nested
+    with pytest.raises(TypeCheckError):
+        compile_expr("x" + " + 1" * 300 + " + 'a'", schema=SCHEMA, cache=False)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "x > 1",
+        "x + y * 2 - 1",
+        "d['a'] + 1 > x",
+        "x in [1, 2, 3]",
+        "x not in {1, 2, 3}",
+        "name in d",
+        "xs[0] * 2 == 8",
+        "x / 2 < 1.5 and name == 'foo'",
+        "1 < x < 10",
+        "name.startswith('f') or x is None",
+        "f(x) + 1",
+        "[x, y][0] + pair[1]",
+        "x in b",
+        "65 in b and True not in b",
+        "b'A' in b",
+    ],
+)
+def test_evaluate(code):
+    from baku.minieval import compile_expr
+
+    env = {**ENV, "f": lambda v: v * 10}
+    typed = compile_expr(code, schema=SCHEMA, cache=False)
+    generic = compile_expr(code, cache=False)
+    assert typed.evaluate(env) == generic.evaluate(env)
+
+
+def test_specialized():
+    from baku.minieval import compile_expr
+    from baku.schema import TypedCompiler, infer_types
+
+    def compile(code, schema):
+        node = compile_expr(code, cache=False).node
+        compiler = TypedCompiler(infer_types(node, schema))
+        return compiler.compile(node), compiler.specialized
+
+    # Compare, BinOp and Subscript
+    fn, n = compile("d['a'] + 1 > x", SCHEMA)
+    assert n == 3
+    assert fn(ENV) is False
+
+    # unknown types, generic dispatch
+    fn, n = compile("d['a'] + 1 > x", {})
+    assert n == 0
+    assert fn(ENV) is False
+
+    # the missing name is KeyError, as usual
+    fn, _ = compile("x > 1", SCHEMA)
+    with pytest.raises(KeyError):
+        fn({})
+
+
+def test_specialized__overridden_operator():
+    import operator
+    from baku.minieval import compile_expr
+    from baku.q import QEvaluator
+    from baku.schema import TypedCompiler, infer_types
+
+    class Evaluator(QEvaluator):
+        bop_mapping = {**QEvaluator.bop_mapping, "+": operator.sub}
+
+    node = compile_expr("x + 1", cache=False).node
+    compiler = TypedCompiler(infer_types(node, SCHEMA), evaluator=Evaluator())
+    assert compiler.compile(node)({"x": 3}) == 2
+    assert compiler.specialized == 0
+
+
+def test_schema():
+    import pickle
+    from baku.minieval import compile_expr
+    from baku.schema import Schema
+
+    assert Schema(SCHEMA) == SCHEMA
+    assert hash(Schema(SCHEMA)) == hash(Schema(dict(reversed(list(SCHEMA.items())))))
+
+    # dict is accepted, and cached by the schema
+    c = compile_expr("x + 1", schema=SCHEMA)
+    assert compile_expr("x + 1", schema=Schema(SCHEMA)) is c
+    assert compile_expr("x + 1") is not c
+
+    loaded = pickle.loads(pickle.dumps(c))
+    assert loaded.schema == c.schema
+    assert loaded.evaluate(ENV) == 4
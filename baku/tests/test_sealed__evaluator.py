@@ -0,0 +1,76 @@
+# type: ignore
+import pytest
+from baku.tests.test_minieval__evaluator import ob
+
+
+@pytest.mark.parametrize(
+    "code, env",
+    [
+        ("2 * (3 + 1)", None),
+        ("(x + 1) * x", {"x": 10}),
+        ("0 < x <= 10 < y <= 20", {"x": 10, "y": 20}),
+        ("0 < x and x <= 10", {"x": 10}),
+        ("d['x'] + d['y']", {"d": {"x": 10, "y": 20}}),
+        ("ob.x * ob.y", {"ob": ob}),
+        ("x.split(sep='/')", {"x": "foo/bar/boo"}),
+        ("""{"x": d["x"], "y": d.get("y")}""", {"d": {"x": 10}}),
+        ("""{1, x, 3}""", {"x": 10}),
+    ],
+)
+def test_same_as_closure(code, env):
+    from baku.minieval import compile_expr
+
+    sealed = compile_expr(code, backend="sealed", cache=False)
+    closure = compile_expr(code, cache=False)
+    assert sealed.evaluate(env) == closure.evaluate(env)
+
+
+def test_no_builtins():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("len(x)", backend="sealed", cache=False)
+    with pytest.raises(KeyError):
+        c.evaluate({"x": [1]})  # len is not in env
+    assert c.evaluate({"x": [1], "len": len}) == 1
+
+
+def test_ng():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("_x + 1", backend="sealed", cache=False)
+    with pytest.raises(NameError):
+        c.evaluate({"_x": 1})
+
+
+def test_checked_getattr():
+    from baku.sealed import _getattr
+
+    with pytest.raises(AttributeError):
+        _getattr(ob, "__class__")
+    assert _getattr(ob, "x") == 10
+
+
+def test_unknown_backend():
+    from baku.minieval import compile_expr
+
+    with pytest.raises(ValueError):
+        compile_expr("x", backend="jit", cache=False)
+
+
+@pytest.mark.parametrize(
+    "code, exc",
+    [
+        ("x ** 2", NotImplementedError),
+        ("-x", NotImplementedError),
+        ("f(*a)", NotImplementedError),
+        ("f(**k)", NotImplementedError),
+        ("{**d}", NotImplementedError),
+        ("x._y", AttributeError),
+    ],
+)
+def test_compile_sealed__validation(code, exc):
+    import ast
+    from baku.sealed import compile_sealed
+
+    with pytest.raises(exc):
+        compile_sealed(ast.parse(code, mode="eval").body)
@@ -0,0 +1,213 @@
+# type: ignore
+import pytest
+
+
+def test_roundtrip():
+    from baku.minieval import compile_expr
+    from baku.store import dumps, loads, to_entry, from_entry, source_key
+
+    codes = ["x + 1", "d['a'] > 0 and x in [1, 2]", "x" + " + 1" * 300]
+    entries = {source_key(code): to_entry(compile_expr(code)) for code in codes}
+    loaded = loads(dumps(entries))
+    assert list(loaded) == list(entries)
+
+    for code, entry in zip(codes, loaded.values()):
+        c = from_entry(entry)
+        expected = compile_expr(code)
+        assert c.code == code
+        assert c.backend == expected.backend
+        assert c.evaluate({"x": 1, "d": {"a": 1}}) == expected.evaluate(
+            {"x": 1, "d": {"a": 1}}
+        )
+
+    # deeply nested, stored by source
+    assert loaded[source_key(codes[-1])][-1] is None
+
+
+def test_source_key():
+    from baku.store import source_key
+
+    assert source_key("x + 1") == source_key("x + 1")
+    assert source_key("x + 1") != source_key("x + 2")
+    assert source_key("x + 1") != source_key("x + 1", backend="vm")
+    assert source_key("x + 1") != source_key("x + 1", optimize=False)
+
+
+def test_loads__invalid(monkeypatch):
+    from baku import store
+    from baku.store import dumps, loads, from_entry, FormatError
+
+    with pytest.raises(FormatError):
+        loads(b"xxxx")
+    with pytest.raises(FormatError):
+        from_entry(("x", "closure", True, "["))
+    with pytest.raises(FormatError):
+        from_entry(("x", "closure", True, ["Name", "x", ["Load"]]))  # not a string
+
+    data = dumps({})
+    monkeypatch.setattr(store, "FORMAT_VERSION", store.FORMAT_VERSION + 1)
+    with pytest.raises(FormatError):
+        loads(data)
+
+
+def test_store(tmp_path):
+    from baku.store import Store
+
+    store = Store(tmp_path)
+    assert store.load() == 0
+    c = store.compile("x + 1")
+    assert c.evaluate({"x": 1}) == 2
+    assert (store.hits, store.misses) == (0, 1)
+    assert store.save() is True
+    assert store.save() is False  # not modified
+
+    store = Store(tmp_path)
+    assert store.load() == 1
+    cs = store.compile_many(["x + 1", "x + 2"])
+    assert [c.evaluate({"x": 1}) for c in cs] == [2, 3]
+    assert (store.hits, store.misses) == (1, 1)
+    assert store.save() is True
+    assert Store(tmp_path).load() == 2
+    assert [p.name for p in tmp_path.iterdir()] == ["default.baku"]
+
+
+def test_store__broken(tmp_path):
+    from baku.store import Store
+
+    (tmp_path / "default.baku").write_bytes(b"BAKU\x00\x00")
+    store = Store(tmp_path)
+    assert store.load() == 0
+    store.compile("x")
+    assert store.save() is True
+    assert Store(tmp_path).load() == 1
+
+
+def test_ruleset(tmp_path):
+    from baku.rules import RuleSet
+    from baku.store import Store
+
+    rules = {"a": "x > 0", "b": "x > 0 and d['k'] == 'v'", "c": "x < 0"}
+    store = Store(tmp_path, name="rules")
+    expected = RuleSet(rules, store=store).match({"x": 1, "d": {"k": "v"}})
+    assert expected == ["a", "b"]
+    store.save()
+
+    store = Store(tmp_path, name="rules")
+    store.load()
+    assert RuleSet(rules, store=store).match({"x": 1, "d": {"k": "v"}}) == expected
+    assert (store.hits, store.misses) == (3, 0)
+
+
+def test_header():
+    from baku.store import header
+
+    h = header()
+    assert h["baku"] != "unknown"
+    assert len(h["digest"]) == 16
+
+
+def test_loads__pickle(tmp_path):
+    import pickle
+    from baku.store import Store
+
+    class Evil:
+        def __reduce__(self):
+            return (exec, ("raise SystemExit('executed')",))
+
+    (tmp_path / "default.baku").write_bytes(b"BAKU" + pickle.dumps(Evil()))
+    store = Store(tmp_path)
+    assert store.load() == 0  # not unpickled
+
+
+_X = [0, "x", 1, 0, 1, 1]  # x
+
+
+@pytest.mark.parametrize(
+    "node",
+    [
+        [*_X, 6, "__class__", 1, 0, 1, 11],  # private
+        [*_X, 6, None, 1, 0, 1, 3],
+        [0, "f", 1, 0, 1, 1, *_X, 7, 0, [[None, 1, 2, 1, 5]], 1, 0, 1, 6],  # **d
+        [0, "f", 1, 0, 1, 1, *_X, 7, -2, [], 1, 0, 1, 6],
+        [12, 1, 0, 1, 1],
+        [0, "x"],
+        [0, "x", 1, 0, 1, "1"],
+        [0, "x", 1, 5, 1, 1],
+        [0, "None", 1, 0, 1, 4],
+        [0, "1x", 1, 0, 1, 2],
+        [0, [1, "x"], 1, 0, 1, 1],
+        [1, ["o", 1], None, 1, 0, 1, 1],
+        [1, {"x": 1}, None, 1, 0, 1, 1],
+        [1, 1, "k", 1, 0, 1, 1],
+        [*_X, *_X],
+        [2, 0, 1, 0, 1, 5],
+        [*_X, *_X, 2, -1, 1, 0, 1, 5],
+        [*_X, *_X, 2, 9, 1, 0, 1, 5],
+        [*_X, 3, 0, 1, 1, 0, 1, 1],
+        [*_X, 4, [], 1, 0, 1, 1],
+        [*_X, 11, 1, 1, 0, 1, 1],
+        [],
+        {"n": "Name", "f": ["x", ["Load"]]},
+        "[",
+    ],
+)
+def test_store__tampered(tmp_path, node):
+    import json
+    from baku.store import Store, dumps, from_entry, source_key, FormatError
+
+    key = source_key("x")
+    entry = ("x", "closure", True, json.dumps(node))
+    with pytest.raises(FormatError):
+        from_entry(entry)
+
+    (tmp_path / "default.baku").write_bytes(dumps({key: entry}))
+    store = Store(tmp_path)
+    assert store.load() == 1
+    c = store.compile("x")  # compiled again
+    assert c.evaluate({"x": 1}) == 1
+    assert (store.hits, store.misses) == (0, 1)
+    assert store.save() is True
+
+
+def test_store__mismatch(tmp_path):
+    from baku.minieval import compile_expr
+    from baku.store import Store, dumps, source_key, to_entry
+
+    # the entry of other source code
+    entry = to_entry(compile_expr("True"))
+    (tmp_path / "default.baku").write_bytes(dumps({source_key("x"): entry}))
+    store = Store(tmp_path)
+    store.load()
+    assert store.compile("x").evaluate({"x": 0}) == 0
+    assert store.misses == 1
+
+
+def test_encode():
+    import ast
+    from baku.minieval import compile_expr
+    from baku.store import encode, decode
+
+    codes = [
+        "x + 1.5 - 2j",
+        "f(x, k=b'\\x00') in (1, 'a', None, ...)",
+        "not_x is not None or [x, {1: 2}, {3}]",
+        "x.y[0] <= 1 < 2",
+    ]
+    for code in codes:
+        node = compile_expr(code).node
+        assert ast.dump(decode(encode(node)), include_attributes=True) == ast.dump(
+            node, include_attributes=True
+        )
+
+
+def test_from_entry__lazy():
+    from baku.minieval import compile_expr, Compiled
+    from baku.store import from_entry, to_entry
+
+    c = from_entry(to_entry(compile_expr("x + 1")))
+    with pytest.raises(AttributeError):
+        Compiled.fn.__get__(c)  # compiled on the first use
+    assert c.evaluate({"x": 1}) == 2
+    assert Compiled.fn.__get__(c) is c.fn
+    with pytest.raises(AttributeError):
+        c.foo
@@ -0,0 +1,46 @@
+# type: ignore
+import asyncio
+
+
+def test_filter_map_project():
+    from itertools import count, islice
+    from baku import stream
+
+    envs = ({"x": i, "d": {"k": i % 3}} for i in count())  # infinite
+    got = list(islice(stream.filter("d['k'] == 0", envs), 3))
+    assert [env["x"] for env in got] == [0, 3, 6]
+
+    assert list(stream.map("x * 2", [{"x": 1}, {"x": 2}])) == [2, 4]
+    assert list(
+        stream.project({"y": "x + 1", "big": "x + 1 > 1"}, [{"x": 0}, {"x": 1}])
+    ) == [{"y": 1, "big": False}, {"y": 2, "big": True}]
+
+
+def test_read_jsonl(tmp_path):
+    from baku import stream
+
+    path = tmp_path / "data.jsonl"
+    path.write_text('{"x": 1}\n\n{"x": 2}\n{"x": 3}\n')
+
+    assert list(stream.map("x", stream.read_jsonl(str(path)))) == [1, 2, 3]
+    with path.open() as rf:
+        got = stream.filter("d['x'] >= 2", stream.read_jsonl(rf, name="d"))
+        assert list(got) == [{"d": {"x": 2}}, {"d": {"x": 3}}]
+
+
+def test_async():
+    from baku import stream
+
+    async def envs():
+        for i in range(5):
+            await asyncio.sleep(0)
+            yield {"x": i}
+
+    async def run():
+        return (
+            [env["x"] async for env in stream.afilter("x > 2", envs())],
+            [v async for v in stream.amap("x * 2", envs())],
+            [v async for v in stream.aproject({"y": "x"}, [{"x": 1}])],
+        )
+
+    assert asyncio.run(run()) == ([3, 4], [0, 2, 4, 6, 8], [{"y": 1}])
@@ -0,0 +1,107 @@
+# type: ignore
+import sys
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+
+@pytest.fixture
+def switch_often():
+    # switch threads frequently, to surface races
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def _run_concurrently(fn, args, *, workers=8):
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(fn, args))
+
+
+@pytest.mark.parametrize("backend", ["closure", "sealed", "vm", "cse"])
+def test_evaluate(switch_often, backend):
+    from baku.minieval import compile_expr
+
+    code = "d['x'] + d['x'] * 2 > 10 and d['k'] in ['a', 'c'] and d['x'] + d['x'] * 2 < 1000"
+    c = compile_expr(code, backend=backend, cache=False)
+    envs = [{"d": {"x": i, "k": "abcd"[i % 4]}} for i in range(2000)]
+    expected = [c.evaluate(env) for env in envs]
+    assert _run_concurrently(c.evaluate, envs) == expected
+
+
+def test_literal_eval_plus(switch_often):
+    from baku.minieval import literal_eval_plus, cache_clear
+
+    cache_clear()
+    codes = [f"x + {i % 10}" for i in range(1000)]
+    got = _run_concurrently(lambda code: literal_eval_plus(code, env={"x": 1}), codes)
+    assert got == [1 + i % 10 for i in range(1000)]
+
+
+def test_build(switch_often):
+    from baku.q import q, QBuilder
+
+    b = QBuilder()
+    guard = q("d", builder=b)["tenant"].Eq(q("t"))
+    queries = [guard.And(q("x", builder=b).Gt(i % 10)) for i in range(1000)]
+    got = _run_concurrently(str, queries)
+    assert got == [f"((d['tenant'] == t) and (x > {i % 10}))" for i in range(1000)]
+
+
+def test_render_cache(switch_often):
+    from baku.q import q
+
+    # the default builder (shared by all threads), the render cache is per thread
+    guard = q("d")["tenant"].Eq(q("t"))
+    queries = [guard.And(q("x").Gt(i % 10)) for i in range(1000)]
+    got = _run_concurrently(str, queries)
+    assert got == [f"((d['tenant'] == t) and (x > {i % 10}))" for i in range(1000)]
+
+    b = guard.builder
+    caches = _run_concurrently(lambda _: id(b.render_cache), range(8), workers=1)
+    assert len(set(caches)) == 1
+    assert b.render_cache is not _run_concurrently(lambda _: b.render_cache, [0])[0]
+
+
+def test_cse_hits(switch_often):
+    import ast
+    from baku.cse import CSECompiler
+
+    code = "d['a']['b'] > 1 and d['a']['b'] < 10"
+    fn = CSECompiler(count_hits=True).compile_toplevel(ast.parse(code).body[0].value)
+    envs = [{"d": {"a": {"b": i % 10}}} for i in range(2000)]
+    got = _run_concurrently(fn, envs)
+    assert got == [1 < i % 10 < 10 for i in range(2000)]
+    assert fn.stats.hits == sum(1 for i in range(2000) if i % 10 > 1)  # exact
+
+
+def test_interning(switch_often):
+    from baku.q import q, InterningQBuilder
+
+    b = InterningQBuilder()
+
+    def build(i):
+        x = q("x", builder=b)
+        return x["k"].Add(i % 5).Mult(x.y)
+
+    nodes = _run_concurrently(build, range(1000))
+    assert len({id(x) for x in nodes}) == 5
+
+
+def test_ruleset(switch_often):
+    from baku.rules import RuleSet
+
+    rs = RuleSet({f"r{i}": f"d['k'] == {i % 7} and d['x'] > {i}" for i in range(100)})
+    envs = [{"d": {"k": i % 7, "x": i}} for i in range(500)]
+    expected = [rs.match(env) for env in envs]
+    assert _run_concurrently(rs.match, envs) == expected
+
+
+def test_immutable():
+    from baku.minieval import compile_expr
+
+    c = compile_expr("x + 1")
+    with pytest.raises(AttributeError):
+        c.fn = None
+    with pytest.raises(AttributeError):
+        del c.code
@@ -0,0 +1,53 @@
+# type: ignore
+import io
+import json
+
+
+def test_evaluate():
+    from baku.tracing import Tracer
+
+    tracer = Tracer()
+    assert tracer.evaluate("x + 1 > 1", {"x": 1}) is True
+
+    events = tracer.dump()
+    assert [(ev["node"], ev["depth"], ev["result"]) for ev in events] == [
+        ("Name", 2, "int"),
+        ("Constant", 2, "int"),
+        ("BinOp", 1, "int"),
+        ("Constant", 1, "int"),
+        ("Compare", 0, "bool"),
+    ]
+    assert all(ev["elapsed_ns"] >= 0 for ev in events)
+
+
+def test_literal_eval_plus():
+    from baku.minieval import literal_eval_plus
+    from baku.tracing import Tracer
+
+    tracer = Tracer(maxlen=2)
+    assert literal_eval_plus("x and y", env={"x": 1, "y": 2}, tracer=tracer) == 2
+    assert [ev.node for ev in tracer.events] == ["Name", "BoolOp"]  # ring buffer
+
+    wf = io.StringIO()
+    tracer.dump_jsonl(wf)
+    assert [json.loads(line)["node"] for line in wf.getvalue().splitlines()] == [
+        "Name",
+        "BoolOp",
+    ]
+
+
+def test_deep():
+    from baku.minieval import literal_eval_plus
+    from baku.tracing import Tracer
+
+    tracer = Tracer(maxlen=5)
+    code = "x" + " + f(x)" * 300
+    assert literal_eval_plus(code, env={"x": 1, "f": abs}, tracer=tracer) == 301
+    assert [ev.node for ev in tracer.events] == [
+        "vm:BINOP",
+        "vm:NAME",
+        "vm:NAME",
+        "vm:CALL",
+        "vm:BINOP",
+    ]
+    assert tracer.events[-1].result == "int"
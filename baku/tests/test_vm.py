@@ -0,0 +1,86 @@
+# type: ignore
+import ast
+import pytest
+from baku.tests.test_minieval__evaluator import ob
+
+
+@pytest.mark.parametrize(
+    "code, env",
+    [
+        ("1", None),
+        ("2 * (3 + 1)", None),
+        ("(x + 1) * x", {"x": 10}),
+        ("0 < x <= 10 < y < 20", {"x": 10, "y": 20}),
+        ("0 < x <= 10 < y <= 20", {"x": 10, "y": 20}),
+        ("0 < x < 5 < y", {"x": 10}),
+        ("x and y or z", {"x": 1, "y": 0, "z": 3}),
+        ("x or y and z", {"x": 1}),
+        ("d['x'] + d['y']", {"d": {"x": 10, "y": 20}}),
+        ("ob.x * ob.y", {"ob": ob}),
+        ("x.split(sep='/')", {"x": "foo/bar/boo"}),
+        ("""(d["x"], d.get("y"))""", {"d": {"x": 10}}),
+        ("""{"x": d["x"], "y": [d.get("y"), 1]}""", {"d": {"x": 10}}),
+        ("""{1, x, 3}""", {"x": 10}),
+    ],
+)
+def test_evaluate(code, env):
+    from baku.minieval import compile_expr, ContextForEvaluation
+
+    c = compile_expr(code, backend="vm", cache=False)
+    expected = eval(code, {"__builtins__": None}, env)
+    assert c.evaluate(env) == expected
+    assert c.run(ContextForEvaluation(env)).val == expected
+
+
+@pytest.mark.parametrize(
+    "code",
+    ["0 < x <= 10 < y", "x and y or f(z, k=1)", "d['x'].y", "[x, (y, z), {1: x}]"],
+)
+def test_build(code):
+    from baku.minieval import compile_expr
+
+    expected = compile_expr(code, cache=False).build()
+    assert compile_expr(code, backend="vm", cache=False).build() == expected
+
+
+def test_ng():
+    from baku.minieval import compile_expr
+
+    with pytest.raises(NameError):
+        compile_expr("x + _y", backend="vm", cache=False).evaluate({"x": 1, "_y": 1})
+
+
+def _deep(n):
+    # ((((x + 1) + 1) ...) + 1)
+    node = ast.Name(id="x", ctx=ast.Load())
+    for _ in range(n):
+        node = ast.BinOp(left=node, op=ast.Add(), right=ast.Constant(value=1))
+    return node
+
+
+def test_deep():
+    from baku.minieval import compile_node
+
+    n = 10000
+    c = compile_node(_deep(n))
+    assert c.backend == "vm"
+    assert c.evaluate({"x": 0}) == n
+    assert c.build() == "(" * n + "x" + " + 1)" * n
+
+
+def test_long_or():
+    from baku.minieval import compile_expr
+
+    code = " or ".join(f"x == {i}" for i in range(3000))
+    c = compile_expr(code, cache=False)
+    assert c.evaluate({"x": 2999}) is True
+    assert c.evaluate({"x": -1}) is False
+
+
+def test_deep_render():
+    from baku.q import q, QBuilder
+
+    x = q("x", builder=QBuilder())
+    for _ in range(10000):
+        x = x.Add(q("1"))
+    assert str(x).startswith("(((")
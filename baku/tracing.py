@@ -0,0 +1,138 @@
+from __future__ import annotations
+import typing as t
+import ast
+import json
+import time
+from collections import deque
+from baku.minieval import (
+    StrictVisitor,
+    ContextProtocol,
+    ContextForEvaluation,
+    Compiled,
+    compile_expr,
+    MAX_RECURSIVE_DEPTH,
+)
+from baku.q import Q
+from baku import vm
+
+
+class TraceEvent(t.NamedTuple):
+    node: str  # ast's node class name (or the opcode name, e.g. "vm:BINOP")
+    depth: int  # (or the size of the stack)
+    elapsed_ns: int  # including children
+    result: str  # type name of the result (e.g. "int", "Q")
+    lineno: int
+    col_offset: int
+
+
+class TracingVisitor(StrictVisitor):
+    """StrictVisitor that records a TraceEvent per node (used only if tracing is requested)"""
+
+    def __init__(self, ctx: ContextProtocol, events: t.Deque[TraceEvent]) -> None:
+        super().__init__(ctx)
+        self.events = events
+        self.depth = 0
+
+    def visit(self, node: ast.AST) -> t.Any:
+        self.depth += 1
+        start = time.perf_counter_ns()
+        try:
+            r = super().visit(node)
+        finally:
+            self.depth -= 1
+        elapsed = time.perf_counter_ns() - start
+
+        top = self.stack[-1]
+        result = top[-1] if top else None
+        self.events.append(
+            TraceEvent(
+                node=node.__class__.__name__,
+                depth=self.depth,
+                elapsed_ns=elapsed,
+                result=type(getattr(result, "val", result)).__name__,
+                lineno=getattr(node, "lineno", 0),
+                col_offset=getattr(node, "col_offset", 0),
+            )
+        )
+        return r
+
+
+def _event(name: str, depth: int, elapsed: int, result: t.Any) -> TraceEvent:
+    return TraceEvent(
+        node=name,
+        depth=depth,
+        elapsed_ns=elapsed,
+        result=type(getattr(result, "val", result)).__name__,
+        lineno=0,  # the instructions have no positions
+        col_offset=0,
+    )
+
+
+def _traced(
+    name: str, handler: vm.Handler, events: t.Deque[TraceEvent], clock: t.List[int]
+) -> vm.Handler:
+    def _handler(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> t.Any:
+        start = time.perf_counter_ns()
+        target = handler(stack, a, b, ctx)
+        clock[0] = end = time.perf_counter_ns()
+        events.append(_event(name, len(stack), end - start, stack[-1]))
+        return target
+
+    return _handler
+
+
+class Tracer:
+    """collect trace events into a ring buffer (the oldest events are dropped)
+
+    deeply nested expressions are traced through baku.vm, an event per instruction
+    (the elapsed time of CALL is the time since the previous instruction).
+    """
+
+    def __init__(self, maxlen: int = 4096) -> None:
+        self.events: t.Deque[TraceEvent] = deque(maxlen=maxlen)
+
+    def run(self, c: Compiled, ctx: ContextProtocol) -> Q:
+        if vm.depth(c.node) > MAX_RECURSIVE_DEPTH:
+            return self.run_program(vm.compile_program(c.node), ctx)
+        v = TracingVisitor(ctx, self.events)
+        v.visit(c.node)
+        return v.stack[-1][-1]  # type: ignore
+
+    def run_program(self, program: vm.Program, ctx: ContextProtocol) -> Q:
+        clock = [time.perf_counter_ns()]
+        handlers = [
+            _traced(f"vm:{name}", handler, self.events, clock)
+            for name, handler in zip(vm.OPNAMES, vm.RUN)
+        ]
+        gen = vm.execute(program.code, handlers, ctx)
+        try:
+            r = gen.send(None)
+            while True:
+                clock[0], start = time.perf_counter_ns(), clock[0]
+                self.events.append(_event("vm:CALL", 0, clock[0] - start, r))
+                r = gen.send(r)
+        except StopIteration as e:
+            return t.cast(Q, e.value)
+
+    def evaluate(
+        self,
+        code_or_compiled: t.Union[str, Compiled],
+        env: t.Optional[t.Dict[str, object]] = None,
+    ) -> object:
+        c = (
+            compile_expr(code_or_compiled)
+            if isinstance(code_or_compiled, str)
+            else code_or_compiled
+        )
+        return self.run(c, ContextForEvaluation(env or {})).val
+
+    def clear(self) -> None:
+        self.events.clear()
+
+    def dump(self) -> t.List[t.Dict[str, t.Any]]:
+        return [ev._asdict() for ev in self.events]
+
+    def dump_jsonl(self, wf: t.IO[str]) -> None:
+        for ev in self.events:
+            wf.write(json.dumps(ev._asdict()))
+            wf.write("\n")
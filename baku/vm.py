@@ -0,0 +1,471 @@
+from __future__ import annotations
+import typing as t
+import sys
+import ast
+from baku.q import QEvaluator, OPERATORS, Q
+from baku.optimize import constant_value
+
+if t.TYPE_CHECKING:
+    from baku.minieval import ContextProtocol
+
+Env = t.Mapping[str, t.Any]
+
+# opcodes, an instruction is a tuple (opcode, a, b)
+CONST = 0  # a=value
+NAME = 1  # a=name
+NAME_REJECT = 2  # a=name (starts with "_", NameError on evaluation)
+BINOP = 3  # a=operator function, b=ast's class name
+BOOL = 4  # a=jump target, b="And" or "Or" (jump if decided, e.g. `False and ...`)
+BOOL_COMBINE = 5  # b="And" or "Or"
+CMP = 6  # a=operator function, b=ast's class name
+CMP_FIRST = 7  # a=(operator function, jump target), b=ast's class name
+CMP_NEXT = 8  # a=(operator function, jump target), b=ast's class name
+CMP_LAST = 9  # a=operator function, b=ast's class name
+SUBSCRIPT = 10
+ATTR = 11  # a=attribute name
+CALL = 12  # a=len(args), b=keyword names
+BUILD_TUPLE = 13  # a=len(elts)
+BUILD_LIST = 14  # a=len(elts)
+BUILD_SET = 15  # a=len(elts)
+BUILD_DICT = 16  # a=len(items)
+
+OPNAMES = (
+    "CONST",
+    "NAME",
+    "NAME_REJECT",
+    "BINOP",
+    "BOOL",
+    "BOOL_COMBINE",
+    "CMP",
+    "CMP_FIRST",
+    "CMP_NEXT",
+    "CMP_LAST",
+    "SUBSCRIPT",
+    "ATTR",
+    "CALL",
+    "BUILD_TUPLE",
+    "BUILD_LIST",
+    "BUILD_SET",
+    "BUILD_DICT",
+)
+
+Instruction = t.Tuple[int, t.Any, t.Any]
+
+
+class _Label:
+    __slots__ = ("pos",)
+
+    def __init__(self) -> None:
+        self.pos = -1
+
+
+class Linearizer:
+    """convert expression to postfix instructions, without recursion (and validate it)"""
+
+    def __init__(self, evaluator: t.Optional[QEvaluator] = None) -> None:
+        self.evaluator = evaluator or QEvaluator()
+
+    def bop(self, op: ast.AST) -> t.Callable[[t.Any, t.Any], t.Any]:
+        name = OPERATORS.get(op.__class__.__name__)
+        if name is None:
+            raise NotImplementedError(op.__class__.__name__)
+        return self.evaluator.bop_mapping[name]
+
+    def linearize(self, node: ast.AST) -> t.List[Instruction]:
+        code: t.List[t.Any] = []
+        # work is a stack of ast nodes, instructions(tuple) and labels
+        work: t.List[t.Any] = [node]
+        while work:
+            x = work.pop()
+            if isinstance(x, tuple):
+                code.append(x)
+            elif isinstance(x, _Label):
+                x.pos = len(code)
+            else:
+                method = getattr(self, "linearize_" + x.__class__.__name__, None)
+                if method is None:
+                    raise NotImplementedError("visit_" + x.__class__.__name__)
+                # pushed in reverse order
+                work.extend(reversed(method(x)))
+
+        def _resolve(a: t.Any) -> t.Any:
+            if isinstance(a, _Label):
+                return a.pos
+            if isinstance(a, tuple) and len(a) == 2 and isinstance(a[1], _Label):
+                return (a[0], a[1].pos)
+            return a
+
+        return [(op, _resolve(a), b) for op, a, b in code]
+
+    def linearize_Expression(self, node: ast.Expression) -> t.List[t.Any]:
+        return [node.body]
+
+    def linearize_Expr(self, node: ast.Expr) -> t.List[t.Any]:
+        return [node.value]
+
+    def linearize_Name(self, node: ast.Name) -> t.List[t.Any]:
+        if node.id.startswith("_"):
+            return [(NAME_REJECT, node.id, None)]
+        return [(NAME, node.id, None)]
+
+    def linearize_Constant(self, node: ast.AST) -> t.List[t.Any]:
+        return [(CONST, constant_value(node), None)]
+
+    # for python < 3.8
+    linearize_NameConstant = linearize_Num = linearize_Str = linearize_Constant
+
+    def linearize_BinOp(self, node: ast.BinOp) -> t.List[t.Any]:
+        fn = self.bop(node.op)
+        return [node.left, node.right, (BINOP, fn, node.op.__class__.__name__)]
+
+    def linearize_BoolOp(self, node: ast.BoolOp) -> t.List[t.Any]:
+        name = node.op.__class__.__name__
+        if name not in ("And", "Or"):
+            raise NotImplementedError(name)
+        end = _Label()
+        r: t.List[t.Any] = [node.values[0]]
+        for v in node.values[1:]:
+            r.append((BOOL, end, name))
+            r.append(v)
+            r.append((BOOL_COMBINE, None, name))
+        r.append(end)
+        return r
+
+    def linearize_Compare(self, node: ast.Compare) -> t.List[t.Any]:
+        assert len(node.ops) == len(node.comparators)
+        pairs = [(self.bop(op), op.__class__.__name__) for op in node.ops]
+        if len(pairs) == 1:
+            fn, name = pairs[0]
+            return [node.left, node.comparators[0], (CMP, fn, name)]
+
+        end = _Label()
+        r: t.List[t.Any] = [node.left]
+        last = len(pairs) - 1
+        for i, ((fn, name), x) in enumerate(zip(pairs, node.comparators)):
+            r.append(x)
+            if i == 0:
+                r.append((CMP_FIRST, (fn, end), name))
+            elif i == last:
+                r.append((CMP_LAST, fn, name))
+            else:
+                r.append((CMP_NEXT, (fn, end), name))
+        r.append(end)
+        return r
+
+    def linearize_Subscript(self, node: ast.Subscript) -> t.List[t.Any]:
+        if sys.version_info < (3, 9):
+            key = node.slice.value  # type: ignore
+        else:
+            key = node.slice
+        return [node.value, key, (SUBSCRIPT, None, None)]
+
+    def linearize_Attribute(self, node: ast.Attribute) -> t.List[t.Any]:
+        if node.attr.startswith("_"):
+            raise AttributeError(node.attr)
+        return [node.value, (ATTR, node.attr, None)]
+
+    def linearize_Call(self, node: ast.Call) -> t.List[t.Any]:
+        names = []
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise NotImplementedError("visit_keyword")
+            names.append(keyword.arg)
+        return [
+            node.func,
+            *node.args,
+            *[keyword.value for keyword in node.keywords],
+            (CALL, len(node.args), tuple(names)),
+        ]
+
+    def linearize_Tuple(self, node: ast.Tuple) -> t.List[t.Any]:
+        return [*node.elts, (BUILD_TUPLE, len(node.elts), None)]
+
+    def linearize_List(self, node: ast.List) -> t.List[t.Any]:
+        return [*node.elts, (BUILD_LIST, len(node.elts), None)]
+
+    def linearize_Set(self, node: ast.Set) -> t.List[t.Any]:
+        return [*node.elts, (BUILD_SET, len(node.elts), None)]
+
+    def linearize_Dict(self, node: ast.Dict) -> t.List[t.Any]:
+        r: t.List[t.Any] = []
+        for k, v in zip(node.keys, node.values):
+            if k is None:
+                raise NotImplementedError("visit_Dict")  # {**d}
+            r.append(k)
+            r.append(v)
+        r.append((BUILD_DICT, len(node.keys), None))
+        return r
+
+
+def _pop_n(stack: t.List[t.Any], n: int) -> t.List[t.Any]:
+    if n == 0:
+        return []
+    xs = stack[-n:]
+    del stack[-n:]
+    return xs
+
+
+# an instruction handler takes (stack, a, b, env or ctx), returns the jump target or None
+Handler = t.Callable[[t.List[t.Any], t.Any, t.Any, t.Any], t.Optional[int]]
+
+
+def execute(
+    code: t.Sequence[Instruction], handlers: t.Sequence[Handler], env: t.Any
+) -> t.Generator[t.Any, t.Any, t.Any]:
+    """the loop shared by the evaluators, CALL is not in handlers
+
+    the result of each CALL is yielded, and the value sent back is pushed instead
+    (e.g. awaited by baku.aio). the value of the expression is returned.
+    """
+    stack: t.List[t.Any] = []
+    n = len(code)
+    pc = 0
+    while pc < n:
+        op, a, b = code[pc]
+        pc += 1
+        if op == CALL:
+            kwvals = _pop_n(stack, len(b))
+            args = _pop_n(stack, a)
+            stack[-1] = yield stack[-1](*args, **dict(zip(b, kwvals)))
+            continue
+        target = handlers[op](stack, a, b, env)
+        if target is not None:
+            pc = target
+    return stack[-1]
+
+
+def drive(gen: t.Generator[t.Any, t.Any, t.Any]) -> t.Any:
+    """run execute(), the results of CALLs are used as is"""
+    try:
+        r = gen.send(None)
+        while True:
+            r = gen.send(r)
+    except StopIteration as e:
+        return e.value
+
+
+# handlers of Program.evaluate(), env is the mapping
+
+
+def _name(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    stack.append(env[a])
+
+
+def _name_reject(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    raise NameError(f"{a!r} is not defined (?)")
+
+
+def _const(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    stack.append(a)
+
+
+def _binop(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    r = stack.pop()
+    stack[-1] = a(stack[-1], r)
+
+
+def _bool(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> t.Optional[int]:
+    # the value is kept if decided, else dropped by BOOL_COMBINE
+    if (not stack[-1]) if b == "And" else stack[-1]:
+        return t.cast(int, a)
+    return None
+
+
+def _bool_combine(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    r = stack.pop()
+    stack[-1] = r
+
+
+def _cmp_chain(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> t.Optional[int]:
+    fn, end = a
+    r = stack.pop()
+    v = fn(stack[-1], r)
+    if not v:
+        stack[-1] = v
+        return t.cast(int, end)
+    stack[-1] = r
+    return None
+
+
+def _subscript(stack: t.List[t.Any], a: t.Any, b: t.Any, env: t.Any) -> None:
+    k = stack.pop()
+    stack[-1] = stack[-1][k]
+
+
+def _attr(stack: t.List[t.Any], a: t.Any, b: t.Any, env: t.Any) -> None:
+    stack[-1] = getattr(stack[-1], a)
+
+
+def _build_tuple(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    stack.append(tuple(_pop_n(stack, a)))
+
+
+def _build_list(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    stack.append(_pop_n(stack, a))
+
+
+def _build_set(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    stack.append(set(_pop_n(stack, a)))
+
+
+def _build_dict(stack: t.List[t.Any], a: t.Any, b: t.Any, env: Env) -> None:
+    xs = _pop_n(stack, a * 2)
+    stack.append(dict(zip(xs[::2], xs[1::2])))
+
+
+def _unknown(stack: t.List[t.Any], a: t.Any, b: t.Any, env: t.Any) -> None:
+    raise RuntimeError("unknown opcode (CALL is executed by the loop)")
+
+
+# indexed by opcode
+EVALUATE: t.Tuple[Handler, ...] = (
+    _const,  # CONST
+    _name,  # NAME
+    _name_reject,  # NAME_REJECT
+    _binop,  # BINOP
+    _bool,  # BOOL
+    _bool_combine,  # BOOL_COMBINE
+    _binop,  # CMP
+    _cmp_chain,  # CMP_FIRST
+    _cmp_chain,  # CMP_NEXT
+    _binop,  # CMP_LAST
+    _subscript,  # SUBSCRIPT
+    _attr,  # ATTR
+    _unknown,  # CALL
+    _build_tuple,  # BUILD_TUPLE
+    _build_list,  # BUILD_LIST
+    _build_set,  # BUILD_SET
+    _build_dict,  # BUILD_DICT
+)
+
+
+# handlers of Program.run(), env is the context (building Q objects)
+
+
+def _ctx_name(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    stack.append(ctx.Name(a))
+
+
+def _ctx_const(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    stack.append(ctx.Value(a))
+
+
+def _ctx_binop(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    r = stack.pop()
+    stack[-1] = getattr(stack[-1], b)(r)
+
+
+def _short_circuit(ctx: t.Any, name: str, v: t.Any) -> bool:
+    # optional, for the contexts not subclassing ContextProtocol (no short-circuit)
+    short_circuit = getattr(ctx, "ShortCircuit", None)
+    return short_circuit is not None and bool(short_circuit(name, v))
+
+
+def _ctx_bool(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> t.Optional[int]:
+    return t.cast(int, a) if _short_circuit(ctx, b, stack[-1]) else None
+
+
+def _ctx_cmp_first(
+    stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any
+) -> t.Optional[int]:
+    r = stack.pop()
+    v = getattr(stack.pop(), b)(r)
+    return _ctx_cmp_chained(stack, a[1], ctx, v, r)
+
+
+def _ctx_cmp_next(
+    stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any
+) -> t.Optional[int]:
+    r = stack.pop()
+    v = getattr(stack.pop(), b)(r)
+    return _ctx_cmp_chained(stack, a[1], ctx, stack.pop().And(v), r)
+
+
+def _ctx_cmp_chained(
+    stack: t.List[t.Any], end: int, ctx: t.Any, v: t.Any, r: t.Any
+) -> t.Optional[int]:
+    # the accumulated value, and the right operand (the left of the next comparison)
+    stack.append(v)
+    if _short_circuit(ctx, "And", v):
+        return end
+    stack.append(r)
+    return None
+
+
+def _ctx_cmp_last(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    r = stack.pop()
+    v = getattr(stack.pop(), b)(r)
+    stack[-1] = stack[-1].And(v)
+
+
+def _ctx_build_tuple(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    stack.append(ctx.Tuple(_pop_n(stack, a)))
+
+
+def _ctx_build_list(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    stack.append(ctx.List(_pop_n(stack, a)))
+
+
+def _ctx_build_set(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    stack.append(ctx.Set(_pop_n(stack, a)))
+
+
+def _ctx_build_dict(stack: t.List[t.Any], a: t.Any, b: t.Any, ctx: t.Any) -> None:
+    xs = _pop_n(stack, a * 2)
+    stack.append(ctx.Dict(xs[::2], xs[1::2]))
+
+
+RUN: t.Tuple[Handler, ...] = (
+    _ctx_const,  # CONST
+    _ctx_name,  # NAME
+    _ctx_name,  # NAME_REJECT
+    _ctx_binop,  # BINOP
+    _ctx_bool,  # BOOL
+    _ctx_binop,  # BOOL_COMBINE
+    _ctx_binop,  # CMP
+    _ctx_cmp_first,  # CMP_FIRST
+    _ctx_cmp_next,  # CMP_NEXT
+    _ctx_cmp_last,  # CMP_LAST
+    _subscript,  # SUBSCRIPT
+    _attr,  # ATTR
+    _unknown,  # CALL
+    _ctx_build_tuple,  # BUILD_TUPLE
+    _ctx_build_list,  # BUILD_LIST
+    _ctx_build_set,  # BUILD_SET
+    _ctx_build_dict,  # BUILD_DICT
+)
+
+
+class Program:
+    """postfix instructions, evaluated with an explicit stack (for deeply nested expressions)"""
+
+    __slots__ = ("code",)
+
+    def __init__(self, code: t.Sequence[Instruction]) -> None:
+        self.code = tuple(code)
+
+    def __call__(self, env: Env) -> t.Any:
+        return self.evaluate(env)
+
+    def evaluate(self, env: Env) -> t.Any:
+        return drive(execute(self.code, EVALUATE, env))
+
+    def run(self, ctx: ContextProtocol) -> Q:
+        """same as StrictVisitor (with ctx), but without recursion"""
+        return t.cast(Q, drive(execute(self.code, RUN, ctx)))
+
+
+def compile_program(node: ast.AST) -> Program:
+    return Program(Linearizer().linearize(node))
+
+
+def depth(node: ast.AST) -> int:
+    """the depth of the tree (without recursion)"""
+    r = 0
+    stack = [(node, 1)]
+    while stack:
+        x, d = stack.pop()
+        if d > r:
+            r = d
+        stack.extend((child, d + 1) for child in ast.iter_child_nodes(x))
+    return r
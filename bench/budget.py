@@ -0,0 +1,54 @@
+"""the overhead of evaluation budgets (closure backend, counted per node)
+
+python bench/budget.py [--json]
+"""
+
+from __future__ import annotations
+import typing as t
+import sys
+import argparse
+from harness import measure, report
+from baku.budget import Budget, BudgetedExpression
+from baku.minieval import compile_expr
+
+ENV = {"x": 10, "y": 0.5, "name": "foo", "d": {"kind": 3, "score": 500}, "f": abs}
+
+EXPRESSIONS: t.Dict[str, str] = {
+    "compare": "x > 5",
+    "arith": "x * 2 + y / 4 - 1",
+    "call": "f(x) + f(y) > 0",
+    "mixed": "0 < x <= 10 and d['score'] + x > 300 and name in ['foo', 'bar']",
+}
+
+BUDGETS: t.Dict[str, Budget] = {
+    "unlimited": Budget(),
+    "limits": Budget(max_visits=1000, max_calls=100, max_size=10_000),
+    "timeout": Budget(max_visits=1000, max_calls=100, max_size=10_000, timeout=1.0),
+}
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, code in EXPRESSIONS.items():
+        c = compile_expr(code, cache=False)
+        results.append(
+            measure("plain", name, lambda c=c: c.evaluate(ENV), calls=100_000)
+        )
+        for label, budget in BUDGETS.items():
+            expr = BudgetedExpression(c, budget)
+            results.append(
+                measure(label, name, lambda e=expr: e.evaluate(ENV), calls=100_000)
+            )
+        if not args.json:
+            print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""deep-expression throughput, recursive backends vs the vm backend
+
+python bench/deep.py
+"""
+
+from __future__ import annotations
+import typing as t
+import ast
+import sys
+import timeit
+from baku.minieval import Compiled, ContextForEvaluation, StrictVisitor
+from baku.closure import compile_closure
+from baku.vm import compile_program
+
+
+def deep(n: int) -> ast.AST:
+    node: ast.AST = ast.Name(id="x", ctx=ast.Load())
+    for _ in range(n):
+        node = ast.BinOp(left=node, op=ast.Add(), right=ast.Constant(value=1))
+    return node
+
+
+def visitor(node: ast.AST) -> t.Callable[[t.Dict[str, t.Any]], t.Any]:
+    def _run(env: t.Dict[str, t.Any]) -> t.Any:
+        v = StrictVisitor(ContextForEvaluation(env))
+        v.visit(node)
+        return v.stack[-1][-1].val
+
+    return _run
+
+
+def bench(fn: t.Callable[[t.Dict[str, t.Any]], t.Any], number: int) -> str:
+    env = {"x": 0}
+    try:
+        sec = min(timeit.repeat(lambda: fn(env), number=number, repeat=3))
+    except RecursionError:
+        return "RecursionError"
+    return f"{number / sec:12.1f} ops/sec"
+
+
+def main() -> None:
+    print(f"recursionlimit={sys.getrecursionlimit()}")
+    for n in [10, 100, 300, 1000, 10000]:
+        node = deep(n)
+        number = max(10, 20000 // n)
+        row = {}
+        for name, factory in [
+            ("visitor", visitor),
+            ("closure", compile_closure),
+            ("vm", compile_program),
+        ]:
+            try:
+                fn = factory(node)
+            except RecursionError:
+                row[name] = "RecursionError"
+                continue
+            row[name] = bench(fn, number)
+
+        c = Compiled("<deep>", node, backend="vm")
+        row["vm(build)"] = bench(lambda env: c.build(), max(1, number // 10))
+        print(f"depth={n:<6}", "  ".join(f"{k}: {v}" for k, v in row.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""measurement helpers for the benchmark scripts in this directory"""
+
+from __future__ import annotations
+import typing as t
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+from dataclasses import dataclass, asdict, field
+
+
+@dataclass
+class Result:
+    name: str
+    group: str
+    calls: int
+    ops_per_sec: float
+    p50_ns: int
+    p90_ns: int
+    p99_ns: int
+    peak_bytes_per_call: int  # by tracemalloc, transient allocations included
+    blocks_per_call: float  # allocated blocks, the difference of tracemalloc snapshots
+    extra: t.Dict[str, t.Any] = field(default_factory=dict)
+
+
+def _percentile(sorted_xs: t.List[int], p: float) -> int:
+    if not sorted_xs:
+        return 0
+    i = min(len(sorted_xs) - 1, int(len(sorted_xs) * p))
+    return sorted_xs[i]
+
+
+def measure(
+    name: str,
+    group: str,
+    fn: t.Callable[[], t.Any],
+    *,
+    calls: int = 1000,
+    warmup: int = 10,
+    alloc_calls: int = 5,
+    **extra: t.Any,
+) -> Result:
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    clock = time.perf_counter_ns
+    total_start = clock()
+    for _ in range(calls):
+        start = clock()
+        fn()
+        latencies.append(clock() - start)
+    total = clock() - total_start
+    latencies.sort()
+
+    peak = 0
+    for _ in range(alloc_calls):
+        tracemalloc.start()
+        try:
+            fn()
+            peak += tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return Result(
+        name=name,
+        group=group,
+        calls=calls,
+        ops_per_sec=calls / (total / 1e9) if total else float("inf"),
+        p50_ns=_percentile(latencies, 0.50),
+        p90_ns=_percentile(latencies, 0.90),
+        p99_ns=_percentile(latencies, 0.99),
+        peak_bytes_per_call=peak // max(alloc_calls, 1),
+        blocks_per_call=_blocks(fn, alloc_calls),
+        extra=extra,
+    )
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+
+
+def _blocks(fn: t.Callable[[], t.Any], calls: int) -> float:
+    """the number of memory blocks allocated (and still alive) per call"""
+    if calls <= 0:
+        return 0.0
+    tracemalloc.start()
+    try:
+        before = _snapshot()
+        for _ in range(calls):
+            fn()
+        after = _snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    return sum(stat.count_diff for stat in diff) / calls
+
+
+def metadata() -> t.Dict[str, t.Any]:
+    try:
+        from importlib.metadata import version
+
+        baku_version = version("baku")
+    except Exception:
+        # not installed, running in the repository
+        path = os.path.join(os.path.dirname(__file__), "..", "VERSION")
+        with open(path) as rf:
+            baku_version = rf.read().strip()
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "baku": baku_version,
+    }
+
+
+def report(
+    results: t.List[Result], *, as_json: bool = False, out: t.TextIO = sys.stdout
+) -> None:
+    if as_json:
+        json.dump(
+            {"metadata": metadata(), "results": [asdict(r) for r in results]},
+            out,
+            indent=2,
+        )
+        out.write("\n")
+        return
+
+    header = f"{'group':<16} {'name':<28} {'ops/sec':>12} {'p50(us)':>9} {'p90(us)':>9} {'p99(us)':>9} {'peak(B)':>9} {'blocks':>8}"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for r in results:
+        print(
+            f"{r.group:<16} {r.name:<28} {r.ops_per_sec:>12.1f} {r.p50_ns / 1000:>9.2f} {r.p90_ns / 1000:>9.2f} {r.p99_ns / 1000:>9.2f} {r.peak_bytes_per_call:>9d} {r.blocks_per_call:>8.1f}",
+            file=out,
+        )
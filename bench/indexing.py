@@ -0,0 +1,65 @@
+"""RuleSet.match() with predicate indexes vs linear scan, by the number of rules
+
+python bench/indexing.py [--json]
+"""
+
+from __future__ import annotations
+import typing as t
+import sys
+import random
+import argparse
+from harness import measure, report
+from baku.rules import RuleSet
+
+
+def generate(n: int, *, seed: int = 0) -> t.Dict[str, str]:
+    rnd = random.Random(seed)
+    rules = {}
+    for i in range(n):
+        kind = rnd.randrange(100)
+        lo = rnd.randrange(0, 1000)
+        x = rnd.random()
+        if x < 0.5:
+            code = f"d['kind'] == 'k{kind}' and d['score'] > {lo}"
+        elif x < 0.8:
+            code = f"d['status'] in ['s{kind}', 's{kind + 1}'] and d['kind'] != 'k0'"
+        elif x < 0.99:
+            code = f"{lo} < d['score'] <= {lo + 10} and d['status'] != 'x'"
+        else:
+            code = f"d['kind'] == 'k{kind}' or d['score'] > {lo}"  # not indexed
+        rules[f"r{i}"] = code
+    return rules
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    args = parser.parse_args(argv)
+
+    env = {"d": {"kind": "k7", "status": "s7", "score": 500}}
+    results = []
+    for n in [100, 1000, 10000]:
+        rules = generate(n)
+        for name, index in [("indexed", True), ("linear", False)]:
+            rs = RuleSet(rules, index=index)
+            calls = max(10, 100_000 // n)
+            results.append(
+                measure(
+                    f"{name}({n})",
+                    "match",
+                    lambda rs=rs: rs.match(env),
+                    calls=calls,
+                    alloc_calls=1,
+                    rules=n,
+                    matched=len(rs.match(env)),
+                )
+            )
+            if not args.json:
+                print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
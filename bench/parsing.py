@@ -0,0 +1,74 @@
+"""cold compile, by stage (ast.parse, validation by StrictVisitor, optimization)
+
+optimize: constant folding of the parsed node, copied (optimize()) or in place
+compile: parse + validation + optimization + closures (compile_expr(cache=False))
+
+python bench/parsing.py [--json] [-n <the number of rules>]
+"""
+
+from __future__ import annotations
+import typing as t
+import ast
+import argparse
+from harness import measure, report
+from indexing import generate
+from baku.minieval import StrictVisitor, ContextForBuilding, compile_expr
+from baku.optimize import optimize
+
+
+def _ast_parse(codes: t.List[str]) -> None:
+    for code in codes:
+        ast.parse(code, mode="eval")
+
+
+def _ast_parse_and_validate(codes: t.List[str]) -> None:
+    for code in codes:
+        StrictVisitor(ContextForBuilding({})).visit(ast.parse(code, mode="eval").body)
+
+
+def _optimize(codes: t.List[str], *, inplace: bool) -> None:
+    for code in codes:
+        optimize(ast.parse(code, mode="eval").body, inplace=inplace)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    parser.add_argument("-n", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    codes = list(generate(args.n).values())
+    size = sum(len(code) for code in codes)
+    options = {
+        "calls": 5,
+        "warmup": 1,
+        "alloc_calls": 0,
+        "rules": args.n,
+        "bytes": size,
+    }
+    results = [
+        measure("ast.parse", "parse", lambda: _ast_parse(codes), **options),
+        measure(
+            "ast.parse+validate",
+            "parse",
+            lambda: _ast_parse_and_validate(codes),
+            **options,
+        ),
+        measure(
+            "copied", "optimize", lambda: _optimize(codes, inplace=False), **options
+        ),
+        measure(
+            "in place", "optimize", lambda: _optimize(codes, inplace=True), **options
+        ),
+        measure(
+            "compile_expr",
+            "compile",
+            lambda: [compile_expr(code, cache=False) for code in codes],
+            **options,
+        ),
+    ]
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""startup (compiling 10k rules), with and without the on-disk store
+
+python bench/startup.py [--json] [-n <the number of rules>]
+"""
+
+from __future__ import annotations
+import typing as t
+import os
+import sys
+import argparse
+import tempfile
+from harness import measure, report
+from indexing import generate
+from baku.minieval import compile_expr
+from baku.rules import RuleSet
+from baku.store import Store
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    parser.add_argument("-n", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    rules = generate(args.n)
+    codes = list(rules.values())
+    options = {"calls": 3, "warmup": 1, "alloc_calls": 0, "rules": args.n}
+
+    with tempfile.TemporaryDirectory() as d:
+        store = Store(d)
+        store.compile_many(codes)
+        store.save()
+        size = os.path.getsize(store.path)
+
+        def _load() -> Store:
+            store = Store(d)
+            store.load()
+            return store
+
+        def _compile_stored() -> t.Any:
+            store = _load()
+            return store.compile_many(codes)
+
+        def _compile_stored_fn() -> t.Any:
+            # the closures are compiled on the first use
+            return [c.fn for c in _compile_stored()]
+
+        def _ruleset_stored() -> t.Any:
+            return RuleSet(rules, store=_load())
+
+        results = [
+            measure(
+                "parse",
+                "compile",
+                lambda: [compile_expr(code, cache=False) for code in codes],
+                **options,
+            ),
+            measure("store", "compile", _compile_stored, **options),
+            measure("store (+fn)", "compile", _compile_stored_fn, **options),
+            measure("load only", "compile", _load, bytes=size, **options),
+            measure("parse", "RuleSet", lambda: RuleSet(rules), **options),
+            measure("store", "RuleSet", _ruleset_stored, **options),
+        ]
+        if not args.json:
+            print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""benchmark suite for parse, evaluate and build paths
+
+python bench/suite.py [--json] [-k <substring>] [--quick]
+(or `make bench`, `make bench-json`)
+"""
+
+from __future__ import annotations
+import typing as t
+import argparse
+import sys
+from functools import partial
+from harness import measure, report
+
+from baku.minieval import (
+    compile_expr,
+    literal_eval_plus,
+    cache_clear,
+    ContextForEvaluation,
+)
+from baku.batch import evaluate_batch, np
+from baku.rules import RuleSet
+
+
+class Ob:
+    x = 10
+    name = "foo/bar"
+
+
+EXPRESSIONS: t.Dict[str, t.Tuple[str, t.Dict[str, t.Any]]] = {
+    "small": ("x + 1", {"x": 10}),
+    "medium": (
+        "0 < x <= 10 and d['kind'] in ['a', 'b', 'c'] and ob.name.startswith('foo')",
+        {"x": 10, "d": {"kind": "b"}, "ob": Ob},
+    ),
+    "wide": (" or ".join(f"x == {i}" for i in range(200)), {"x": 199}),
+    "deep": ("x" + " + 1" * 300, {"x": 0}),
+}
+
+
+class Case(t.NamedTuple):
+    group: str
+    name: str
+    fn: t.Callable[[], t.Any]
+    options: t.Dict[str, t.Any]
+
+
+def _cold(code: str, env: t.Dict[str, t.Any]) -> t.Callable[[], t.Any]:
+    def _run() -> t.Any:
+        cache_clear()
+        return literal_eval_plus(code, env=env)
+
+    return _run
+
+
+def cases(quick: bool = False) -> t.Iterator[Case]:
+    n = 200 if quick else 2000
+
+    for size, (code, env) in EXPRESSIONS.items():
+        # parse + validation + compilation, every time
+        yield Case(
+            "compile(cold)",
+            size,
+            partial(compile_expr, code, cache=False),
+            {"calls": n // 10},
+        )
+        yield Case("eval(cold)", size, _cold(code, env), {"calls": n // 10})
+        yield Case(
+            "eval(cached)",
+            size,
+            partial(literal_eval_plus, code, env=env),
+            {"calls": n},
+        )
+
+        c = compile_expr(code)
+        if c.backend != "vm":
+            yield Case(
+                "eval(visitor)",
+                size,
+                lambda c=c, env=env: c.run(ContextForEvaluation(env)).val,
+                {"calls": n // 10},
+            )
+        for backend in ["closure", "sealed", "vm", "cse"]:
+            bc = compile_expr(code, backend=backend)
+            if bc.backend != backend:
+                continue  # too deep, compiled with vm
+            yield Case(
+                f"eval({backend})", size, partial(bc.evaluate, env), {"calls": n}
+            )
+        yield Case("build", size, c.build, {"calls": n // 10})
+
+    # batch evaluation (vs per-row literal_eval_plus)
+    rows = 1000 if quick else 100_000
+    columns = {"x": list(range(rows)), "y": ["a", "b", "c", "d"] * (rows // 4)}
+    code = "0 < x <= 10000 and y in {'a', 'c'}"
+    options = {"calls": 5, "warmup": 1, "alloc_calls": 1, "rows": rows}
+    yield Case(
+        "batch",
+        "python",
+        partial(evaluate_batch, code, columns, use_numpy=False),
+        options,
+    )
+    if np is not None:
+        yield Case(
+            "batch",
+            "numpy",
+            partial(evaluate_batch, code, columns, use_numpy=True),
+            options,
+        )
+    yield Case(
+        "batch",
+        "loop",
+        lambda: [
+            literal_eval_plus(code, env={"x": x, "y": y})
+            for x, y in zip(columns["x"], columns["y"])
+        ],
+        options,
+    )
+
+    # many rules against the same env (vs per-rule evaluation)
+    rules = {
+        f"r{i}": f"d['kind'] == 'k{i % 20}' and d['status'] in ['a', 'b'] and 0 < d['score'] <= {i}"
+        for i in range(50 if quick else 500)
+    }
+    env = {"d": {"kind": "k3", "status": "a", "score": 100}}
+    options = {"calls": n // 10, "rules": len(rules)}
+    rs = RuleSet(rules)
+    yield Case("ruleset", "match", partial(rs.match, env), options)
+    compiled = [(k, compile_expr(code, cache=False)) for k, code in rules.items()]
+    yield Case(
+        "ruleset",
+        "loop",
+        lambda: [k for k, c in compiled if c.evaluate(env)],
+        options,
+    )
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    parser.add_argument(
+        "-k", dest="keyword", help="run only cases matching (group or name)"
+    )
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    args = parser.parse_args(argv)
+
+    results = []
+    for case in cases(args.quick):
+        if args.keyword and args.keyword not in f"{case.group} {case.name}":
+            continue
+        results.append(measure(case.name, case.group, case.fn, **case.options))
+        if not args.json:
+            print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""concurrent evaluation of shared compiled expressions, with ThreadPoolExecutor
+
+the throughput (all threads) relative to the single-thread loop,
+and the results are checked against the single-thread ones.
+
+python bench/threads.py [--json]
+"""
+
+from __future__ import annotations
+import typing as t
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from harness import measure, report
+from baku.minieval import compile_expr
+
+CODE = "0 < d['x'] <= 10000 and d['kind'] in ['a', 'c'] and d['x'] * 2 + 1 != 7"
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    args = parser.parse_args(argv)
+
+    envs = [{"d": {"x": i, "kind": "abcd"[i % 4]}} for i in range(10_000)]
+    results = []
+    for backend in ["closure", "vm", "cse"]:
+        c = compile_expr(CODE, backend=backend)
+        expected = [c.evaluate(env) for env in envs]
+
+        def _serial() -> t.List[object]:
+            return [c.evaluate(env) for env in envs]
+
+        results.append(measure("serial", backend, _serial, calls=10, alloc_calls=1))
+        for workers in [1, 2, 4, 8]:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                n = len(envs) // workers
+
+                def _chunk(i: int) -> t.List[object]:
+                    return [c.evaluate(env) for env in envs[i * n : (i + 1) * n]]
+
+                def _threads() -> t.List[object]:
+                    r: t.List[object] = []
+                    for xs in ex.map(_chunk, range(workers)):
+                        r.extend(xs)
+                    return r
+
+                assert _threads() == expected[: n * workers], "inconsistent results"
+                results.append(
+                    measure(
+                        f"threads({workers})",
+                        backend,
+                        _threads,
+                        calls=10,
+                        alloc_calls=1,
+                        workers=workers,
+                    )
+                )
+        if not args.json:
+            print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""evaluation with/without the env schema (closure backend, specialized by the types)
+
+python bench/typed.py [--json]
+"""
+
+from __future__ import annotations
+import typing as t
+import sys
+import argparse
+from harness import measure, report
+from baku.minieval import compile_expr
+
+SCHEMA = {"x": int, "y": float, "name": str, "d": t.Dict[str, int]}
+ENV = {"x": 10, "y": 0.5, "name": "foo", "d": {"kind": 3, "score": 500}}
+
+EXPRESSIONS: t.Dict[str, str] = {
+    "compare": "x > 5",
+    "arith": "x * 2 + y / 4 - 1",
+    "item": "d['score'] >= 100",
+    "in": "d['kind'] in [1, 2, 3] and name != 'bar'",
+    "mixed": "0 < x <= 10 and d['score'] + x > 300 and name in ['foo', 'bar']",
+}
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="output as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, code in EXPRESSIONS.items():
+        for label, schema in [("generic", None), ("typed", SCHEMA)]:
+            c = compile_expr(code, schema=schema, cache=False)
+            results.append(
+                measure(
+                    label,
+                    name,
+                    lambda c=c: c.fn(ENV),
+                    calls=100_000,
+                    result=c.fn(ENV),
+                )
+            )
+            if not args.json:
+                print(".", end="", file=sys.stderr, flush=True)
+    if not args.json:
+        print("", file=sys.stderr)
+    report(results, as_json=args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from setuptools import setup, find_packages
 install_requires = ["typing_extensions"]
 dev_requires = ["black", "flake8", "mypy"]
 tests_requires = ["pytest"]
+numpy_requires = ["numpy"]
 
 setup(
     classifiers=[
@@ -18,7 +19,11 @@ setup(
     python_requires=">=3.7",
     packages=find_packages(exclude=["baku.tests"]),
     install_requires=install_requires,
-    extras_require={"testing": tests_requires, "dev": dev_requires},
+    extras_require={
+        "testing": tests_requires,
+        "dev": dev_requires,
+        "numpy": numpy_requires,
+    },
     tests_require=tests_requires,
     test_suite="baku.tests",
     #     entry_points="""